@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Настройки кэша (можно переопределить через .env)
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(6 * 3600)))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2000"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+AI_CACHE_DB = os.getenv("AI_CACHE_DB", "")  # путь к SQLite-файлу; пусто — только память
+AI_CACHE_DB_MAX_ROWS = int(os.getenv("AI_CACHE_DB_MAX_ROWS", "50000"))  # строк на пространство имён в SQLite
+AI_CACHE_SWEEP_EVERY = int(os.getenv("AI_CACHE_SWEEP_EVERY", "200"))  # чистка просроченных раз в N записей
+
+_MISS = object()
+_SPACES = re.compile(r"\s+")
+
+def normalize_prompt(text: str) -> str:
+    """
+    Приводит запрос к каноничному виду: регистр, лишние пробелы и переносы не влияют на ключ.
+    """
+    return _SPACES.sub(" ", text or "").strip().lower()
+
+def make_key(*parts) -> str:
+    payload = "\x1f".join(normalize_prompt(str(p)) for p in parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Кэш ответов: LRU в памяти с ограничением по числу записей и объёму,
+    TTL на запись и необязательный постоянный уровень в SQLite.
+    Одновременные промахи по одному ключу ждут одно общее вычисление.
+
+    SQLite-уровень держит одно соединение на кэш. Просроченная строка удаляется, когда на неё
+    попадает чтение, а раз в AI_CACHE_SWEEP_EVERY записей удаляются все просроченные
+    и самые старые сверх max_db_rows, чтобы файл не рос без ограничений.
+    """
+
+    def __init__(self, namespace: str, ttl: int, max_entries: int = AI_CACHE_MAX_ENTRIES,
+                 max_bytes: int = AI_CACHE_MAX_BYTES, db_path: str = AI_CACHE_DB,
+                 max_db_rows: int = AI_CACHE_DB_MAX_ROWS, sweep_every: int = AI_CACHE_SWEEP_EVERY):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.max_db_rows = max_db_rows
+        self.sweep_every = sweep_every
+        self._conn = None
+        self._conn_lock = threading.Lock()  # соединение используется из потоков asyncio.to_thread
+        self._writes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "db_hits": 0, "coalesced": 0, "evictions": 0}
+
+    # --- память ---
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISS
+        expires_at, value, _ = entry
+        if expires_at < time.time():
+            self._drop(key)
+            return _MISS
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key, value, expires_at):
+        size = len(json.dumps(value, ensure_ascii=False))
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    # --- SQLite ---
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_cache_expires_at ON ai_cache (expires_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _db_key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _db_get(self, key):
+        with self._conn_lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, expires_at FROM ai_cache WHERE key = ?", (self._db_key(key),)).fetchone()
+            if row is None:
+                return _MISS, 0
+            if row[1] < time.time():
+                conn.execute("DELETE FROM ai_cache WHERE key = ?", (self._db_key(key),))
+                conn.commit()
+                return _MISS, 0
+        return json.loads(row[0]), row[1]
+
+    def _db_set(self, key, value, expires_at):
+        with self._conn_lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (self._db_key(key), json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                self._sweep(conn)
+            conn.commit()
+
+    def _sweep(self, conn):
+        """
+        Удаляет просроченные строки и самые старые строки этого пространства имён сверх max_db_rows.
+        """
+        conn.execute("DELETE FROM ai_cache WHERE expires_at < ?", (time.time(),))
+        # Ключи пространства имён — диапазон «namespace:» .. «namespace;» по первичному ключу
+        bounds = (f"{self.namespace}:", f"{self.namespace};")
+        count = conn.execute("SELECT COUNT(*) FROM ai_cache WHERE key >= ? AND key < ?", bounds).fetchone()[0]
+        if count > self.max_db_rows:
+            conn.execute(
+                "DELETE FROM ai_cache WHERE key IN ("
+                "SELECT key FROM ai_cache WHERE key >= ? AND key < ? ORDER BY expires_at LIMIT ?)",
+                (*bounds, count - self.max_db_rows)
+            )
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- публичный интерфейс ---
+
+    async def get(self, key):
+        value = self._get_memory(key)
+        if value is not _MISS:
+            self.stats["hits"] += 1
+            return value
+        if self.db_path:
+            value, expires_at = await asyncio.to_thread(self._db_get, key)
+            if value is not _MISS:
+                self.stats["db_hits"] += 1
+                self._put_memory(key, value, expires_at)
+                return value
+        self.stats["misses"] += 1
+        return _MISS
+
+    async def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, value, expires_at)
+        if self.db_path:
+            await asyncio.to_thread(self._db_set, key, value, expires_at)
+
+    async def lookup(self, key, default=None):
+        value = await self.get(key)
+        return default if value is _MISS else value
+
+    def inflight(self, key):
+        """
+        Уже идущее вычисление этого ключа (задача) или None.
+        """
+        return self._inflight.get(key)
+
+    async def get_or_compute(self, key, factory, should_cache=None):
+        """
+        Возвращает значение из кэша или вычисляет его через factory().
+        should_cache(value) позволяет не кэшировать неудачные ответы.
+        """
+        value = await self.get(key)
+        if value is not _MISS:
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._compute(key, factory, should_cache))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, factory, should_cache):
+        try:
+            value = await factory()
+            if should_cache is None or should_cache(value):
+                await self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["entries"] = len(self._entries)
+        stats["bytes"] = self._bytes
+        total = stats["hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["db_hits"]) / total if total else 0.0
+        return stats
+
+answer_cache = ResponseCache("answer", AI_CACHE_TTL)
+search_cache = ResponseCache("search", SEARCH_CACHE_TTL)
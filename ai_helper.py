@@ -1,62 +1,128 @@
 import os
 import json
 import asyncio
-from duckduckgo_search import DDGS
-import google.generativeai as genai
+import logging
+from llm_client import LLMError, build_default_client
+from ai_cache import answer_cache, search_cache, make_key
+from search_backend import DDGSSearchBackend
 
-# Настройка ключей
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
 
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-    except Exception as e:
-        print(f"Ошибка настройки Gemini: {e}")
-        gemini_model = None
-else:
-    gemini_model = None
+# Общий дедлайн на поиск материалов, секунды
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "6"))
+
+# Клиент создаётся при первом запросе: к этому моменту main уже загрузил .env
+_llm = None
+
+def get_llm_client():
+    global _llm
+    if _llm is None:
+        _llm = build_default_client()
+    return _llm
+
+def set_llm_client(client):
+    """
+    Подмена клиента (например, на FakeProvider в тестах).
+    """
+    global _llm
+    _llm = client
+
+_search_backend = DDGSSearchBackend()
+
+def get_search_backend():
+    return _search_backend
+
+def set_search_backend(backend):
+    """
+    Подмена поискового бэкенда (например, на StubSearchBackend в тестах).
+    """
+    global _search_backend
+    _search_backend = backend
 
 async def search_educational_resources(query: str):
     """
-    Выполняет поиск реальных образовательных ресурсов.
+    Выполняет поиск реальных образовательных ресурсов (с кэшем по нормализованному запросу).
+    Неполные результаты (истёк дедлайн или упал подзапрос) не кэшируются.
     """
-    results = []
+    partial = []
+
+    async def compute():
+        results, is_partial = await _search_educational_resources(query)
+        partial.append(is_partial)
+        return results
+
+    return await search_cache.get_or_compute(
+        make_key(query),
+        compute,
+        should_cache=lambda results: bool(results) and not partial[0]
+    )
+
+async def _search_educational_resources(query: str):
+    """
+    (результаты, неполные ли они).
+    """
+    # Подзапросы и их вес при ранжировании (VK-видео в приоритете)
+    search_queries = [
+        (f"site:vk.com/video {query}", 3.0),
+        (f"{query} образовательный материал", 2.0),
+        (f"{query} урок видео", 1.0)
+    ]
+    backend = get_search_backend()
+    futures = {
+        asyncio.ensure_future(backend.search(sq, max_results=2)): weight
+        for sq, weight in search_queries
+    }
+    ranked = {}  # ссылка -> [очки, порядок появления, результат]
+    partial = False
+
+    async def collect(fut):
+        return futures[fut], await fut
+
     try:
-        ddgs = DDGS()
-        search_queries = [
-            f"site:vk.com/video {query}",
-            f"{query} образовательный материал",
-            f"{query} урок видео"
-        ]
-        
-        for sq in search_queries:
+        # Общий дедлайн на все подзапросы: медленный подзапрос не задерживает остальные
+        for next_done in asyncio.as_completed([collect(f) for f in futures], timeout=SEARCH_DEADLINE):
             try:
-                # Ограничиваем время поиска
-                search_results = list(ddgs.text(sq, max_results=2))
-                for r in search_results:
-                    results.append({"title": r['title'], "link": r['href']})
+                weight, search_results = await next_done
+            except asyncio.TimeoutError:
+                raise
             except Exception as e:
-                print(f"Search sub-query error: {e}")
-        
-        # Убираем дубликаты
-        unique_results = []
-        seen_links = set()
-        for r in results:
-            if r['link'] not in seen_links:
-                unique_results.append(r)
-                seen_links.add(r['link'])
-        return unique_results[:5]
-                
-    except Exception as e:
-        print(f"Global search error: {e}")
-        
-    return results
+                logger.warning(f"Search sub-query error: {e}")
+                partial = True
+                continue
+            # Убираем дубликаты и ранжируем по мере поступления
+            for pos, r in enumerate(search_results):
+                entry = ranked.setdefault(r['link'], [0.0, len(ranked), r])
+                entry[0] += weight / (pos + 1)
+    except asyncio.TimeoutError:
+        logger.warning(f"Search deadline {SEARCH_DEADLINE}s exceeded, returning {len(ranked)} partial results")
+        partial = True
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+    ordered = sorted(ranked.values(), key=lambda e: (-e[0], e[1]))
+    return [e[2] for e in ordered[:5]], partial
+
+def is_good_answer(answer: str) -> bool:
+    return bool(answer) and not answer.startswith("❌")
 
 async def solve_problem(query: str, system_prompt: str = "Ты — помощник в учебе. Отвечай на русском языке."):
     """
-    Основная функция для решения задач.
+    Основная функция для решения задач. Одинаковые запросы (с точностью до регистра и пробелов)
+    берутся из кэша, ошибки не кэшируются.
+    """
+    return await answer_cache.get_or_compute(
+        make_key(system_prompt, query),
+        lambda: _solve_problem(query, system_prompt),
+        should_cache=is_good_answer
+    )
+
+def get_cache_stats():
+    return {"answers": answer_cache.get_stats(), "search": search_cache.get_stats()}
+
+async def _build_prompt(query: str) -> str:
+    """
+    Для запросов материалов добавляет к вопросу реальные найденные ссылки.
     """
     is_material_request = any(word in query.lower() for word in ["ссылки", "материалы", "видео", "почитать", "изучить"])
     
@@ -65,11 +131,9 @@ async def solve_problem(query: str, system_prompt: str = "Ты — помощн
     if is_material_request:
         # Извлекаем тему для поиска
         topic = query
-        if gemini_model:
-            try:
-                topic_resp = gemini_model.generate_content(f"Извлеки только тему (2-3 слова) из запроса: {query}")
-                topic = topic_resp.text.strip()
-            except: pass
+        try:
+            topic = (await get_llm_client().complete("", f"Извлеки только тему (2-3 слова) из запроса: {query}")).strip()
+        except LLMError: pass
         
         real_links = await search_educational_resources(topic)
         if real_links:
@@ -77,30 +141,71 @@ async def solve_problem(query: str, system_prompt: str = "Ты — помощн
             context_info = f"\n\nВот реальные найденные ссылки:\n{links_str}\n\nИспользуй их в ответе."
         else:
             context_info = "\n\n(Реальных ссылок не найдено, дай общие рекомендации)."
+    return query + context_info
+
+def _error_message(e: LLMError) -> str:
+    err_msg = str(e)
+    if "402" in err_msg or "credits" in err_msg:
+        return "❌ Ошибка: На балансе OpenAI закончились средства. Пожалуйста, добавьте GEMINI_API_KEY в файл .env для бесплатной работы."
+    return f"❌ Ошибка AI: {err_msg[:100]}"
 
-    # Попытка вызвать AI
+async def _solve_problem(query: str, system_prompt: str):
+    prompt = await _build_prompt(query)
+    # Попытка вызвать AI (Gemini, при ошибке — OpenAI)
     try:
-        full_prompt = f"{system_prompt}\n\nПользователь: {query}{context_info}"
-        
-        # 1. Пробуем Gemini если есть ключ
-        if gemini_model:
-            response = gemini_model.generate_content(full_prompt)
-            return response.text
-
-        # 2. Пробуем OpenAI (системный Manus или пользовательский)
-        from openai import OpenAI
-        client = OpenAI() # Использует ключ из окружения
-        resp = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": query + context_info}
-            ]
-        )
-        return resp.choices[0].message.content
-        
-    except Exception as e:
-        err_msg = str(e)
-        if "402" in err_msg or "credits" in err_msg:
-            return "❌ Ошибка: На балансе OpenAI закончились средства. Пожалуйста, добавьте GEMINI_API_KEY в файл .env для бесплатной работы."
-        return f"❌ Ошибка AI: {err_msg[:100]}"
+        return await get_llm_client().complete(system_prompt, prompt)
+    except LLMError as e:
+        return _error_message(e)
+
+async def stream_solution(query: str, system_prompt: str = "Ты — помощник в учебе. Отвечай на русском языке."):
+    """
+    Потоковый вариант solve_problem: отдаёт ответ кусками по мере генерации.
+    Ответ из кэша (или уже вычисляемый для такого же вопроса) отдаётся одним куском;
+    полный удачный ответ сохраняется в кэш.
+    """
+    key = make_key(system_prompt, query)
+    cached = await answer_cache.lookup(key)
+    if cached is not None:
+        yield cached
+        return
+    inflight = answer_cache.inflight(key)
+    if inflight is not None:
+        yield await asyncio.shield(inflight)
+        return
+
+    prompt = await _build_prompt(query)
+    parts = []
+    try:
+        async for chunk in get_llm_client().stream(system_prompt, prompt):
+            parts.append(chunk)
+            yield chunk
+    except LLMError as e:
+        # Ошибка после начала ответа — дописываем её к уже показанному тексту
+        yield ("\n\n" if parts else "") + _error_message(e)
+        return
+    answer = "".join(parts)
+    if is_good_answer(answer):
+        await answer_cache.set(key, answer)
+
+# --- Артефакты задания (план, материалы, сложность) ---
+
+def task_text(subject: str, description: str) -> str:
+    return f"{subject}: {description}"
+
+async def get_task_steps(text: str):
+    prompt = f"Разбей на конкретные шаги выполнение этого задания: {text}. Используй эмодзи."
+    return await solve_problem(prompt, system_prompt="Ты — эксперт-репетитор.")
+
+async def get_task_materials(text: str):
+    prompt = f"Найди реальные ссылки на материалы (видео VK и статьи) по теме: {text}. Не выдумывай ссылки!"
+    return await solve_problem(prompt, system_prompt="Ты — эксперт по поиску образовательного контента.")
+
+async def get_task_difficulty(subject: str, description: str):
+    prompt = f"Определи сложность задания (easy, normal, hard) одним словом: {subject} - {description}"
+    diff_res = await solve_problem(prompt, system_prompt="Отвечай только одним словом: easy, normal или hard")
+    # Ошибка AI — не ответ: None, чтобы не записать её как «normal»
+    if not is_good_answer(diff_res):
+        return None
+    difficulty = diff_res.lower().strip() if diff_res else "normal"
+    if difficulty not in ['easy', 'normal', 'hard']: difficulty = 'normal'
+    return difficulty
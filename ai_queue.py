@@ -0,0 +1,214 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+
+logger = logging.getLogger(__name__)
+
+# Настройки очереди AI-запросов (можно переопределить через .env)
+AI_QUEUE_CONCURRENCY = int(os.getenv("AI_QUEUE_CONCURRENCY", "6"))  # одновременно выполняемых задач
+AI_QUEUE_MAX_PENDING = int(os.getenv("AI_QUEUE_MAX_PENDING", "200"))  # ожидающих задач, дальше — отказ
+AI_QUEUE_MAX_WAIT = float(os.getenv("AI_QUEUE_MAX_WAIT", "120"))  # сколько интерактивный запрос может ждать старта
+AI_QUEUE_POSITION_INTERVAL = float(os.getenv("AI_QUEUE_POSITION_INTERVAL", "3"))
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class QueueFull(Exception):
+    """
+    Очередь переполнена, запрос не принят.
+    """
+
+class JobCancelled(Exception):
+    """
+    Задача снята: пользователь задал новый вопрос или истёк срок ожидания.
+    """
+
+class AIJob:
+    def __init__(self, queue, owner, factory, priority: int, deadline, key):
+        self.queue = queue
+        self.owner = owner
+        self.factory = factory
+        self.priority = priority
+        self.deadline = deadline
+        self.key = key
+        self.task = None
+        self.future = asyncio.get_running_loop().create_future()
+        # Результат фоновых задач никто не ждёт — помечаем исключение как обработанное
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    @property
+    def started(self) -> bool:
+        return self.task is not None
+
+    def cancel(self, reason: str = "заменён новым вопросом"):
+        if self.future.done():
+            return
+        if not self.started:
+            self.queue._waiting -= 1
+        self.future.set_exception(JobCancelled(reason))
+        if self.task:
+            self.task.cancel()
+
+    async def result(self, on_position=None, interval: float = AI_QUEUE_POSITION_INTERVAL):
+        """
+        Ждёт результат. Пока задача стоит в очереди, вызывает on_position(позиция),
+        когда позиция меняется.
+        """
+        shown = None
+        while not self.future.done():
+            if on_position and not self.started:
+                position = self.queue.position(self)
+                if position and position != shown:
+                    shown = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.warning(f"Queue position update failed: {e}")
+            await asyncio.wait({self.future}, timeout=None if self.started else interval)
+        return self.future.result()
+
+class AIQueue:
+    """
+    Очередь обращений к LLM с ограниченным числом одновременных задач.
+    Интерактивные вопросы идут раньше фоновых; внутри приоритета пользователи чередуются
+    (справедливая очередь по виртуальному времени), поэтому один ученик с десятком задач
+    не задерживает остальных. Новый вопрос пользователя снимает его предыдущий.
+    """
+
+    def __init__(self, concurrency: int = AI_QUEUE_CONCURRENCY, max_pending: int = AI_QUEUE_MAX_PENDING,
+                 max_wait: float = AI_QUEUE_MAX_WAIT):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self._heap = []
+        self._seq = itertools.count()
+        self._vtime = 0
+        self._owner_tags = {}
+        self._latest = {}  # владелец -> последняя интерактивная задача
+        self._ready = None
+        self._workers = []
+        self._waiting = 0
+        self.running = 0
+        self.stats = {"done": 0, "failed": 0, "cancelled": 0, "expired": 0, "rejected": 0}
+
+    def start(self):
+        if not self._workers:
+            self._ready = asyncio.Semaphore(0)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, owner, factory, priority: int = INTERACTIVE, replace: bool = True) -> AIJob:
+        """
+        Ставит в очередь factory() — функцию без аргументов, возвращающую корутину.
+        Фоновым задачам оставлена только половина очереди, чтобы не вытеснять вопросы учеников.
+        """
+        limit = self.max_pending if priority == INTERACTIVE else self.max_pending // 2
+        if self._waiting >= limit:
+            self.stats["rejected"] += 1
+            raise QueueFull()
+
+        if priority == INTERACTIVE and replace:
+            previous = self._latest.get(owner)
+            if previous and not previous.future.done():
+                previous.cancel()
+                self.stats["cancelled"] += 1
+
+        tag = max(self._vtime, self._owner_tags.get(owner, 0)) + 1
+        self._owner_tags[owner] = tag
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait if priority == INTERACTIVE else None
+        job = AIJob(self, owner, factory, priority, deadline, (priority, tag, next(self._seq)))
+        if priority == INTERACTIVE:
+            self._latest[owner] = job
+
+        heapq.heappush(self._heap, job)
+        self._waiting += 1
+        self.start()
+        self._ready.release()
+        return job
+
+    def promote(self, job: AIJob, owner, priority: int = INTERACTIVE) -> bool:
+        """
+        Поднимает ожидающую задачу до priority от имени owner: например, ученик нажал кнопку,
+        пока фоновая генерация для этого задания ещё стоит в очереди. Вместо второго обращения
+        к LLM он ждёт ту же задачу. Возвращает False, если задача уже запущена или завершена.
+        """
+        if job.started or job.future.done():
+            return False
+        if job.priority <= priority:
+            return True
+        tag = max(self._vtime, self._owner_tags.get(owner, 0)) + 1
+        self._owner_tags[owner] = tag
+        job.priority = priority
+        job.key = (priority, tag, next(self._seq))
+        heapq.heapify(self._heap)
+        return True
+
+    def position(self, job: AIJob) -> int:
+        """
+        Сколько ожидающих задач будет запущено раньше этой (0 — уже выполняется).
+        """
+        if job.started or job.future.done():
+            return 0
+        return sum(1 for other in self._heap if other.key < job.key and not other.future.done()) + 1
+
+    def pending(self) -> int:
+        return self._waiting
+
+    def get_stats(self):
+        return dict(self.stats, waiting=self._waiting, running=self.running)
+
+    def _pop(self):
+        job = heapq.heappop(self._heap)
+        self._vtime = max(self._vtime, job.key[1])
+        if len(self._owner_tags) > 10000:
+            self._owner_tags = {o: t for o, t in self._owner_tags.items() if t > self._vtime}
+        return job
+
+    def _forget(self, job: AIJob):
+        if self._latest.get(job.owner) is job:
+            del self._latest[job.owner]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.acquire()
+            job = self._pop()
+            if not job.future.done() and job.deadline is not None and loop.time() > job.deadline:
+                job.cancel("истекло время ожидания")
+                self.stats["expired"] += 1
+            if job.future.done():
+                self._forget(job)
+                continue
+            self._waiting -= 1
+            job.task = asyncio.create_task(job.factory())
+            self.running += 1
+            try:
+                await asyncio.wait({job.task})
+            finally:
+                self.running -= 1
+                self._forget(job)
+            if job.future.done():
+                job.task.cancelled() or job.task.exception()
+                continue
+            if job.task.cancelled():
+                job.future.set_exception(JobCancelled("отменено"))
+            elif job.task.exception():
+                self.stats["failed"] += 1
+                job.future.set_exception(job.task.exception())
+            else:
+                self.stats["done"] += 1
+                job.future.set_result(job.task.result())
+
+ai_queue = AIQueue()
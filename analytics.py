@@ -0,0 +1,288 @@
+"""
+Аналитика настроения и нагрузки для учителей.
+
+Записи настроения и дедлайны заданий забираются из БД одним запросом каждое,
+а дальше всё считается матрицами numpy «класс × день» и «ученик × день»:
+скользящие средние нагрузки, тренд, плотность дедлайнов, всплески стресса
+и их связь с объёмом домашки. Отчёт кэшируется, пока не появятся новые записи.
+"""
+import os
+import time
+import asyncio
+import logging
+import datetime
+import warnings
+
+import numpy as np
+
+import db_helper
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", "28"))  # сколько дней истории смотрим
+ANALYTICS_AHEAD_DAYS = int(os.getenv("ANALYTICS_AHEAD_DAYS", "14"))  # сколько дней дедлайнов вперёд
+ANALYTICS_SPIKE_Z = float(os.getenv("ANALYTICS_SPIKE_Z", "1.5"))  # всплеск — средняя за день выше mean + z·std
+ANALYTICS_AT_RISK_LOAD = float(os.getenv("ANALYTICS_AT_RISK_LOAD", "7"))  # средняя нагрузка за неделю, выше — в зоне риска
+ROLLING_DAYS = 7
+TELEGRAM_TEXT_LIMIT = 4096
+NO_CLASS = "Без класса"
+
+def _rolling_sum(matrix: np.ndarray, days: int = ROLLING_DAYS) -> np.ndarray:
+    """
+    Сумма по скользящему окну вдоль дней (через cumsum), окно в начале неполное.
+    """
+    csum = np.cumsum(matrix, axis=1)
+    result = csum.copy()
+    result[:, days:] -= csum[:, :-days]
+    return result
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """
+    num / den, где знаменатель 0 — NaN.
+    """
+    out = np.full(np.shape(num), np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+def _masked_corr(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Корреляция Пирсона по строкам, только по дням, где mask. Меньше трёх точек или нулевой разброс — NaN.
+    """
+    m = mask.astype(float)
+    n = m.sum(axis=1)
+    x = np.where(mask, x, 0.0)
+    mx = _ratio((x * m).sum(axis=1), n)[:, None]
+    my = _ratio((y * m).sum(axis=1), n)[:, None]
+    dx = (x - mx) * m
+    dy = (y - my) * m
+    cov = (dx * dy).sum(axis=1)
+    var = (dx * dx).sum(axis=1) * (dy * dy).sum(axis=1)
+    r = _ratio(cov, np.sqrt(var))
+    r[n < 3] = np.nan
+    return r
+
+def _num(value):
+    """
+    numpy-скаляр в float для отчёта, NaN — None.
+    """
+    value = float(value)
+    return None if np.isnan(value) else round(value, 2)
+
+def compute_report(mood_rows, deadline_rows, today: datetime.date, window: int = ANALYTICS_WINDOW_DAYS,
+                   ahead: int = ANALYTICS_AHEAD_DAYS, utc_offset: datetime.timedelta = datetime.timedelta(0)):
+    """
+    mood_rows — [(user_id, класс, имя, время, нагрузка, настроение), ...] за окно,
+    deadline_rows — [(класс, дедлайн), ...] с начала окна до today + ahead.
+    Дни нумеруются от начала окна: 0 .. window-1 — история, window .. window+ahead-1 — будущие дедлайны.
+    Время настроения записано в UTC, а дедлайны и today — местные: перед разбивкой по дням
+    время настроения сдвигается на utc_offset (местное время минус UTC).
+    """
+    start = today - datetime.timedelta(days=window - 1)
+    days = window + ahead
+    origin = start.toordinal()
+
+    class_names = sorted({r[1] or NO_CLASS for r in mood_rows} | {r[0] or NO_CLASS for r in deadline_rows})
+    class_pos = {name: i for i, name in enumerate(class_names)}
+    n_classes = len(class_names)
+
+    # --- Записи настроения ---
+    if mood_rows:
+        user_ids, classes, names, stamps, loads, moods = zip(*mood_rows)
+        user_ids = np.array(user_ids)
+        # toordinal заметно быстрее, чем разбор datetime в numpy
+        if utc_offset:
+            stamps = [stamp + utc_offset for stamp in stamps]
+        mood_day = np.fromiter(map(datetime.datetime.toordinal, stamps), dtype=int, count=len(stamps)) - origin
+        load = np.array(loads, dtype=float)
+        stressed = np.array(moods, dtype=object) == "stressed"
+        mood_class = np.array([class_pos[c or NO_CLASS] for c in classes])
+    else:
+        user_ids = mood_day = mood_class = np.zeros(0, dtype=int)
+        load = np.zeros(0)
+        stressed = np.zeros(0, dtype=bool)
+        names = ()
+    keep = (mood_day >= 0) & (mood_day < window)
+    user_ids, mood_day, load, stressed, mood_class = (
+        user_ids[keep], mood_day[keep], load[keep], stressed[keep], mood_class[keep])
+    names = np.array(names, dtype=object)[keep] if len(names) else names
+
+    cell = mood_class * window + mood_day
+    class_sum = np.bincount(cell, weights=load, minlength=n_classes * window).reshape(n_classes, window)
+    class_cnt = np.bincount(cell, minlength=n_classes * window).reshape(n_classes, window).astype(float)
+    daily_mean = _ratio(class_sum, class_cnt)
+    rolling = _ratio(_rolling_sum(class_sum), _rolling_sum(class_cnt))
+
+    # Тренд: последняя неделя против предыдущей
+    last_week = _ratio(class_sum[:, -ROLLING_DAYS:].sum(axis=1), class_cnt[:, -ROLLING_DAYS:].sum(axis=1))
+    prev_week = _ratio(class_sum[:, -2 * ROLLING_DAYS:-ROLLING_DAYS].sum(axis=1),
+                       class_cnt[:, -2 * ROLLING_DAYS:-ROLLING_DAYS].sum(axis=1))
+    recent = mood_day >= window - ROLLING_DAYS
+    stressed_share = _ratio(np.bincount(mood_class[recent & stressed], minlength=n_classes),
+                            np.bincount(mood_class[recent], minlength=n_classes))
+
+    # Всплески: дни, когда средняя нагрузка класса заметно выше его обычной
+    has_data = class_cnt > 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # у класса может не быть ни одной отметки
+        mu = np.nanmean(daily_mean, axis=1, keepdims=True)
+        sigma = np.nanstd(daily_mean, axis=1, keepdims=True)
+    spikes = has_data & (sigma > 0) & (np.nan_to_num(daily_mean) > mu + ANALYTICS_SPIKE_Z * sigma)
+
+    # --- Дедлайны ---
+    if deadline_rows:
+        dl_classes, dl_times = zip(*deadline_rows)
+        dl_day = np.fromiter(map(datetime.datetime.toordinal, dl_times), dtype=int, count=len(dl_times)) - origin
+        dl_class = np.array([class_pos[c or NO_CLASS] for c in dl_classes])
+        ok = (dl_day >= 0) & (dl_day < days)
+        density = np.bincount(dl_class[ok] * days + dl_day[ok], minlength=n_classes * days).reshape(n_classes, days)
+    else:
+        density = np.zeros((n_classes, days), dtype=int)
+    upcoming = density[:, window:]
+    busiest = upcoming.argmax(axis=1) if ahead else np.zeros(n_classes, dtype=int)
+
+    # Связь нагрузки с домашкой: дедлайны в этот и на следующий день
+    pressure = density[:, :window] + density[:, 1:window + 1]
+    corr = _masked_corr(daily_mean, pressure.astype(float), has_data)
+
+    # --- Ученики ---
+    user_index, first, user_pos = np.unique(user_ids, return_index=True, return_inverse=True)
+    n_users = len(user_index)
+    user_class = mood_class[first]
+    class_students = np.bincount(user_class, minlength=n_classes)
+    user_recent_sum = np.bincount(user_pos[recent], weights=load[recent], minlength=n_users)
+    user_recent_cnt = np.bincount(user_pos[recent], minlength=n_users)
+    user_load = _ratio(user_recent_sum, user_recent_cnt)
+    at_risk = [[] for _ in class_names]
+    risky = np.flatnonzero(np.nan_to_num(user_load) >= ANALYTICS_AT_RISK_LOAD)
+    for pos in risky[np.argsort(-user_load[risky], kind="stable")]:
+        name = names[first[pos]] or f"id {user_index[pos]}"
+        at_risk[user_class[pos]].append((name, _num(user_load[pos])))
+
+    # --- Сборка отчёта ---
+    dates = [start + datetime.timedelta(days=d) for d in range(days)]
+    class_reports = []
+    for i, name in enumerate(class_names):
+        class_reports.append({
+            "class_name": name,
+            "logs": int(class_cnt[i].sum()),
+            "students": int(class_students[i]),
+            "load_week": _num(last_week[i]),
+            "load_prev_week": _num(prev_week[i]),
+            "stressed_share": _num(stressed_share[i]),
+            "rolling": [_num(v) for v in rolling[i]],
+            "spikes": [(dates[d], _num(daily_mean[i, d]), int(pressure[i, d])) for d in np.flatnonzero(spikes[i])],
+            "deadlines_ahead": int(upcoming[i].sum()),
+            "busiest_day": (dates[window + busiest[i]], int(upcoming[i, busiest[i]])) if upcoming[i].any() else None,
+            "load_deadline_corr": _num(corr[i]),
+            "at_risk": at_risk[i],
+        })
+
+    school_sum, school_cnt = class_sum.sum(axis=0, keepdims=True), class_cnt.sum(axis=0, keepdims=True)
+    school_week = _ratio(school_sum[:, -ROLLING_DAYS:].sum(), school_cnt[:, -ROLLING_DAYS:].sum())
+    school_prev = _ratio(school_sum[:, -2 * ROLLING_DAYS:-ROLLING_DAYS].sum(),
+                         school_cnt[:, -2 * ROLLING_DAYS:-ROLLING_DAYS].sum())
+    return {
+        "today": today,
+        "window_start": start,
+        "school": {
+            "logs": int(school_cnt.sum()),
+            "students": n_users,
+            "load_week": _num(school_week),
+            "load_prev_week": _num(school_prev),
+            "stressed_share": _num(_ratio(np.array(float((recent & stressed).sum())), np.array(float(recent.sum())))),
+            "rolling": [_num(v) for v in _ratio(_rolling_sum(school_sum), _rolling_sum(school_cnt))[0]],
+            "deadlines_ahead": int(upcoming.sum()),
+            "at_risk": len(risky),
+        },
+        "classes": class_reports,
+    }
+
+def _utc_offset(utc_now: datetime.datetime) -> datetime.timedelta:
+    """
+    Местное время минус UTC в момент utc_now.
+    """
+    return datetime.datetime.fromtimestamp(utc_now.replace(tzinfo=datetime.timezone.utc).timestamp()) - utc_now
+
+_cache = {"key": None, "report": None}
+_lock = asyncio.Lock()
+
+async def get_school_report():
+    """
+    Отчёт по всей школе, дни — по местному времени. Пересчитывается только когда изменились
+    записи настроения или задания (или сменился день); иначе отдаётся из кэша.
+    """
+    async with _lock:
+        utc_now = datetime.datetime.utcnow()
+        offset = _utc_offset(utc_now)
+        today = (utc_now + offset).date()
+        key = (await db_helper.get_analytics_fingerprint(), today)
+        if _cache["key"] == key:
+            return _cache["report"]
+        started = time.perf_counter()
+        now = datetime.datetime.combine(today, datetime.time())
+        since = now - datetime.timedelta(days=ANALYTICS_WINDOW_DAYS - 1)
+        until = now + datetime.timedelta(days=ANALYTICS_AHEAD_DAYS + 1)
+        mood_rows, deadline_rows = await asyncio.gather(
+            db_helper.get_mood_rows(since - offset),  # записи настроения хранятся в UTC
+            db_helper.get_deadline_rows(since, until)
+        )
+        report = await asyncio.to_thread(compute_report, mood_rows, deadline_rows, today, utc_offset=offset)
+        _cache.update(key=key, report=report)
+        logger.info(f"School report rebuilt from {len(mood_rows)} mood logs and {len(deadline_rows)} deadlines "
+                    f"in {time.perf_counter() - started:.3f} s")
+        return report
+
+def _trend(week, prev):
+    if week is None:
+        return "нет данных"
+    if prev is None:
+        return f"{week:.1f}"
+    delta = week - prev
+    arrow = "↗" if delta > 0.3 else "↘" if delta < -0.3 else "→"
+    return f"{week:.1f} {arrow} (было {prev:.1f})"
+
+def _share(value):
+    return "—" if value is None else f"{value * 100:.0f}%"
+
+def format_report(report, class_name: str = None):
+    """
+    Текст отчёта для учителя, разбитый на части не длиннее сообщения Telegram.
+    """
+    school = report["school"]
+    lines = [
+        f"📈 Нагрузка и настроение {report['window_start'].strftime('%d.%m')}–{report['today'].strftime('%d.%m')}",
+        f"Отметок: {school['logs']}, учеников: {school['students']}",
+        f"Нагрузка за неделю: {_trend(school['load_week'], school['load_prev_week'])}",
+        f"В стрессе за неделю: {_share(school['stressed_share'])}",
+        f"Дедлайнов впереди: {school['deadlines_ahead']}, в зоне риска: {school['at_risk']}",
+    ]
+    blocks = ["\n".join(lines)]
+    for c in report["classes"]:
+        if class_name and c["class_name"].lower() != class_name.lower():
+            continue
+        lines = [
+            f"🏫 {c['class_name']} — отметок {c['logs']}, учеников {c['students']}",
+            f"Нагрузка: {_trend(c['load_week'], c['load_prev_week'])}, в стрессе {_share(c['stressed_share'])}",
+        ]
+        if c["busiest_day"]:
+            day, count = c["busiest_day"]
+            lines.append(f"Дедлайнов впереди: {c['deadlines_ahead']}, пик {day.strftime('%d.%m')} ({count})")
+        if c["spikes"]:
+            lines.append("Всплески: " + ", ".join(
+                f"{day.strftime('%d.%m')} {load:.1f} (дедлайнов {deadlines})" for day, load, deadlines in c["spikes"][-3:]))
+        if c["load_deadline_corr"] is not None:
+            lines.append(f"Связь нагрузки с домашкой: r = {c['load_deadline_corr']:+.2f}")
+        if c["at_risk"]:
+            lines.append("⚠️ В зоне риска: " + ", ".join(f"{name} ({load:.1f})" for name, load in c["at_risk"][:10]))
+        blocks.append("\n".join(lines))
+    if class_name and len(blocks) == 1:
+        blocks.append(f"По классу {class_name} данных нет.")
+
+    chunks = []
+    for block in blocks:
+        block = block[:TELEGRAM_TEXT_LIMIT]
+        if chunks and len(chunks[-1]) + len(block) + 2 <= TELEGRAM_TEXT_LIMIT:
+            chunks[-1] += "\n\n" + block
+        else:
+            chunks.append(block)
+    return chunks
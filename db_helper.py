@@ -1,7 +1,33 @@
 from sqlalchemy.future import select
-from models import AsyncSessionLocal, User, Task, Schedule, MoodLog, Achievement
+from sqlalchemy import and_, or_, update, case, literal, func
+from sqlalchemy.orm import aliased
+from models import engine, AsyncSessionLocal, User, Task, TaskCompletion, Schedule, MoodLog, Achievement, TelegramFile, UserStats, ClassStats
+from collections import OrderedDict
+import timetable
 import datetime
 import json
+import os
+import time
+
+# Кэш пользователей по telegram_id: ограничен по размеру и по времени жизни записи
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+_user_cache = OrderedDict()  # telegram_id -> (время записи, User)
+
+def _cache_user(user):
+    if user is None:
+        return user
+    _user_cache[user.telegram_id] = (time.monotonic(), user)
+    _user_cache.move_to_end(user.telegram_id)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    return user
+
+def invalidate_user(telegram_id: int = None):
+    if telegram_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(telegram_id, None)
 
 async def get_or_create_user(telegram_id: int, username: str = None, full_name: str = None):
     async with AsyncSessionLocal() as session:
@@ -17,7 +43,7 @@ async def get_or_create_user(telegram_id: int, username: str = None, full_name:
                 await session.rollback()
                 result = await session.execute(select(User).where(User.telegram_id == telegram_id))
                 user = result.scalar_one_or_none()
-        return user
+        return _cache_user(user)
 
 async def get_user(telegram_id: int):
     async with AsyncSessionLocal() as session:
@@ -25,7 +51,17 @@ async def get_user(telegram_id: int):
         user = result.scalar_one_or_none()
         return user
 
-async def add_task(user_id: int, subject: str, description: str, deadline: datetime.datetime, difficulty: str = 'normal', steps: str = None, class_name: str = None):
+async def get_user_cached(telegram_id: int):
+    """
+    То же, что get_user, но сначала смотрит в кэш. Отсутствующих пользователей не кэширует.
+    """
+    entry = _user_cache.get(telegram_id)
+    if entry and time.monotonic() - entry[0] < USER_CACHE_TTL:
+        _user_cache.move_to_end(telegram_id)
+        return entry[1]
+    return _cache_user(await get_user(telegram_id))
+
+async def add_task(user_id: int, subject: str, description: str, deadline: datetime.datetime, difficulty: str = 'normal', steps: str = None, class_name: str = None, difficulty_source: str = None):
     async with AsyncSessionLocal() as session:
         task = Task(
             user_id=user_id, 
@@ -33,47 +69,123 @@ async def add_task(user_id: int, subject: str, description: str, deadline: datet
             description=description, 
             deadline=deadline,
             difficulty=difficulty,
+            difficulty_source=difficulty_source,
             steps=steps,
             class_name=class_name
         )
         session.add(task)
+        await _bump_class_stats(session, class_name, tasks_total=1)
         await session.commit()
         await session.refresh(task)
         return task
 
-async def get_user_tasks(user_id: int, only_active: bool = True):
+async def add_tasks(user_id: int, class_name: str, items):
+    """
+    Добавляет пачку заданий одной транзакцией. items — словари с subject, description, deadline
+    и необязательными difficulty, difficulty_source и steps.
+    """
+    async with AsyncSessionLocal() as session:
+        tasks = [
+            Task(
+                user_id=user_id,
+                subject=item["subject"],
+                description=item["description"],
+                deadline=item["deadline"],
+                difficulty=item.get("difficulty", "normal"),
+                difficulty_source=item.get("difficulty_source"),
+                steps=item.get("steps"),
+                class_name=class_name
+            )
+            for item in items
+        ]
+        session.add_all(tasks)
+        await _bump_class_stats(session, class_name, tasks_total=len(tasks))
+        await session.commit()
+        return tasks
+
+async def get_task(task_id: int):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Task).where(Task.id == task_id))
+        return result.scalar_one_or_none()
+
+async def get_labeled_tasks():
+    """
+    (предмет, описание, сложность) заданий, сложность которых определил AI, — выборка для difficulty_model.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Task.subject, Task.description, Task.difficulty).where(Task.difficulty_source == "llm")
+        )
+        return [tuple(row) for row in result.all()]
+
+async def update_task_artifacts(task_id: int, **fields):
+    """
+    Сохраняет сгенерированные артефакты задания (steps, materials, difficulty).
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Task).where(Task.id == task_id))
+        task = result.scalar_one_or_none()
+        if task:
+            for name, value in fields.items():
+                setattr(task, name, value)
+            await session.commit()
+            return True
+        return False
+
+async def get_user_tasks(user_id: int, class_name: str, only_active: bool = True):
+    """
+    Задания класса ученика; only_active — только те, что он ещё не выполнил.
+    """
     async with AsyncSessionLocal() as session:
-        query = select(Task).where(Task.user_id == user_id)
+        query = select(Task).where(Task.class_name == class_name)
         if only_active:
-            query = query.where(Task.is_completed == False)
-        result = await session.execute(query)
+            query = query.outerjoin(
+                TaskCompletion,
+                and_(TaskCompletion.task_id == Task.id, TaskCompletion.user_id == user_id)
+            ).where(TaskCompletion.id.is_(None))
+        result = await session.execute(query.order_by(Task.deadline))
         tasks = result.scalars().all()
         return tasks
 
 async def get_schedule(class_name: str, day: int):
-    from schedule_gen import РАСПИСАНИЕ
-    if class_name not in РАСПИСАНИЕ:
+    index = timetable.get_index()
+    if class_name not in index.classes():
         return None
-    schedule_data = РАСПИСАНИЕ[class_name].get(day, [])
     return [
         {
-            'subject': subject,
-            'room': room
+            'number': lesson.number,
+            'subject': lesson.subject,
+            'room': lesson.room,
+            'start_time': lesson.start_time
         }
-        for subject, room in schedule_data
+        for lesson in index.lessons(class_name, day)
     ]
 
+def dialect_insert(model):
+    """
+    INSERT с поддержкой ON CONFLICT для текущей СУБД.
+    """
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def _xp_update(user_id: int, amount):
+    # Считается в самой БД одним UPDATE, поэтому параллельные начисления не теряются
+    return (
+        update(User)
+        .where(User.id == user_id)
+        .values(xp=User.xp + amount, level=(User.xp + amount) // 100 + 1)
+        .returning(User)
+    )
+
 async def update_xp(user_id: int, amount: int):
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.id == user_id))
+        result = await session.execute(_xp_update(user_id, amount))
         user = result.scalar_one_or_none()
-        if user:
-            user.xp += amount
-            user.level = (user.xp // 100) + 1
-            await session.commit()
-            await session.refresh(user)
-            return user
-        return None
+        await session.commit()
+        return _cache_user(user)
 
 async def update_user_class(telegram_id: int, class_name: str):
     async with AsyncSessionLocal() as session:
@@ -83,21 +195,180 @@ async def update_user_class(telegram_id: int, class_name: str):
             user.class_name = class_name
             await session.commit()
             await session.refresh(user)
-            return user
+            return _cache_user(user)
         return None
 
-async def complete_task(task_id: int):
+# Начисление XP за сложность задания
+XP_MAP = {'easy': 10, 'normal': 20, 'hard': 40}
+
+# Достижения: название -> условие по счётчикам ученика (UserStats) и самому ученику (User)
+ACHIEVEMENT_RULES = [
+    ("🎯 Первое задание", lambda stats, user: stats.completed >= 1),
+    ("📚 10 заданий", lambda stats, user: stats.completed >= 10),
+    ("🏅 50 заданий", lambda stats, user: stats.completed >= 50),
+    ("🔥 3 дня подряд", lambda stats, user: stats.best_streak >= 3),
+    ("⚡ Неделя без пропусков", lambda stats, user: stats.best_streak >= 7),
+    ("⏰ Пунктуальный", lambda stats, user: stats.on_time >= 10 and stats.on_time >= 0.9 * stats.rated),
+    ("⭐ Продвинутый ученик", lambda stats, user: user.xp > 100),
+    ("🚀 Уровень 5", lambda stats, user: user.level >= 5),
+]
+
+async def _bump_class_stats(session, class_name: str, **deltas):
+    """
+    Прибавляет deltas к счётчикам класса одним UPSERT.
+    """
+    if not class_name:
+        return
+    now = datetime.datetime.utcnow()
+    stmt = dialect_insert(ClassStats).values(class_name=class_name, updated_at=now, **{k: max(v, 0) for k, v in deltas.items()})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["class_name"],
+        set_={**{k: getattr(ClassStats, k) + v for k, v in deltas.items()}, "updated_at": now}
+    )
+    await session.execute(stmt)
+
+async def _bump_user_stats(session, user_id: int, on_time: bool, now: datetime.datetime):
+    """
+    Учитывает выполненное задание в счётчиках ученика: серия растёт, если вчера тоже что-то было выполнено.
+    now — время отметки (UTC), по нему же считаются дни серии.
+    """
+    today = now.date()
+    streak = case(
+        (UserStats.last_completed_on == today, UserStats.current_streak),
+        (UserStats.last_completed_on == today - datetime.timedelta(days=1), UserStats.current_streak + 1),
+        else_=1
+    )
+    stmt = dialect_insert(UserStats).values(
+        user_id=user_id, completed=1, on_time=int(on_time), rated=1, current_streak=1, best_streak=1,
+        last_completed_on=today, updated_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "completed": UserStats.completed + 1,
+            "on_time": UserStats.on_time + int(on_time),
+            "rated": UserStats.rated + 1,
+            "current_streak": streak,
+            "best_streak": case((streak > UserStats.best_streak, streak), else_=UserStats.best_streak),
+            "last_completed_on": today,
+            "updated_at": now,
+        }
+    ).returning(UserStats)
+    return (await session.execute(stmt)).scalar_one()
+
+async def _award_achievements(session, stats, user):
+    """
+    Проверяет правила достижений и записывает новые. Возвращает названия впервые полученных.
+    """
+    earned = [name for name, rule in ACHIEVEMENT_RULES if rule(stats, user)]
+    if not earned:
+        return []
+    result = await session.execute(
+        dialect_insert(Achievement)
+        .values([{"user_id": user.id, "name": name, "earned_at": datetime.datetime.utcnow()} for name in earned])
+        .on_conflict_do_nothing(index_elements=["user_id", "name"])
+        .returning(Achievement.name)
+    )
+    return list(result.scalars().all())
+
+async def complete_task(task_id: int, user_id: int):
+    """
+    Отмечает задание выполненным и в той же транзакции начисляет XP, обновляет счётчики ученика
+    и класса и проверяет достижения.
+    Повторное нажатие или гонка двух нажатий не даёт XP дважды: отметку защищает уникальный индекс.
+    Возвращает None, если задание не отмечено, иначе список новых достижений (может быть пустым).
+    """
+    now = datetime.datetime.utcnow()
+    # Дедлайны хранятся в местном времени, поэтому сравниваем их с тем же моментом по местным часам
+    local_now = datetime.datetime.fromtimestamp(now.replace(tzinfo=datetime.timezone.utc).timestamp())
+    on_time_expr = case((or_(Task.deadline.is_(None), Task.deadline >= literal(local_now)), True), else_=False)
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Task).where(Task.id == task_id))
-        task = result.scalar_one_or_none()
-        if task and not task.is_completed:
-            task.is_completed = True
-            await session.commit()
-            # Начисление XP
-            xp_map = {'easy': 10, 'normal': 20, 'hard': 40}
-            await update_xp(task.user_id, xp_map.get(task.difficulty, 20))
-            return True
-        return False
+        completion = (await session.execute(
+            dialect_insert(TaskCompletion)
+            .from_select(
+                ["task_id", "user_id", "completed_at", "on_time"],
+                select(Task.id, literal(user_id), literal(now), on_time_expr).where(Task.id == task_id)
+            )
+            .on_conflict_do_nothing(index_elements=["task_id", "user_id"])
+            .returning(TaskCompletion.on_time)
+        )).first()
+        if completion is None:
+            # Задания нет или оно уже выполнено этим учеником
+            await session.rollback()
+            return None
+        on_time = bool(completion.on_time)
+
+        task = (await session.execute(
+            select(Task.difficulty, Task.class_name).where(Task.id == task_id)
+        )).one()
+
+        result = await session.execute(_xp_update(user_id, XP_MAP.get(task.difficulty, XP_MAP['normal'])))
+        user = result.scalar_one_or_none()
+        stats = await _bump_user_stats(session, user_id, on_time, now)
+        await _bump_class_stats(session, task.class_name, completions_total=1, on_time_total=int(on_time), rated_total=1)
+        earned = await _award_achievements(session, stats, user) if user else []
+        await session.commit()
+        _cache_user(user)
+        return earned
+
+async def get_user_stats(user):
+    """
+    Счётчики ученика, его XP и уровень и место в рейтинге класса по XP.
+    XP читается тем же запросом, что и место, — переданный user может быть из кэша и отставать.
+    Место считается по индексу (class_name, xp), без чтения заданий.
+    Возвращает (stats, xp, level, rank, class_size); rank и class_size — None, если класс не выбран.
+    """
+    me = aliased(User)
+    rank = (
+        select(func.count()).select_from(User)
+        .where(User.class_name == me.class_name, User.xp > func.coalesce(me.xp, 0))
+        .correlate(me).scalar_subquery()
+    )
+    class_size = select(func.count()).select_from(User).where(User.class_name == me.class_name).correlate(me).scalar_subquery()
+    async with AsyncSessionLocal() as session:
+        stats = (await session.execute(select(UserStats).where(UserStats.user_id == user.id))).scalar_one_or_none()
+        row = (await session.execute(
+            select(me.xp, me.level, me.class_name, rank, class_size).where(me.id == user.id)
+        )).one()
+        stats = stats or UserStats(user_id=user.id, completed=0, on_time=0, rated=0, current_streak=0, best_streak=0)
+        if not row.class_name:
+            return stats, row.xp or 0, row.level or 1, None, None
+        return stats, row.xp or 0, row.level or 1, row[3] + 1, row[4]
+
+async def count_active_tasks(user_id: int, class_name: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(func.count(Task.id))
+            .outerjoin(TaskCompletion, and_(TaskCompletion.task_id == Task.id, TaskCompletion.user_id == user_id))
+            .where(Task.class_name == class_name, TaskCompletion.id.is_(None))
+        )
+        return result.scalar()
+
+async def get_class_leaderboard(class_name: str, limit: int = 10):
+    """
+    Топ класса по XP: читается первые limit записей индекса (class_name, xp).
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(User.full_name, User.username, User.xp, User.level, UserStats.current_streak)
+            .outerjoin(UserStats, UserStats.user_id == User.id)
+            .where(User.class_name == class_name)
+            .order_by(User.xp.desc())
+            .limit(limit)
+        )
+        return result.all()
+
+async def get_class_stats(class_name: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(ClassStats).where(ClassStats.class_name == class_name))
+        return result.scalar_one_or_none()
+
+async def get_achievements(user_id: int):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Achievement).where(Achievement.user_id == user_id).order_by(Achievement.earned_at)
+        )
+        return result.scalars().all()
 
 async def add_mood_log(user_id: int, mood: str, load_level: int):
     async with AsyncSessionLocal() as session:
@@ -114,11 +385,36 @@ async def get_recent_moods(user_id: int, limit: int = 5):
         return result.scalars().all()
 
 async def delete_task(task_id: int):
+    """
+    Удаляет задание вместе с отметками о выполнении и вычитает эти отметки из счётчиков
+    учеников и класса (серии и XP остаются как были).
+    """
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Task).where(Task.id == task_id))
         task = result.scalar_one_or_none()
         if task:
+            on_time = func.coalesce(func.sum(case((TaskCompletion.on_time == True, 1), else_=0)), 0)
+            rows = (await session.execute(
+                select(TaskCompletion.user_id, func.count(), on_time, func.count(TaskCompletion.on_time))
+                .where(TaskCompletion.task_id == task_id)
+                .group_by(TaskCompletion.user_id)
+            )).all()
+            for user_id, completed, user_on_time, rated in rows:
+                await session.execute(
+                    update(UserStats).where(UserStats.user_id == user_id).values(
+                        completed=UserStats.completed - completed,
+                        on_time=UserStats.on_time - user_on_time,
+                        rated=UserStats.rated - rated,
+                        updated_at=datetime.datetime.utcnow()
+                    )
+                )
             await session.delete(task)
+            await _bump_class_stats(
+                session, task.class_name, tasks_total=-1,
+                completions_total=-sum(r[1] for r in rows),
+                on_time_total=-sum(r[2] for r in rows),
+                rated_total=-sum(r[3] for r in rows)
+            )
             await session.commit()
             return True
         return False
@@ -129,6 +425,9 @@ async def update_task_desc(task_id: int, new_desc: str):
         task = result.scalar_one_or_none()
         if task:
             task.description = new_desc
+            # Текст изменился — план и материалы нужно сгенерировать заново
+            task.steps = None
+            task.materials = None
             await session.commit()
             return True
         return False
@@ -139,6 +438,9 @@ async def update_task_subject(task_id: int, new_subject: str):
         task = result.scalar_one_or_none()
         if task:
             task.subject = new_subject
+            # Текст изменился — план и материалы нужно сгенерировать заново
+            task.steps = None
+            task.materials = None
             await session.commit()
             return True
         return False
@@ -152,3 +454,90 @@ async def update_task_deadline(task_id: int, new_deadline: datetime.datetime):
             await session.commit()
             return True
         return False
+
+async def get_file_id(slot: str, image_hash: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(TelegramFile).where(TelegramFile.slot == slot))
+        entry = result.scalar_one_or_none()
+        if entry and entry.image_hash == image_hash:
+            return entry.file_id
+        return None
+
+async def save_file_id(slot: str, image_hash: str, file_id: str):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(TelegramFile).where(TelegramFile.slot == slot))
+        entry = result.scalar_one_or_none()
+        if entry:
+            # Картинка для слота изменилась — старый file_id больше не нужен
+            entry.image_hash = image_hash
+            entry.file_id = file_id
+            entry.updated_at = datetime.datetime.utcnow()
+        else:
+            session.add(TelegramFile(slot=slot, image_hash=image_hash, file_id=file_id))
+        await session.commit()
+
+async def get_due_reminders(now: datetime.datetime, horizon: datetime.datetime, reminded_before: datetime.datetime):
+    """
+    (user_id, telegram_id, subject, deadline) для невыполненных заданий с дедлайном в (now, horizon]
+    у учеников, которым не напоминали после reminded_before. Идёт по индексу tasks.deadline.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(User.id, User.telegram_id, Task.subject, Task.deadline)
+            .select_from(Task)
+            .join(User, User.class_name == Task.class_name)
+            .outerjoin(TaskCompletion, and_(TaskCompletion.task_id == Task.id, TaskCompletion.user_id == User.id))
+            .where(
+                Task.deadline > now,
+                Task.deadline <= horizon,
+                TaskCompletion.id.is_(None),
+                or_(User.last_reminded_at.is_(None), User.last_reminded_at < reminded_before)
+            )
+            .order_by(User.id, Task.deadline)
+        )
+        return result.all()
+
+async def mark_reminded(user_ids, when: datetime.datetime, chunk_size: int = 500):
+    if not user_ids:
+        return
+    async with AsyncSessionLocal() as session:
+        for i in range(0, len(user_ids), chunk_size):
+            await session.execute(
+                update(User).where(User.id.in_(user_ids[i:i + chunk_size])).values(last_reminded_at=when)
+            )
+        await session.commit()
+
+# --- Данные для аналитики ---
+
+async def get_analytics_fingerprint():
+    """
+    Меняется, когда появляются новые записи настроения или задания и когда задание правят
+    (tasks.updated_at) — в том числе из другого процесса бота.
+    """
+    async with AsyncSessionLocal() as session:
+        moods = (await session.execute(select(func.count(MoodLog.id), func.max(MoodLog.id)))).one()
+        tasks = (await session.execute(select(func.count(Task.id), func.max(Task.id), func.max(Task.updated_at)))).one()
+        return tuple(moods) + tuple(tasks)
+
+async def get_mood_rows(since: datetime.datetime):
+    """
+    (user_id, класс, имя, время, нагрузка, настроение) всех записей настроения начиная с since.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(MoodLog.user_id, User.class_name, User.full_name, MoodLog.timestamp, MoodLog.load_level, MoodLog.mood)
+            .join(User, User.id == MoodLog.user_id)
+            .where(MoodLog.timestamp >= since, MoodLog.load_level.isnot(None))
+        )
+        return result.all()
+
+async def get_deadline_rows(since: datetime.datetime, until: datetime.datetime):
+    """
+    (класс, дедлайн) заданий с дедлайном в [since, until). Идёт по индексу tasks.deadline.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Task.class_name, Task.deadline)
+            .where(Task.deadline >= since, Task.deadline < until, Task.class_name.isnot(None))
+        )
+        return result.all()
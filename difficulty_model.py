@@ -0,0 +1,200 @@
+"""
+Локальная оценка сложности задания (easy / normal / hard) без обращения к AI.
+
+Наивный байесовский классификатор по словам описания, предмету и объёму задания.
+Обучается на заданиях, сложность которых определил AI (difficulty_source = 'llm'),
+плюс на небольшом наборе затравочных примеров, чтобы работать и на пустой базе.
+
+    python difficulty_model.py train    # переобучить по БД и сохранить модель
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import datetime
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# По умолчанию рядом с модулем, а не в текущей папке, откуда запущен бот
+DIFFICULTY_MODEL_PATH = os.getenv(
+    "DIFFICULTY_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "difficulty_model.json")
+)
+DIFFICULTY_MIN_CONFIDENCE = float(os.getenv("DIFFICULTY_MIN_CONFIDENCE", "0.6"))  # ниже — спрашиваем AI
+DIFFICULTY_RETRAIN_HOURS = float(os.getenv("DIFFICULTY_RETRAIN_HOURS", "24"))
+
+LABELS = ("easy", "normal", "hard")
+
+# Затравочные примеры: задают разумное поведение, пока в базе мало размеченных заданий
+SEED_EXAMPLES = [
+    ("Литература", "прочитать рассказ", "easy"),
+    ("Литература", "прочитать главу", "easy"),
+    ("История", "прочитать параграф", "easy"),
+    ("Английский язык", "выучить слова", "easy"),
+    ("Русский язык", "повторить правило", "easy"),
+    ("Музыка", "послушать произведение", "easy"),
+    ("Алгебра", "решить номера", "normal"),
+    ("Геометрия", "решить задачи", "normal"),
+    ("Русский язык", "упражнение", "normal"),
+    ("Физика", "параграф ответить на вопросы", "normal"),
+    ("Литература", "выучить стихотворение наизусть", "normal"),
+    ("Английский язык", "упражнение в рабочей тетради", "normal"),
+    ("Русский язык", "написать сочинение", "hard"),
+    ("Литература", "сочинение по роману", "hard"),
+    ("История", "подготовить доклад", "hard"),
+    ("Биология", "проект исследование", "hard"),
+    ("Алгебра", "подготовиться к контрольной работе", "hard"),
+    ("Физика", "лабораторная работа отчёт", "hard"),
+    ("Информатика", "написать программу проект", "hard"),
+]
+
+_WORD_RE = re.compile(r"[a-zа-яё]+|\d+")
+_NUMBER_RE = re.compile(r"\d+")
+
+def features(subject: str, description: str):
+    """
+    Признаки задания: основы слов (первые 6 букв), предмет и грубый объём —
+    сколько слов в описании и сколько в нём номеров упражнений.
+    """
+    words = _WORD_RE.findall((description or "").lower())
+    result = [f"w:{w[:6]}" for w in words if not w.isdigit() and len(w) > 2]
+    result.append(f"s:{(subject or '').lower()}")
+    result.append(f"len:{min(len(words) // 5, 4)}")
+    result.append(f"nums:{min(len(_NUMBER_RE.findall(description or '')), 4)}")
+    return result
+
+class DifficultyModel:
+    """
+    Мультиномиальный наивный Байес со сглаживанием Лапласа.
+    predict работает за микросекунды: несколько обращений к словарям на признак.
+    """
+
+    def __init__(self, counts=None, totals=None, priors=None, samples: int = 0, trained_at: str = None):
+        self.counts = counts or {label: {} for label in LABELS}
+        self.totals = totals or {label: 0 for label in LABELS}
+        self.priors = priors or {label: 1 for label in LABELS}
+        self.samples = samples
+        self.trained_at = trained_at
+        self._vocab = len({token for label in LABELS for token in self.counts[label]}) or 1
+
+    @classmethod
+    def fit(cls, examples):
+        """
+        examples — [(предмет, описание, сложность), ...]; строки с неизвестной сложностью пропускаются.
+        """
+        counts = {label: Counter() for label in LABELS}
+        priors = Counter()
+        samples = 0
+        for subject, description, label in examples:
+            if label not in LABELS:
+                continue
+            counts[label].update(features(subject, description))
+            priors[label] += 1
+            samples += 1
+        return cls(
+            counts={label: dict(c) for label, c in counts.items()},
+            totals={label: sum(c.values()) for label, c in counts.items()},
+            priors={label: priors[label] + 1 for label in LABELS},
+            samples=samples,
+            trained_at=datetime.datetime.now().isoformat(timespec="seconds")
+        )
+
+    def predict(self, subject: str, description: str):
+        """
+        (сложность, уверенность от 0 до 1).
+        """
+        tokens = features(subject, description)
+        total_priors = sum(self.priors.values())
+        scores = {}
+        for label in LABELS:
+            counts = self.counts[label]
+            denominator = self.totals[label] + self._vocab
+            score = math.log(self.priors[label] / total_priors)
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        # Нормируем в вероятности (softmax по логарифмам)
+        top = scores[best]
+        norm = sum(math.exp(s - top) for s in scores.values())
+        return best, 1 / norm
+
+    def to_dict(self):
+        return {"counts": self.counts, "totals": self.totals, "priors": self.priors,
+                "samples": self.samples, "trained_at": self.trained_at}
+
+    def save(self, path: str = DIFFICULTY_MODEL_PATH):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DIFFICULTY_MODEL_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+_model = None
+
+def get_model() -> DifficultyModel:
+    global _model
+    if _model is None:
+        try:
+            _model = DifficultyModel.load()
+        except (OSError, ValueError) as e:
+            logger.info(f"Difficulty model not loaded ({e}), using seed examples")
+            _model = DifficultyModel.fit(SEED_EXAMPLES)
+    return _model
+
+def classify(subject: str, description: str):
+    """
+    Сложность задания и уверенность модели. При уверенности ниже DIFFICULTY_MIN_CONFIDENCE
+    вызывающий код может уточнить ответ у AI.
+    """
+    return get_model().predict(subject, description)
+
+def is_confident(confidence: float) -> bool:
+    return confidence >= DIFFICULTY_MIN_CONFIDENCE
+
+async def retrain(path: str = DIFFICULTY_MODEL_PATH):
+    """
+    Переобучает модель на заданиях, размеченных AI, и атомарно подменяет текущую.
+    """
+    global _model
+    import db_helper
+    started = time.perf_counter()
+    examples = SEED_EXAMPLES + await db_helper.get_labeled_tasks()
+    model = await asyncio.to_thread(DifficultyModel.fit, examples)
+    await asyncio.to_thread(model.save, path)
+    _model = model
+    logger.info(f"Difficulty model retrained on {model.samples} tasks in {time.perf_counter() - started:.2f} s")
+    return model
+
+async def run_retrain_loop(interval_hours: float = DIFFICULTY_RETRAIN_HOURS):
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await retrain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Difficulty model retrain failed: {e}")
+
+async def _train_cli():
+    from models import init_db
+    await init_db()
+    model = await retrain()
+    print(f"Модель сохранена в {DIFFICULTY_MODEL_PATH}: {model.samples} примеров")
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["train"]:
+        print("Использование: python difficulty_model.py train")
+        sys.exit(1)
+    asyncio.run(_train_cli())
@@ -0,0 +1,89 @@
+import os
+import json
+import datetime
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, update, delete, or_
+
+from models import AsyncSessionLocal, FsmRecord
+from db_helper import dialect_insert
+
+# memory — состояние живёт в одном процессе; db — в общей БД (SQLite-файл или Postgres),
+# его видят все процессы бота и оно переживает перезапуск. По умолчанию БД нужна только
+# при нескольких процессах: aiogram читает состояние на каждом апдейте
+FSM_STORAGE = os.getenv(
+    "FSM_STORAGE", "db" if os.getenv("BOT_MODE", "polling") in ("worker", "router") else "memory"
+)
+
+def _key(key: StorageKey) -> str:
+    parts = [key.bot_id, key.chat_id, key.user_id]
+    if key.thread_id:
+        parts.append(key.thread_id)
+    if key.business_connection_id:
+        parts.append(key.business_connection_id)
+    parts.append(key.destiny)
+    return ":".join(str(p) for p in parts)
+
+class DBStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm_states. Каждая запись — одна строка,
+    запись состояния и данных — один UPSERT. Когда и состояние, и данные сброшены,
+    строка удаляется, чтобы таблица не росла на каждого, кто когда-то заполнял форму.
+    """
+
+    async def _upsert(self, key: StorageKey, **fields):
+        fields["updated_at"] = datetime.datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            stmt = dialect_insert(FsmRecord).values(key=_key(key), **fields)
+            stmt = stmt.on_conflict_do_update(index_elements=["key"], set_=fields)
+            await session.execute(stmt)
+            await session.commit()
+
+    async def _clear(self, key: StorageKey, **fields):
+        fields["updated_at"] = datetime.datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(FsmRecord).where(FsmRecord.key == _key(key)).values(**fields))
+            await session.execute(delete(FsmRecord).where(
+                FsmRecord.key == _key(key),
+                FsmRecord.state.is_(None),
+                or_(FsmRecord.data.is_(None), FsmRecord.data == "{}")
+            ))
+            await session.commit()
+
+    async def _get(self, key: StorageKey, column):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(column).where(FsmRecord.key == _key(key)))
+            return result.scalar_one_or_none()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self._clear(key, state=None)
+        else:
+            await self._upsert(key, state=state)
+
+    async def get_state(self, key: StorageKey):
+        return await self._get(key, FsmRecord.state)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not data:
+            await self._clear(key, data=None)
+        else:
+            await self._upsert(key, data=json.dumps(dict(data), ensure_ascii=False, default=str))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        data = await self._get(key, FsmRecord.data)
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        pass
+
+def build_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "db":
+        return DBStorage()
+    raise ValueError(f"Неизвестное FSM_STORAGE: {kind}")
@@ -0,0 +1,189 @@
+import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Настройки по умолчанию (можно переопределить через .env)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "40"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+class LLMError(Exception):
+    """
+    Ни один провайдер не смог ответить. В args[0] — текст последней ошибки.
+    """
+
+class GeminiProvider:
+    """
+    Gemini через нативный async-метод SDK. Модель создаётся один раз и переиспользуется.
+    """
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash"):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._model = genai.GenerativeModel(model_name)
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        response = await self._model.generate_content_async(f"{system_prompt}\n\nПользователь: {user_prompt}")
+        return response.text
+
+    async def stream(self, system_prompt: str, user_prompt: str):
+        response = await self._model.generate_content_async(
+            f"{system_prompt}\n\nПользователь: {user_prompt}", stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+class OpenAIProvider:
+    """
+    OpenAI через AsyncOpenAI. Клиент (и его пул соединений) создаётся при первом запросе и живёт всё время работы бота.
+    """
+    name = "openai"
+
+    def __init__(self, model_name: str = "gpt-4.1-mini"):
+        self.model_name = model_name
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI()  # Использует ключ из окружения
+        return self._client
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        resp = await self._get_client().chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        )
+        return resp.choices[0].message.content
+
+    async def stream(self, system_prompt: str, user_prompt: str):
+        stream = await self._get_client().chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            stream=True
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+class FakeProvider:
+    """
+    Локальный провайдер для тестов и отладки без сети: отвечает заготовкой или эхом запроса.
+    """
+    name = "fake"
+
+    def __init__(self, answer: str = None, delay: float = 0.0, fail: bool = False):
+        self.answer = answer
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("fake provider failure")
+        return self.answer if self.answer is not None else f"[fake] {user_prompt}"
+
+    async def stream(self, system_prompt: str, user_prompt: str):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("fake provider failure")
+        answer = self.answer if self.answer is not None else f"[fake] {user_prompt}"
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if self.delay:
+                await asyncio.sleep(self.delay / len(words))
+            yield word if i == 0 else " " + word
+
+class LLMClient:
+    """
+    Обёртка над списком провайдеров: общий лимит одновременных запросов, таймаут на запрос
+    и переход к следующему провайдеру (Gemini -> OpenAI), если предыдущий упал.
+    """
+
+    def __init__(self, providers, timeout: float = LLM_TIMEOUT, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.providers = list(providers)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        if not self.providers:
+            raise LLMError("Нет настроенных AI-провайдеров")
+        last_error = None
+        async with self._semaphore:
+            for provider in self.providers:
+                try:
+                    return await asyncio.wait_for(provider.complete(system_prompt, user_prompt), self.timeout)
+                except asyncio.TimeoutError:
+                    last_error = f"{provider.name}: таймаут {self.timeout:g} с"
+                except Exception as e:
+                    last_error = f"{provider.name}: {e}"
+                logger.warning(f"LLM provider failed, {last_error}")
+        raise LLMError(last_error)
+
+    async def stream(self, system_prompt: str, user_prompt: str):
+        """
+        Отдаёт ответ кусками по мере генерации. Таймаут действует на ожидание каждого куска.
+        Следующий провайдер пробуется, только если предыдущий упал до первого куска:
+        после этого ответ уже частично показан пользователю и ошибка пробрасывается как LLMError.
+        """
+        if not self.providers:
+            raise LLMError("Нет настроенных AI-провайдеров")
+        last_error = None
+        async with self._semaphore:
+            for provider in self.providers:
+                started = False
+                if hasattr(provider, "stream"):
+                    chunks = provider.stream(system_prompt, user_prompt)
+                else:
+                    chunks = _single_chunk(provider.complete(system_prompt, user_prompt))
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield chunk
+                except asyncio.TimeoutError:
+                    last_error = f"{provider.name}: таймаут {self.timeout:g} с"
+                except Exception as e:
+                    last_error = f"{provider.name}: {e}"
+                finally:
+                    await chunks.aclose()
+                if started:
+                    raise LLMError(last_error)
+                logger.warning(f"LLM provider failed, {last_error}")
+        raise LLMError(last_error)
+
+async def _single_chunk(coro):
+    yield await coro
+
+def build_default_client() -> LLMClient:
+    """
+    Собирает клиента по переменным окружения: LLM_PROVIDER=fake для локального запуска,
+    иначе Gemini (если есть ключ) и OpenAI как запасной вариант.
+    """
+    if os.getenv("LLM_PROVIDER") == "fake":
+        return LLMClient([FakeProvider()])
+
+    providers = []
+    gemini_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if gemini_key:
+        try:
+            providers.append(GeminiProvider(gemini_key))
+        except Exception as e:
+            logger.error(f"Gemini provider setup failed, falling back to OpenAI: {e}")
+    providers.append(OpenAIProvider())
+    return LLMClient(providers)
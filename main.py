@@ -3,10 +3,11 @@ import sys
 import os
 import asyncio
 import datetime
+import contextlib
 import random
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -14,13 +15,24 @@ from aiogram.types import FSInputFile
 from aiogram.exceptions import TelegramBadRequest
 from dotenv import load_dotenv
 
+# Загрузка переменных (до импорта модулей проекта: они читают настройки из окружения)
+load_dotenv()
+
 from models import init_db
 import db_helper
 import ai_helper
 import schedule_gen
-
-# Загрузка переменных
-load_dotenv()
+import task_pipeline
+import reminders
+import timetable
+import parser_engine
+import difficulty_model
+import analytics
+import webhook
+from outbox import outbox
+from ai_queue import ai_queue, QueueFull, JobCancelled
+from middlewares import UserContextMiddleware
+from fsm_storage import build_storage
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,7 +44,10 @@ if not TOKEN:
     sys.exit(1)
 
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=build_storage())
+# Пользователь из БД достаётся один раз на апдейт и приходит в хэндлеры аргументом db_user
+dp.message.middleware(UserContextMiddleware())
+dp.callback_query.middleware(UserContextMiddleware())
 
 # Состояния FSM
 class States(StatesGroup):
@@ -100,9 +115,8 @@ async def set_class(cb: types.CallbackQuery):
 # --- РАСПИСАНИЕ ---
 
 @dp.message(F.text == "📅 Расписание")
-async def schedule_menu(message: types.Message):
-    user = await db_helper.get_user(message.from_user.id)
-    if not user or not user.class_name:
+async def schedule_menu(message: types.Message, db_user):
+    if not db_user or not db_user.class_name:
         await message.answer("Сначала выбери класс с помощью /start")
         return
     
@@ -112,16 +126,26 @@ async def schedule_menu(message: types.Message):
         kb.button(text=d, callback_data=f"sch_{i}")
     kb.adjust(5)
     
-    await message.answer(f"На какой день показать расписание ({user.class_name})?", reply_markup=kb.as_markup())
+    text = f"На какой день показать расписание ({db_user.class_name})?"
+    lesson = timetable.get_index().next_lesson(db_user.class_name)
+    if lesson:
+        text += f"\n\n🔔 Ближайший урок: {lesson.number}. {lesson.subject}"
+        # start_time пуст, если время берётся из звонков по умолчанию; start уже посчитан с ним
+        if lesson.start is not None:
+            text += f" в {lesson.start // 60:02d}:{lesson.start % 60:02d}"
+        if lesson.room:
+            text += f", кабинет {lesson.room}"
+    await message.answer(text, reply_markup=kb.as_markup())
 
 @dp.callback_query(F.data.startswith("sch_"))
-async def show_schedule(cb: types.CallbackQuery):
-    user = await db_helper.get_user(cb.from_user.id)
+async def show_schedule(cb: types.CallbackQuery, db_user):
+    if not db_user or not db_user.class_name:
+        await cb.answer("Сначала выбери класс с помощью /start")
+        return
     day_idx = int(cb.data.split("_")[1])
     
-    from schedule_gen import РАСПИСАНИЕ
-    
-    if user.class_name not in РАСПИСАНИЕ or day_idx not in РАСПИСАНИЕ[user.class_name]:
+    schedule_data = timetable.get_index().items(db_user.class_name, day_idx)
+    if not schedule_data:
         await cb.answer("Расписание для этого дня пока не заполнено.")
         return
     
@@ -130,12 +154,24 @@ async def show_schedule(cb: types.CallbackQuery):
     except:
         pass
         
-    schedule_data = РАСПИСАНИЕ[user.class_name][day_idx]
-    img_path = schedule_gen.generate_schedule_image(user.class_name, day_idx, schedule_data)
+    slot = f"schedule:{db_user.class_name}:{day_idx}"
+    image_hash = schedule_gen.schedule_image_hash(db_user.class_name, day_idx, schedule_data)
     
-    photo = FSInputFile(img_path)
+    # Если картинка уже загружалась в Telegram, отправляем её по file_id без повторной загрузки
+    file_id = await db_helper.get_file_id(slot, image_hash)
     days_acc = ["понедельник", "вторник", "среду", "четверг", "пятницу"]
-    await cb.message.answer_photo(photo, caption=f"Твоё расписание на {days_acc[day_idx]}")
+    caption = f"Твоё расписание на {days_acc[day_idx]}"
+    sent = None
+    if file_id:
+        try:
+            sent = await cb.message.answer_photo(file_id, caption=caption)
+        except TelegramBadRequest:
+            logger.warning(f"Stale file_id for {slot}, re-uploading")
+    if sent is None:
+        img_path = await schedule_gen.render_schedule_image(db_user.class_name, day_idx, schedule_data)
+        sent = await cb.message.answer_photo(FSInputFile(img_path), caption=caption)
+        if sent.photo:
+            await db_helper.save_file_id(slot, image_hash, sent.photo[-1].file_id)
     try:
         await cb.message.delete()
     except:
@@ -143,45 +179,95 @@ async def show_schedule(cb: types.CallbackQuery):
 
 # --- ДОМАШНЕЕ ЗАДАНИЕ ---
 
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", "5"))
+
+def render_tasks_page(tasks, page: int, is_admin: bool):
+    """
+    Собирает одну страницу списка заданий: текст со всеми карточками и клавиатуру
+    с кнопками для каждого задания и навигацией по страницам.
+    """
+    pages = max(1, (len(tasks) + TASKS_PAGE_SIZE - 1) // TASKS_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    chunk = tasks[page * TASKS_PAGE_SIZE:(page + 1) * TASKS_PAGE_SIZE]
+    
+    lines = [f"📝 *Твои задания* ({len(tasks)}):", ""]
+    kb = InlineKeyboardBuilder()
+    sizes = []
+    for num, t in enumerate(chunk, page * TASKS_PAGE_SIZE + 1):
+        deadline_str = t.deadline.strftime("%d.%m %H:%M")
+        diff_emoji = {"easy": "🟢", "normal": "🟡", "hard": "🔴"}.get(t.difficulty, "⚪")
+        desc = t.description if len(t.description or "") <= 300 else t.description[:300] + "…"
+        lines.append(f"{num}. {diff_emoji} *{t.subject}*\n{desc}\n⏰ К занятию: {deadline_str}\n")
+        
+        kb.button(text=f"✅ {num}", callback_data=f"done_{t.id}_{page}")
+        kb.button(text=f"🤖 {num}", callback_data=f"steps_{t.id}")
+        kb.button(text=f"📚 {num}", callback_data=f"mats_{t.id}")
+        if is_admin:
+            kb.button(text=f"✏️ {num}", callback_data=f"edit_{t.id}")
+            kb.button(text=f"🗑️ {num}", callback_data=f"del_{t.id}_{page}")
+        sizes.append(5 if is_admin else 3)
+    
+    if pages > 1:
+        kb.button(text="◀️", callback_data=f"tpage_{(page - 1) % pages}")
+        kb.button(text=f"{page + 1}/{pages}", callback_data=f"tpage_{page}")
+        kb.button(text="▶️", callback_data=f"tpage_{(page + 1) % pages}")
+        sizes.append(3)
+    kb.adjust(*sizes)
+    lines.append("✅ — выполнено, 🤖 — план, 📚 — материалы")
+    return "\n".join(lines), kb.as_markup()
+
+async def refresh_tasks_page(cb: types.CallbackQuery, db_user, page: int):
+    tasks = await db_helper.get_user_tasks(db_user.id, db_user.class_name)
+    if not tasks:
+        text, markup = "Все задания выполнены. Отдыхай! 🥳", None
+    else:
+        text, markup = render_tasks_page(tasks, page, str(cb.from_user.id) == os.getenv("ADMIN_ID"))
+    try:
+        await outbox.edit_message_text(cb.message.chat.id, cb.message.message_id, text, reply_markup=markup)
+    except TelegramBadRequest:
+        # Содержимое не изменилось
+        pass
+
 @dp.message(F.text == "📝 Мои Задания")
-async def list_tasks(message: types.Message):
-    db_user = await db_helper.get_user(message.from_user.id)
+async def list_tasks(message: types.Message, db_user):
     if not db_user:
         await message.answer("Сначала выбери класс с помощью /start")
         return
-    tasks = await db_helper.get_user_tasks(db_user.id)
+    tasks = await db_helper.get_user_tasks(db_user.id, db_user.class_name)
     
     if not tasks:
         await message.answer("У тебя пока нет активных заданий. Отдыхай! 🥳", reply_markup=main_kb(message.from_user.id))
         return
     
-    admin_id = os.getenv("ADMIN_ID")
-    for t in tasks:
-        kb = InlineKeyboardBuilder()
-        kb.button(text="✅ Выполнено", callback_data=f"done_{t.id}")
-        kb.button(text="🤖 Разбить на шаги", callback_data=f"steps_{t.id}")
-        kb.button(text="📚 Материалы", callback_data=f"mats_{t.id}")
-        
-        if str(message.from_user.id) == admin_id:
-            kb.button(text="✏️ Редактировать", callback_data=f"edit_{t.id}")
-            kb.button(text="🗑️ Удалить", callback_data=f"del_{t.id}")
-            
-        kb.adjust(1)
-        deadline_str = t.deadline.strftime("%d.%m %H:%M")
-        diff_emoji = {"easy": "🟢", "normal": "🟡", "hard": "🔴"}.get(t.difficulty, "⚪")
-        
-        text = f"{diff_emoji} *{t.subject}*\n\n{t.description}\n\n⏰ К занятию: {deadline_str}"
-        await message.answer(text, reply_markup=kb.as_markup())
+    # Одно сообщение со страницей заданий вместо отдельного сообщения на каждое задание
+    text, markup = render_tasks_page(tasks, 0, str(message.from_user.id) == os.getenv("ADMIN_ID"))
+    await outbox.send_message(message.chat.id, text, reply_markup=markup)
+
+@dp.callback_query(F.data.startswith("tpage_"))
+async def tasks_page_cb(cb: types.CallbackQuery, db_user):
+    if not db_user:
+        await cb.answer("Сначала выбери класс с помощью /start")
+        return
+    await cb.answer()
+    await refresh_tasks_page(cb, db_user, int(cb.data.split("_")[1]))
 
 @dp.callback_query(F.data.startswith("done_"))
-async def complete_task_cb(cb: types.CallbackQuery):
-    task_id = int(cb.data.split("_")[1])
-    if await db_helper.complete_task(task_id):
-        await cb.answer("Молодец! +XP 🌟")
-        try:
-            await cb.message.edit_text(f"✅ {cb.message.text}\n\n*ВЫПОЛНЕНО*")
-        except:
-            await cb.message.answer(f"✅ Задача выполнена!")
+async def complete_task_cb(cb: types.CallbackQuery, db_user):
+    parts = cb.data.split("_")
+    task_id = int(parts[1])
+    earned = await db_helper.complete_task(task_id, db_user.id) if db_user else None
+    if earned is not None:
+        if earned:
+            await cb.answer("🏅 Новое достижение: " + ", ".join(earned), show_alert=True)
+        else:
+            await cb.answer("Молодец! +XP 🌟")
+        if len(parts) > 2:
+            await refresh_tasks_page(cb, db_user, int(parts[2]))
+        else:
+            try:
+                await cb.message.edit_text(f"✅ {cb.message.text}\n\n*ВЫПОЛНЕНО*")
+            except:
+                await cb.message.answer(f"✅ Задача выполнена!")
     else:
         await cb.answer("Ошибка или уже выполнено")
 
@@ -191,9 +277,15 @@ async def get_materials(cb: types.CallbackQuery):
         await cb.answer("Ищу полезные ссылки...")
     except: pass
     
-    task_text = cb.message.text
-    prompt = f"Найди реальные ссылки на материалы (видео VK и статьи) по теме: {task_text}. Не выдумывай ссылки!"
-    result = await ai_helper.solve_problem(prompt, system_prompt="Ты — эксперт по поиску образовательного контента.")
+    task_id = int(cb.data.split("_")[1])
+    try:
+        result = await task_pipeline.get_task_artifact(task_id, "materials", cb.from_user.id)
+    except (QueueFull, JobCancelled):
+        await cb.message.answer("😔 Сейчас слишком много запросов. Попробуй через минуту.")
+        return
+    if result is None:
+        await cb.message.answer("Задание не найдено.")
+        return
     await cb.message.answer(f"📚 *Материалы для подготовки:*\n\n{result}")
 
 @dp.callback_query(F.data.startswith("steps_"))
@@ -202,9 +294,15 @@ async def get_steps(cb: types.CallbackQuery):
         await cb.answer("Генерирую план...")
     except: pass
     
-    task_text = cb.message.text
-    prompt = f"Разбей на конкретные шаги выполнение этого задания: {task_text}. Используй эмодзи."
-    result = await ai_helper.solve_problem(prompt, system_prompt="Ты — эксперт-репетитор.")
+    task_id = int(cb.data.split("_")[1])
+    try:
+        result = await task_pipeline.get_task_artifact(task_id, "steps", cb.from_user.id)
+    except (QueueFull, JobCancelled):
+        await cb.message.answer("😔 Сейчас слишком много запросов. Попробуй через минуту.")
+        return
+    if result is None:
+        await cb.message.answer("Задание не найдено.")
+        return
     await cb.message.answer(f"📋 *Интеллектуальный план выполнения:*\n\n{result}")
 
 # --- АДМИН-ФУНКЦИИ ---
@@ -219,46 +317,117 @@ async def add_task_start(message: types.Message, state: FSMContext):
     await state.set_state(States.waiting_task_subject)
 
 @dp.message(States.waiting_task_subject)
-async def add_task_subject(message: types.Message, state: FSMContext):
-    await state.update_data(subject=message.text)
+async def add_task_subject(message: types.Message, state: FSMContext, db_user):
+    if not db_user:
+        await state.clear()
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
+    # «алгебре», «матеша» -> название предмета как в расписании
+    subject = parser_engine.normalize_subject(message.text, db_user.class_name) or message.text.strip()
+    await state.update_data(subject=subject)
     await message.answer("Что нужно сделать?")
     await state.set_state(States.waiting_task_desc)
 
 @dp.message(States.waiting_task_desc)
 async def add_task_desc(message: types.Message, state: FSMContext):
     await state.update_data(description=message.text)
-    await message.answer("Через сколько часов будет занятие? (введи число)")
+    await message.answer("Когда сдавать? Число часов или, например: «к пятнице», «15.03», «к следующему уроку»")
     await state.set_state(States.waiting_task_deadline)
 
 @dp.message(States.waiting_task_deadline)
-async def add_task_deadline(message: types.Message, state: FSMContext):
+async def add_task_deadline(message: types.Message, state: FSMContext, db_user):
+    if not db_user:
+        await state.clear()
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
     try:
-        hours = int(message.text)
         data = await state.get_data()
-        db_user = await db_helper.get_user(message.from_user.id)
-        deadline = datetime.datetime.now() + datetime.timedelta(hours=hours)
-        
-        prompt = f"Определи сложность задания (easy, normal, hard) одним словом: {data['subject']} - {data['description']}"
-        diff_res = await ai_helper.solve_problem(prompt, system_prompt="Отвечай только одним словом: easy, normal или hard")
-        difficulty = diff_res.lower().strip() if diff_res else "normal"
-        if difficulty not in ['easy', 'normal', 'hard']: difficulty = 'normal'
-            
-        await db_helper.add_task(user_id=db_user.id, subject=data['subject'], description=data['description'], deadline=deadline, difficulty=difficulty, class_name=db_user.class_name)
-        await message.answer(f"✅ Задание добавлено! Сложность: {difficulty}", reply_markup=main_kb(message.from_user.id))
+        text = message.text.strip()
+        if text.isdigit():
+            deadline = datetime.datetime.now() + datetime.timedelta(hours=int(text))
+        else:
+            # Сначала правила (без AI), к LLM — только если правила не справились
+            deadline = parser_engine.parse_deadline(text, class_name=db_user.class_name, subject=data['subject'])
+            deadline = deadline or await parser_engine.llm_deadline(text)
+        if deadline is None:
+            await message.answer("Не понял срок. Введи число часов или дату, например «15.03» или «к пятнице».")
+            return
+
+        # Сложность — локальной моделью за миллисекунды; если она не уверена, фон уточнит у AI
+        difficulty, confidence = difficulty_model.classify(data['subject'], data['description'])
+        source = "model" if difficulty_model.is_confident(confidence) else None
+        task = await db_helper.add_task(user_id=db_user.id, subject=data['subject'], description=data['description'], deadline=deadline, difficulty=difficulty, class_name=db_user.class_name, difficulty_source=source)
+        # План и материалы генерируются один раз в фоне, а не по запросу каждого ученика
+        task_pipeline.schedule_task_artifacts(task.id)
+        await message.answer("✅ Задание добавлено! План и материалы подготовятся в фоне.", reply_markup=main_kb(message.from_user.id))
         await state.clear()
     except Exception as e:
         logger.error(f"Error adding task: {e}")
-        await message.answer("Ошибка. Введи число часов.")
+        await message.answer("Ошибка. Введи число часов или дату.")
+
+@dp.message(Command("homework"))
+async def homework_batch_cmd(message: types.Message, command: CommandObject, db_user):
+    """
+    /homework и дальше задания по одному на строку, например:
+    Пятница:
+    Алгебра: №123, 124
+    Русский: упр. 45 к следующему уроку
+    """
+    admin_id = os.getenv("ADMIN_ID")
+    if str(message.from_user.id) != admin_id:
+        await message.answer("У вас нет прав администратора!")
+        return
+    if not db_user:
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
+    if not command.args:
+        await message.answer("Формат: /homework, а ниже задания по одному на строку: «Алгебра: №123 к пятнице»")
+        return
+    placeholder = await message.answer("⏳ Разбираю задания...")
+    response, _ = await parser_engine.handle_user_task_batch(command.args, db_user.id, db_user.class_name)
+    await outbox.edit_message_text(placeholder.chat.id, placeholder.message_id, response)
+
+@dp.message(Command("set_schedule"))
+async def set_schedule_cmd(message: types.Message, command: CommandObject):
+    """
+    /set_schedule 7А Пн Алгебра 305; Геометрия 305; Физика 412
+    """
+    admin_id = os.getenv("ADMIN_ID")
+    if str(message.from_user.id) != admin_id:
+        await message.answer("У вас нет прав администратора!")
+        return
+    days = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+    try:
+        class_name, day, rest = (command.args or "").split(maxsplit=2)
+        day_idx = int(day) if day.isdigit() else days.index(day.lower())
+        if not 0 <= day_idx < len(days):
+            raise ValueError(day)
+        lessons = []
+        for item in rest.split(";"):
+            item = item.strip()
+            if not item:
+                continue
+            subject, _, room = item.rpartition(" ")
+            lessons.append((subject, room) if subject else (room, ""))
+    except ValueError:
+        await message.answer("Формат: /set_schedule 7А Пн Алгебра 305; Геометрия 305; ...")
+        return
+    await timetable.set_day(class_name, day_idx, lessons)
+    await message.answer(f"✅ Расписание {class_name} на {days[day_idx].capitalize()} обновлено: {len(lessons)} уроков.")
 
 @dp.callback_query(F.data.startswith("del_"))
-async def delete_task_cb(cb: types.CallbackQuery):
+async def delete_task_cb(cb: types.CallbackQuery, db_user):
     admin_id = os.getenv("ADMIN_ID")
     if str(cb.from_user.id) != admin_id:
         await cb.answer("Нет прав!")
         return
-    task_id = int(cb.data.split("_")[1])
+    parts = cb.data.split("_")
+    task_id = int(parts[1])
     if await db_helper.delete_task(task_id):
         await cb.answer("Удалено!")
+        if len(parts) > 2 and db_user:
+            await refresh_tasks_page(cb, db_user, int(parts[2]))
+            return
         try:
             await cb.message.delete()
         except: pass
@@ -269,36 +438,201 @@ async def delete_task_cb(cb: types.CallbackQuery):
 async def ai_menu(message: types.Message):
     await message.answer("Я тут! Спрашивай что угодно по учебе.")
 
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "5"))
+
 @dp.message(F.text == "📊 Статистика")
-async def stats(message: types.Message):
-    db_user = await db_helper.get_user(message.from_user.id)
-    tasks = await db_helper.get_user_tasks(db_user.id)
-    text = f"📊 *Твоя статистика:*\n\nУровень: {db_user.level}\nXP: {db_user.xp}\nЗадач в работе: {len(tasks)}"
+async def stats(message: types.Message, db_user):
+    if not db_user:
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
+    user_stats, xp, level, rank, class_size = await db_helper.get_user_stats(db_user)
+    active = await db_helper.count_active_tasks(db_user.id, db_user.class_name)
+    on_time = f"{user_stats.on_time * 100 // user_stats.rated}%" if user_stats.rated else "—"
+    text = (
+        f"📊 *Твоя статистика:*\n\nУровень: {level}\nXP: {xp}\n"
+        f"Задач в работе: {active}\nВыполнено: {user_stats.completed}\nВовремя: {on_time}\n"
+        f"Серия: {user_stats.current_streak} дн. (рекорд {user_stats.best_streak})\n"
+    )
+    if rank:
+        text += f"Место в классе: {rank} из {class_size}\n"
+        leaders = await db_helper.get_class_leaderboard(db_user.class_name, LEADERBOARD_SIZE)
+        text += f"\n🏆 Топ {db_user.class_name}:\n"
+        for place, (full_name, username, xp, level, streak) in enumerate(leaders, 1):
+            text += f"{place}. {full_name or username or 'Ученик'} — {xp} XP" + (f", 🔥{streak}" if streak else "") + "\n"
     await message.answer(text)
 
 @dp.message(F.text == "🎮 Достижения")
-async def achievements(message: types.Message):
-    user = await db_helper.get_user(message.from_user.id)
-    text = f"🏆 *Твои достижения:*\n\nУровень {user.level}\n"
-    if user.xp > 100: text += "⭐ Продвинутый ученик\n"
-    else: text += "🐣 Новичок\n"
+async def achievements(message: types.Message, db_user):
+    if not db_user:
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
+    text = f"🏆 *Твои достижения:*\n\nУровень {db_user.level}\n"
+    earned = await db_helper.get_achievements(db_user.id)
+    if earned:
+        text += "\n".join(f"{a.name} — {a.earned_at.strftime('%d.%m.%Y')}" for a in earned) + "\n"
+    else:
+        text += "🐣 Новичок\n"
     await message.answer(text)
 
+@dp.message(Command("mood"))
+async def mood_cmd(message: types.Message, command: CommandObject, db_user):
+    """
+    /mood 7 — насколько тяжело с учёбой сегодня, от 1 до 10.
+    """
+    if not db_user:
+        await message.answer("Сначала выбери класс с помощью /start")
+        return
+    try:
+        load_level = int((command.args or "").strip())
+        if not 1 <= load_level <= 10:
+            raise ValueError(load_level)
+    except ValueError:
+        await message.answer("Оцени нагрузку от 1 до 10, например: /mood 6")
+        return
+    mood = "happy" if load_level <= 3 else "neutral" if load_level <= 6 else "stressed"
+    await db_helper.add_mood_log(db_user.id, mood, load_level)
+    await message.answer("Спасибо, записал! " + ("Держись, ты справишься 💪" if mood == "stressed" else "👍"))
+
+@dp.message(Command("report"))
+async def report_cmd(message: types.Message, command: CommandObject):
+    """
+    /report [класс] — нагрузка и настроение по школе или по одному классу.
+    """
+    admin_id = os.getenv("ADMIN_ID")
+    if str(message.from_user.id) != admin_id:
+        await message.answer("У вас нет прав администратора!")
+        return
+    report = await analytics.get_school_report()
+    for chunk in analytics.format_report(report, (command.args or "").strip() or None):
+        await outbox.send_message(message.chat.id, chunk)
+
+# Потоковый ответ AI: сообщение-заглушка дописывается по мере генерации
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.5"))  # не чаще одной правки за столько секунд
+TELEGRAM_TEXT_LIMIT = 4096
+EMPTY_ANSWER_TEXT = "😔 Не получилось сформулировать ответ. Попробуй спросить по-другому."
+
+def split_message(text: str, limit: int = TELEGRAM_TEXT_LIMIT):
+    """
+    Делит текст на части не длиннее limit, по возможности по границам строк.
+    Пустой ответ заменяется коротким сообщением: Telegram не принимает пустой текст.
+    """
+    text = (text or "").strip()
+    if not text:
+        return [EMPTY_ANSWER_TEXT]
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+async def stream_answer(query: str, edit):
+    """
+    Собирает потоковый ответ AI и по дороге показывает его через edit(text) с ограничением частоты.
+    Если промежуточная правка не прошла или текст перестал помещаться в сообщение,
+    дальше ответ собирается молча и показывается один раз в конце.
+    """
+    loop = asyncio.get_running_loop()
+    parts = []
+    progressive = True
+    last_edit = 0.0
+    async with contextlib.aclosing(ai_helper.stream_solution(query)) as chunks:
+        async for chunk in chunks:
+            parts.append(chunk)
+            if not progressive or loop.time() - last_edit < AI_STREAM_EDIT_INTERVAL:
+                continue
+            partial = "".join(parts) + " ▌"
+            if len(partial) > TELEGRAM_TEXT_LIMIT:
+                progressive = False
+                continue
+            try:
+                await edit(partial)
+            except Exception as e:
+                logger.warning(f"Progressive edit failed, falling back to final message: {e}")
+                progressive = False
+            last_edit = loop.time()
+    return "".join(parts)
+
 @dp.message(F.text, ~F.text.startswith("/"))
 async def process_ai_query(message: types.Message):
     if message.text in ["📅 Расписание", "📝 Мои Задания", "➕ Добавить ДЗ", "🤖 AI Помощник", "📊 Статистика", "🎮 Достижения"]:
         return
-    await message.answer("⏳ Думаю...")
-    response = await ai_helper.solve_problem(message.text)
-    await message.answer(response)
+    placeholder = await message.answer("⏳ Думаю...")
+
+    shown = [placeholder.text]
+
+    async def edit_placeholder(text):
+        # Telegram отвечает ошибкой на правку без изменений
+        if text != shown[-1]:
+            shown.append(text)
+            await outbox.edit_message_text(placeholder.chat.id, placeholder.message_id, text)
+
+    try:
+        # Новый вопрос снимает предыдущий вопрос этого же ученика из очереди
+        if AI_STREAMING:
+            job = ai_queue.submit(message.from_user.id, lambda: stream_answer(message.text, edit_placeholder))
+        else:
+            job = ai_queue.submit(message.from_user.id, lambda: ai_helper.solve_problem(message.text))
+    except QueueFull:
+        await edit_placeholder("😔 Сейчас слишком много вопросов. Попробуй через минуту.")
+        return
+
+    async def show_position(position):
+        await edit_placeholder(f"⏳ Думаю... Перед тобой в очереди: {position - 1}" if position > 1 else "⏳ Думаю...")
+
+    try:
+        response = await job.result(on_position=show_position)
+    except JobCancelled as e:
+        await edit_placeholder(f"↩️ Вопрос снят: {e}.")
+        return
+    # Длинный ответ — в заглушку первая часть, остальное следующими сообщениями
+    first, *rest = split_message(response)
+    try:
+        await edit_placeholder(first)
+    except TelegramBadRequest as e:
+        # Заглушку удалили или её нельзя править — отправляем ответ отдельным сообщением
+        logger.warning(f"Final edit failed: {e}")
+        await outbox.send_message(message.chat.id, first)
+    for chunk in rest:
+        await outbox.send_message(message.chat.id, chunk)
 
 async def main():
     await init_db()
     logger.info("Database initialized")
+    await timetable.reload(force=True)
+    timetable_task = asyncio.create_task(timetable.watch())
+    warmed = await schedule_gen.prewarm_schedule_cache(timetable.get_index().as_dict())
+    logger.info(f"Schedule cache warmed: {warmed} cards, render stats: {schedule_gen.get_render_stats()}")
     print("Бот запущен!")
-    # Удаляем вебхук перед запуском polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    outbox.start(bot)
+    ai_queue.start()
+    mode = os.getenv("BOT_MODE", "polling")
+    retrain_task = asyncio.create_task(difficulty_model.run_retrain_loop())
+    reminder_task = None
+    # Рассылку напоминаний ведёт один процесс: в режиме worker она по умолчанию выключена
+    if os.getenv("REMINDERS_ENABLED", "0" if mode == "worker" else "1") == "1":
+        reminder_task = asyncio.create_task(reminders.run_reminder_loop())
+    # Режим получения апдейтов: polling (по умолчанию), webhook или router + несколько worker
+    drop_pending = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+    try:
+        if mode in ("webhook", "router", "worker"):
+            await webhook.run_webhook(bot, dp, drop_pending_updates=drop_pending, role=mode)
+        else:
+            # Удаляем вебхук перед запуском polling
+            await bot.delete_webhook(drop_pending_updates=drop_pending)
+            await dp.start_polling(bot)
+    finally:
+        timetable_task.cancel()
+        retrain_task.cancel()
+        if reminder_task:
+            reminder_task.cancel()
+        await ai_queue.stop()
+        await outbox.stop()
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
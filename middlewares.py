@@ -0,0 +1,14 @@
+from aiogram import BaseMiddleware
+
+import db_helper
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Один раз на апдейт достаёт пользователя из БД (через кэш db_helper)
+    и передаёт его в хэндлер аргументом db_user.
+    """
+
+    async def __call__(self, handler, event, data):
+        tg_user = data.get("event_from_user")
+        data["db_user"] = await db_helper.get_user_cached(tg_user.id) if tg_user else None
+        return await handler(event, data)
@@ -1,21 +1,387 @@
+import os
+import time
 import asyncio
-from sqlalchemy import text
+import logging
+from dotenv import load_dotenv
+from sqlalchemy import (
+    text, inspect, MetaData, Table, Column, Integer, String, DateTime, Date, ForeignKey, Boolean, Text,
+    UniqueConstraint, Index
+)
+from sqlalchemy.exc import IntegrityError
+
+load_dotenv()
+
 from models import engine
 
-async def migrate():
+logger = logging.getLogger(__name__)
+
+# Размер пачки для долгих миграций (бэкфиллы): каждая пачка — отдельная короткая транзакция,
+# чтобы работающий бот не ждал блокировку базы минутами
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "2000"))
+
+# Упорядоченный список миграций: (версия, описание, функция, транзакционная ли)
+MIGRATIONS = []
+
+def migration(version: int, description: str, transactional: bool = True):
+    """
+    Регистрирует миграцию. Транзакционная получает соединение внутри транзакции,
+    в которой потом записывается номер версии. Нетранзакционная (бэкфиллы пачками,
+    индексы) вызывается без аргументов и сама отвечает за идемпотентность.
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func, transactional))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+# --- снимки схемы ---
+# Таблицы в том виде, в каком их создаёт миграция. Модели из models.py сюда не подставляем:
+# иначе схема новой базы менялась бы вместе с моделями в обход миграций
+
+SNAPSHOT = MetaData()
+
+Table(
+    "users", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("telegram_id", Integer, unique=True, nullable=False),
+    Column("username", String),
+    Column("full_name", String),
+    Column("class_name", String),
+    Column("last_reminded_at", DateTime),
+    Column("xp", Integer),
+    Column("level", Integer),
+)
+
+Table(
+    "schedules", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("day_of_week", Integer),
+    Column("lesson_name", String, nullable=False),
+    Column("start_time", String),
+)
+
+Table(
+    "tasks", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("subject", String, nullable=False),
+    Column("description", Text),
+    Column("deadline", DateTime),
+    Column("is_completed", Boolean),
+    Column("difficulty", String),
+    Column("steps", Text),
+    Column("materials", Text),
+    Column("class_name", String),
+)
+
+Table(
+    "task_completions", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("task_id", Integer, ForeignKey("tasks.id", ondelete="CASCADE"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("completed_at", DateTime),
+    UniqueConstraint("task_id", "user_id", name="uq_task_completions_task_user"),
+    Index("ix_task_completions_user_task", "user_id", "task_id"),
+)
+
+Table(
+    "mood_logs", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("timestamp", DateTime),
+    Column("mood", String),
+    Column("load_level", Integer),
+)
+
+Table(
+    "achievements", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("name", String),
+    Column("earned_at", DateTime),
+)
+
+Table(
+    "telegram_files", SNAPSHOT,
+    Column("id", Integer, primary_key=True),
+    Column("slot", String, unique=True, nullable=False),
+    Column("image_hash", String, nullable=False),
+    Column("file_id", String, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+# Миграция 6
+Table(
+    "fsm_states", SNAPSHOT,
+    Column("key", String, primary_key=True),
+    Column("state", String),
+    Column("data", Text),
+    Column("updated_at", DateTime),
+)
+
+# Миграция 8
+Table(
+    "user_stats", SNAPSHOT,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("completed", Integer, nullable=False),
+    Column("on_time", Integer, nullable=False),
+    Column("current_streak", Integer, nullable=False),
+    Column("best_streak", Integer, nullable=False),
+    Column("last_completed_on", Date),
+    Column("updated_at", DateTime),
+)
+
+Table(
+    "class_stats", SNAPSHOT,
+    Column("class_name", String, primary_key=True),
+    Column("tasks_total", Integer, nullable=False),
+    Column("completions_total", Integer, nullable=False),
+    Column("on_time_total", Integer, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+BASELINE_TABLES = ("users", "schedules", "tasks", "task_completions", "mood_logs", "achievements", "telegram_files")
+
+# --- вспомогательные функции ---
+
+async def create_tables(conn, *names: str):
+    """
+    Создаёт таблицы из снимка, если их ещё нет (в старых базах часть таблиц уже есть).
+    """
+    tables = [SNAPSHOT.tables[name] for name in names]
+    await conn.run_sync(lambda sync_conn: SNAPSHOT.create_all(sync_conn, tables=tables, checkfirst=True))
+
+async def add_column_if_missing(conn, table: str, column: str, ddl_type: str):
+    columns = await conn.run_sync(lambda sync_conn: [c["name"] for c in inspect(sync_conn).get_columns(table)])
+    if column not in columns:
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+async def create_index(name: str, table: str, columns: str):
+    """
+    На Postgres индекс строится CONCURRENTLY, без блокировки записи в таблицу.
+    """
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+    else:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+async def run_in_batches(table: str, sql: str, batch_size: int = None):
+    """
+    Выполняет UPDATE/INSERT ... SELECT по диапазонам id таблицы: в sql доступны :lo и :hi.
+    Запрос должен быть идемпотентным, тогда прерванную миграцию можно просто запустить снова.
+    """
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    async with engine.connect() as conn:
+        lo, hi = (await conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {table}"))).one()
+    if lo is None:
+        return
+    for start in range(lo, hi + 1, batch_size):
+        async with engine.begin() as conn:
+            await conn.execute(text(sql), {"lo": start, "hi": start + batch_size})
+        # Отдаём управление event loop, чтобы бот успевал обрабатывать апдейты
+        await asyncio.sleep(0)
+
+# --- миграции ---
+
+@migration(1, "Базовая схема")
+async def baseline_schema(conn):
+    await create_tables(conn, *BASELINE_TABLES)
+
+@migration(2, "Колонки last_reminded_at, class_name, materials")
+async def legacy_columns(conn):
+    await add_column_if_missing(conn, "users", "last_reminded_at", "TIMESTAMP")
+    await add_column_if_missing(conn, "tasks", "class_name", "VARCHAR")
+    await add_column_if_missing(conn, "tasks", "materials", "TEXT")
+
+@migration(3, "Задания класса и отметки о выполнении", transactional=False)
+async def class_scoped_tasks():
+    # Старым заданиям проставляем класс автора
+    await run_in_batches("tasks", (
+        "UPDATE tasks SET class_name = (SELECT class_name FROM users WHERE users.id = tasks.user_id) "
+        "WHERE class_name IS NULL AND id >= :lo AND id < :hi"
+    ))
+    # Отметки о выполнении переносим в task_completions
+    await run_in_batches("tasks", (
+        "INSERT INTO task_completions (task_id, user_id, completed_at) "
+        "SELECT id, user_id, CURRENT_TIMESTAMP FROM tasks "
+        "WHERE is_completed AND user_id IS NOT NULL AND id >= :lo AND id < :hi AND NOT EXISTS ("
+        "SELECT 1 FROM task_completions tc WHERE tc.task_id = tasks.id AND tc.user_id = tasks.user_id)"
+    ))
+
+@migration(4, "Индексы заданий, пользователей, настроений и расписаний", transactional=False)
+async def query_indexes():
+    await create_index("ix_tasks_class_name", "tasks", "class_name")
+    await create_index("ix_tasks_deadline", "tasks", "deadline")
+    await create_index("ix_tasks_user_id", "tasks", "user_id")
+    await create_index("ix_users_class_name", "users", "class_name")
+    await create_index("ix_mood_logs_user_timestamp", "mood_logs", "user_id, timestamp")
+    await create_index("ix_schedules_user_id", "schedules", "user_id")
+
+@migration(5, "Расписание классов в таблице schedules")
+async def class_timetables(conn):
+    await add_column_if_missing(conn, "schedules", "class_name", "VARCHAR")
+    await add_column_if_missing(conn, "schedules", "lesson_number", "INTEGER")
+    await add_column_if_missing(conn, "schedules", "room", "VARCHAR")
+    await add_column_if_missing(conn, "schedules", "updated_at", "TIMESTAMP")
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_schedules_class_day_lesson "
+        "ON schedules (class_name, day_of_week, lesson_number)"
+    ))
+    # Переносим встроенное расписание из schedule_gen, если классов в таблице ещё нет
+    has_rows = (await conn.execute(text("SELECT 1 FROM schedules WHERE class_name IS NOT NULL LIMIT 1"))).first()
+    if has_rows:
+        return
+    from schedule_gen import РАСПИСАНИЕ
+    from timetable import default_start_time
+    rows = [
+        {"c": class_name, "d": day, "n": number, "s": subject, "r": room, "t": default_start_time(number)}
+        for class_name, days in РАСПИСАНИЕ.items()
+        for day, lessons in days.items()
+        for number, (subject, room) in enumerate(lessons, 1)
+    ]
+    await conn.execute(text(
+        "INSERT INTO schedules (class_name, day_of_week, lesson_number, lesson_name, room, start_time, updated_at) "
+        "VALUES (:c, :d, :n, :s, :r, :t, CURRENT_TIMESTAMP)"
+    ), rows)
+
+@migration(6, "Общее хранилище FSM для нескольких процессов бота")
+async def fsm_states(conn):
+    await create_tables(conn, "fsm_states")
+
+@migration(7, "Источник оценки сложности задания")
+async def difficulty_source(conn):
+    await add_column_if_missing(conn, "tasks", "difficulty_source", "VARCHAR")
+    # Раньше сложность всегда определял AI — эти задания становятся обучающей выборкой
+    await conn.execute(text(
+        "UPDATE tasks SET difficulty_source = 'llm' WHERE difficulty IS NOT NULL AND difficulty_source IS NULL"
+    ))
+
+@migration(8, "Материализованная статистика учеников и классов, уникальные достижения")
+async def materialized_stats(conn):
+    await create_tables(conn, "user_stats", "class_stats")
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_class_xp ON users (class_name, xp)"))
+    # В старых базах одно достижение могло записаться дважды — оставляем самую раннюю запись
+    await conn.execute(text(
+        "DELETE FROM achievements WHERE id NOT IN (SELECT MIN(id) FROM achievements GROUP BY user_id, name)"
+    ))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_achievements_user_name ON achievements (user_id, name)"
+    ))
+    # Начальные значения из уже накопленных данных; серии начинаются заново.
+    # У старых отметок время выполнения неизвестно (миграция 3 ставила время миграции),
+    # поэтому вовремя ли они сделаны, не считаем
+    await conn.execute(text(
+        "INSERT INTO user_stats (user_id, completed, on_time, current_streak, best_streak, updated_at) "
+        "SELECT tc.user_id, COUNT(*), 0, 0, 0, CURRENT_TIMESTAMP "
+        "FROM task_completions tc "
+        "WHERE NOT EXISTS (SELECT 1 FROM user_stats us WHERE us.user_id = tc.user_id) "
+        "GROUP BY tc.user_id"
+    ))
+    await conn.execute(text(
+        "INSERT INTO class_stats (class_name, tasks_total, completions_total, on_time_total, updated_at) "
+        "SELECT t.class_name, COUNT(DISTINCT t.id), COUNT(tc.id), 0, CURRENT_TIMESTAMP "
+        "FROM tasks t LEFT JOIN task_completions tc ON tc.task_id = t.id "
+        "WHERE t.class_name IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM class_stats cs WHERE cs.class_name = t.class_name) "
+        "GROUP BY t.class_name"
+    ))
+
+@migration(9, "Отметка «вовремя» у выполнений, пересчёт статистики")
+async def completion_on_time(conn):
+    await add_column_if_missing(conn, "task_completions", "on_time", "BOOLEAN")
+    await add_column_if_missing(conn, "user_stats", "rated", "INTEGER NOT NULL DEFAULT 0")
+    await add_column_if_missing(conn, "class_stats", "rated_total", "INTEGER NOT NULL DEFAULT 0")
+    # Уже записанные отметки не знают, были ли они вовремя (on_time остаётся NULL).
+    # Счётчики пересчитываем по исходным строкам: так уходят и расхождения после удаления заданий
+    on_time = "COALESCE(SUM(CASE WHEN tc.on_time THEN 1 ELSE 0 END), 0)"
+    await conn.execute(text(
+        "UPDATE user_stats SET "
+        "completed = (SELECT COUNT(*) FROM task_completions tc WHERE tc.user_id = user_stats.user_id), "
+        f"on_time = (SELECT {on_time} FROM task_completions tc WHERE tc.user_id = user_stats.user_id), "
+        "rated = (SELECT COUNT(tc.on_time) FROM task_completions tc WHERE tc.user_id = user_stats.user_id)"
+    ))
+    scope = "FROM task_completions tc JOIN tasks t ON t.id = tc.task_id WHERE t.class_name = class_stats.class_name"
+    await conn.execute(text(
+        "UPDATE class_stats SET "
+        "tasks_total = (SELECT COUNT(*) FROM tasks t WHERE t.class_name = class_stats.class_name), "
+        f"completions_total = (SELECT COUNT(*) {scope}), "
+        f"on_time_total = (SELECT {on_time} {scope}), "
+        f"rated_total = (SELECT COUNT(tc.on_time) {scope})"
+    ))
+
+@migration(10, "Время последней правки задания")
+async def task_updated_at(conn):
+    await add_column_if_missing(conn, "tasks", "updated_at", "TIMESTAMP")
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_updated_at ON tasks (updated_at)"))
+
+# --- запуск ---
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+async def _applied_versions():
     async with engine.begin() as conn:
-        # Добавление колонок, если их нет (SQLite специфичный подход)
-        try:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN last_reminded_at DATETIME"))
-        except:
-            pass
-        
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        return set((await conn.execute(text("SELECT version FROM schema_version"))).scalars())
+
+async def _is_applied(version: int):
+    async with engine.connect() as conn:
+        return (await conn.execute(
+            text("SELECT 1 FROM schema_version WHERE version = :v"), {"v": version}
+        )).first() is not None
+
+async def _record_version(conn, version: int, description: str):
+    await conn.execute(
+        text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+        {"v": version, "d": description}
+    )
+
+async def run_migrations():
+    """
+    Применяет недостающие миграции по порядку, каждую ровно один раз.
+    Недостающие определяются по набору записанных версий, а не по максимальной,
+    поэтому пропущенная в середине миграция применяется при следующем запуске.
+    На первой упавшей миграции запуск останавливается с ошибкой.
+    Если схема актуальна, это один лёгкий запрос к schema_version.
+    """
+    started = time.perf_counter()
+    applied = await _applied_versions()
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        logger.info(f"Schema is up to date (v{LATEST_VERSION}), checked in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return LATEST_VERSION
+
+    for version, description, func, transactional in pending:
+        step_started = time.perf_counter()
         try:
-            await conn.execute(text("ALTER TABLE tasks ADD COLUMN class_name VARCHAR"))
-        except:
-            pass
-            
-    print("Миграция завершена!")
+            if transactional:
+                async with engine.begin() as conn:
+                    await func(conn)
+                    await _record_version(conn, version, description)
+            else:
+                await func()
+                async with engine.begin() as conn:
+                    await _record_version(conn, version, description)
+        except IntegrityError:
+            # Ту же миграцию параллельно применил другой процесс — тогда её версия уже записана.
+            # Иначе это ошибка в самой миграции, и идти дальше по схеме нельзя
+            if not await _is_applied(version):
+                logger.error(f"Migration {version} ({description}) failed")
+                raise
+            logger.info(f"Migration {version} already applied by another process")
+            continue
+        logger.info(f"Migration {version} ({description}) applied in {time.perf_counter() - step_started:.2f} s")
+    return max(await _applied_versions())
+
+async def migrate():
+    version = await run_migrations()
+    print(f"Миграция завершена! Версия схемы: {version}")
 
 if __name__ == "__main__":
     asyncio.run(migrate())
@@ -0,0 +1,201 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from rate_limit import ChatRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Настройки отправки (можно переопределить через .env)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+# Приоритеты: ответы пользователю раньше массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+
+class _Lane:
+    """
+    Очередь одного чата. Пока чат обрабатывается или ждёт лимита, его нет в очереди готовых.
+    """
+
+    def __init__(self):
+        self.items = deque()  # [priority, call, future, attempts]
+        self.interactive = 0
+        self.token = 0  # меняется при перепланировании — старые записи в кучах игнорируются
+        self.busy = False
+        self.not_before = 0.0
+
+    @property
+    def priority(self) -> int:
+        return INTERACTIVE if self.interactive else BULK
+
+class Outbox:
+    """
+    Общая очередь исходящих сообщений. Соблюдает общий и поканальный лимиты Telegram,
+    сама повторяет запрос после RetryAfter. Сообщения одного чата уходят строго по очереди.
+
+    Из готовых чатов воркер берёт сначала те, где ждёт интерактивное сообщение, поэтому
+    рассылка напоминаний не задерживает ответы. Чат, который упёрся в свой лимит или получил
+    RetryAfter, откладывается до нужного момента, а воркер тем временем обслуживает другие чаты.
+    """
+
+    def __init__(self, limiter: ChatRateLimiter, workers: int = OUTBOX_WORKERS, max_retries: int = OUTBOX_MAX_RETRIES):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.workers_count = workers
+        self.bot = None
+        self._lanes = {}  # чат -> _Lane
+        self._ready = []  # (приоритет, порядковый номер, чат, token)
+        self._delayed = []  # (не раньше, порядковый номер, чат, token)
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self._size = 0
+        self._workers = []
+
+    def start(self, bot):
+        self.bot = bot
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def stop(self):
+        while self._size:
+            self._changed.clear()
+            await self._changed.wait()
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def pending(self) -> int:
+        return self._size
+
+    async def submit(self, chat_id: int, call, priority: int = INTERACTIVE):
+        """
+        Ставит в очередь вызов API для чата. call — функция без аргументов, возвращающая корутину
+        (например, lambda: bot.send_message(...)), чтобы её можно было повторить.
+        """
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane()
+        was_priority = lane.priority if lane.items else None
+        lane.items.append([priority, call, future, 0])
+        self._size += 1
+        if priority == INTERACTIVE:
+            lane.interactive += 1
+        # Новый чат или чат, который стоял в очереди как массовый, а теперь ждёт ответа пользователю
+        if not lane.busy and lane.priority != was_priority:
+            self._schedule(chat_id, lane)
+        return await future
+
+    async def send_message(self, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs):
+        return await self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), priority)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, priority: int = INTERACTIVE, **kwargs):
+        return await self.submit(
+            chat_id, lambda: self.bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs),
+            priority
+        )
+
+    def _schedule(self, chat_id: int, lane: _Lane, delay: float = 0.0):
+        loop = asyncio.get_running_loop()
+        lane.token += 1
+        if delay > 0:
+            lane.not_before = loop.time() + delay
+        if lane.not_before > loop.time():
+            heapq.heappush(self._delayed, (lane.not_before, next(self._seq), chat_id, lane.token))
+        else:
+            heapq.heappush(self._ready, (lane.priority, next(self._seq), chat_id, lane.token))
+        self._changed.set()
+
+    def _is_current(self, chat_id: int, token: int) -> bool:
+        lane = self._lanes.get(chat_id)
+        return lane is not None and not lane.busy and lane.token == token
+
+    async def _next_chat(self):
+        """
+        Следующий готовый чат с наивысшим приоритетом; ждёт, пока такой появится.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_id, token = heapq.heappop(self._delayed)
+                if self._is_current(chat_id, token):
+                    self._schedule(chat_id, self._lanes[chat_id])
+            while self._ready:
+                _, _, chat_id, token = heapq.heappop(self._ready)
+                if self._is_current(chat_id, token):
+                    return chat_id
+            self._changed.clear()
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pop(self, chat_id: int, lane: _Lane):
+        priority, _, future, _ = lane.items.popleft()
+        self._size -= 1
+        if priority == INTERACTIVE:
+            lane.interactive -= 1
+        if not lane.items:
+            del self._lanes[chat_id]
+            self._changed.set()
+        return future
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._next_chat()
+            lane = self._lanes[chat_id]
+            item = lane.items[0]
+            _, call, future, attempts = item
+            if future.done():
+                # Вызывающий уже не ждёт (например, отменён потоковый ответ)
+                self._pop(chat_id, lane)
+            else:
+                wait = self.limiter.try_acquire_chat(chat_id)
+                if wait > 0:
+                    self._schedule(chat_id, lane, wait)
+                    continue
+                lane.busy = True
+                retry_after = None
+                try:
+                    await self.limiter.global_bucket.acquire()
+                    result = await call()
+                except TelegramRetryAfter as e:
+                    item[3] += 1
+                    if item[3] > self.max_retries:
+                        self._pop(chat_id, lane)
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        logger.warning(f"Flood limit for chat {chat_id}, retry in {e.retry_after}s")
+                        retry_after = e.retry_after
+                except Exception as e:
+                    self._pop(chat_id, lane)
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self._pop(chat_id, lane)
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    lane.busy = False
+                if retry_after is not None:
+                    self._schedule(chat_id, lane, retry_after)
+                    continue
+            if lane.items:
+                self._schedule(chat_id, lane)
+
+outbox = Outbox(ChatRateLimiter(
+    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "25")),
+    chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+    chat_burst=float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+))
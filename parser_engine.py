@@ -1,13 +1,307 @@
+import os
 import re
+import asyncio
 import datetime
-from ai_helper import split_task_into_steps
+import logging
+
+import ai_helper
+import db_helper
+import difficulty_model
+import timetable
+import task_pipeline
+from llm_client import LLMError
+
+logger = logging.getLogger(__name__)
+
+# --- Таблицы разбора ---
+
+# Основа слова -> название предмета (как в расписании). Проверяются от длинных к коротким,
+# поэтому «физкульт» не путается с «физик»
+SUBJECT_STEMS = {
+    "разговоры о важном": "Разговоры о важном",
+    "математ": "Математика", "матем": "Математика",
+    "алгебр": "Алгебра",
+    "геометр": "Геометрия",
+    "русск": "Русский язык", "рус.яз": "Русский язык",
+    "литератур": "Литература", "лит-р": "Литература",
+    "английск": "Английский язык", "англ": "Английский язык",
+    "физкульт": "Физкультура",
+    "физик": "Физика",
+    "хими": "Химия",
+    "биолог": "Биология",
+    "географ": "География",
+    "истори": "История",
+    "обществозн": "Обществознание",
+    "информатик": "Информатика",
+    "музык": "Музыка",
+    "технолог": "Технология",
+}
+
+# Короткие и разговорные названия — только целым словом
+SUBJECT_WORDS = {
+    "матан": "Математика", "матеша": "Математика", "матешу": "Математика", "матеше": "Математика",
+    "русский": "Русский язык", "русскому": "Русский язык", "русяз": "Русский язык",
+    "лит-ра": "Литература", "литра": "Литература",
+    "физра": "Физкультура", "физру": "Физкультура", "физре": "Физкультура",
+    "общага": "Обществознание", "общество": "Обществознание",
+    "инфа": "Информатика", "инфу": "Информатика", "инфе": "Информатика",
+    "обж": "ОБЖ", "изо": "ИЗО", "труд": "Технология", "труды": "Технология",
+}
+
+# Если у класса нет такого предмета в расписании, пробуем родственные
+SUBJECT_FALLBACKS = {
+    "Математика": ("Алгебра", "Геометрия"),
+}
+
+WEEKDAY_FORMS = {
+    0: ("понедельник", "понедельника", "понедельнику"),
+    1: ("вторник", "вторника", "вторнику"),
+    2: ("среда", "среду", "среды", "среде"),
+    3: ("четверг", "четверга", "четвергу"),
+    4: ("пятница", "пятницу", "пятницы", "пятнице"),
+    5: ("суббота", "субботу", "субботы", "субботе"),
+    6: ("воскресенье", "воскресенья", "воскресенью"),
+}
+# Сокращения совпадают с обычными словами («ср. с прошлым»), поэтому считаются сроком
+# только после предлога («к ср», «до вс») или в самом конце текста
+WEEKDAY_ABBREVIATIONS = {"пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6}
+WEEKDAYS = {form: day for day, forms in WEEKDAY_FORMS.items() for form in forms}
+WEEKDAYS.update(WEEKDAY_ABBREVIATIONS)
+
+MONTH_FORMS = {
+    1: ("января", "январь"), 2: ("февраля", "февраль"), 3: ("марта", "март"), 4: ("апреля", "апрель"),
+    5: ("мая", "май"), 6: ("июня", "июнь"), 7: ("июля", "июль"), 8: ("августа", "август"),
+    9: ("сентября", "сентябрь"), 10: ("октября", "октябрь"), 11: ("ноября", "ноябрь"), 12: ("декабря", "декабрь"),
+}
+MONTHS = {form: month for month, forms in MONTH_FORMS.items() for form in forms}
+
+RELATIVE_DAYS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+
+NUMBER_WORDS = {
+    "один": 1, "одну": 1, "одного": 1, "два": 2, "две": 2, "двух": 2, "три": 3, "трёх": 3, "трех": 3,
+    "четыре": 4, "четырёх": 4, "четырех": 4, "пять": 5, "шесть": 6, "семь": 7, "восемь": 8,
+    "девять": 9, "десять": 10, "пару": 2, "пар": 2,
+}
+
+UNIT_STEMS = {"час": "hours", "дн": "days", "день": "days", "недел": "weeks"}
+
+# Сколько обращений к AI одновременно при разборе пачки заданий
+BATCH_AI_CONCURRENCY = int(os.getenv("BATCH_AI_CONCURRENCY", "4"))
+
+# Срок «к дню» — начало учебного дня; «сегодня» — конец дня
+DEFAULT_DUE_TIME = datetime.time(8, 0)
+TODAY_DUE_TIME = datetime.time(23, 59)
+
+def _alternation(words):
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+_NUMBER = rf"(?:\d+|{_alternation(NUMBER_WORDS)})"
+
+# Порядок важен: более конкретные шаблоны проверяются раньше
+# «на пару» обычно значит «вдвоём», поэтому пара с «на» — только «на следующую/ближайшую пару»
+_NEXT_LESSON = r"(?:(?:следующ|ближайш)\w*\s+)"
+_LESSON_RE = re.compile(
+    rf"\b(?:(?:к|на|до)\s+{_NEXT_LESSON}?(?:урок\w*|занят\w*)|(?:к|до)\s+{_NEXT_LESSON}?пар[аеуы]?"
+    rf"|на\s+{_NEXT_LESSON}пар[аеуы]?)\b"
+    r"(?:\s+(?P<subject>[\w.\-]+(?:\s+язык\w*)?))?",
+    re.IGNORECASE
+)
+_DATE_RE = re.compile(r"\b(?P<day>\d{1,2})[./](?P<month>\d{1,2})(?:[./](?P<year>\d{2}|\d{4}))?\b")
+# «15.03» — дата, только если это не номер упражнения, параграфа или главы («№3.12», «§1.2», «1.2 главу»)
+_NUMBERING = r"(?:№|§|стр\w*|с\.|упр\w*|номер\w*|глав\w*|параграф\w*|пункт\w*|п\.|задач\w*|тем[аеуы]?)"
+_DATE_NUMBERING_BEFORE_RE = re.compile(rf"{_NUMBERING}\.?\s*(?:[\d.,\-–]|\s|\bи\b)*$")
+_DATE_NUMBERING_AFTER_RE = re.compile(rf"\s*{_NUMBERING}")
+_DATE_PREPOSITION_RE = re.compile(r"\b(?:к|до|на)\s+$")
+_MONTH_DATE_RE = re.compile(rf"\b(?P<day>\d{{1,2}})\s+(?P<month>{_alternation(MONTHS)})\b", re.IGNORECASE)
+_RELATIVE_RE = re.compile(rf"\b(?P<word>{_alternation(RELATIVE_DAYS)})\b", re.IGNORECASE)
+_OFFSET_RE = re.compile(
+    rf"\bчерез\s+(?:(?P<number>{_NUMBER})\s+)?(?P<unit>{_alternation(UNIT_STEMS)})\w*\b", re.IGNORECASE
+)
+_WEEKDAY_RE = re.compile(
+    rf"\b(?:(?P<next>следующ\w*)\s+)?(?P<weekday>{_alternation(sum(WEEKDAY_FORMS.values(), ()))})\b", re.IGNORECASE
+)
+_WEEKDAY_ABBREVIATION_RE = re.compile(
+    rf"(?:(?P<preposition>\b(?:к|до|на|во?)\s+)(?:(?P<next>следующ\w*)\s+)?|(?<![\w.\-]))"
+    rf"(?P<weekday>{_alternation(WEEKDAY_ABBREVIATIONS)})(?(preposition)\b|\.?\s*$)",
+    re.IGNORECASE
+)
+_TIME_RE = re.compile(r"\b(?P<hour>[01]?\d|2[0-3]):(?P<minute>[0-5]\d)\b")
+_SUBJECT_RE = re.compile(
+    rf"(?<![\w.\-])(?:(?P<word>{_alternation(SUBJECT_WORDS)})(?![\w\-])|(?P<stem>{_alternation(SUBJECT_STEMS)}))",
+    re.IGNORECASE
+)
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*([\w\s.\-]+?)\s*:")
+_BULLET_RE = re.compile(r"^\s*(?:[-•*—–]|\d{1,2}[.)](?!\d))\s*")
+# Явный срок в строке задания: «к пятнице», «до 15.03»
+_EXPLICIT_DEADLINE_RE = re.compile(r"\b(?:к|до)\s+", re.IGNORECASE)
+
+# --- Предметы ---
+
+def normalize_subject(text: str, class_name: str = None):
+    """
+    Название предмета в виде, как в расписании («алгебре» -> «Алгебра»), или None.
+    Для класса сначала сверяется с предметами его расписания.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    if class_name:
+        for subject in _class_subjects(class_name):
+            if subject.lower() == text.lower():
+                return subject
+    match = _SUBJECT_RE.search(text.lower())
+    if not match:
+        return None
+    return SUBJECT_WORDS[match.group("word")] if match.group("word") else SUBJECT_STEMS[match.group("stem")]
+
+def _class_subjects(class_name: str):
+    index = timetable.get_index()
+    return {lesson.subject for day in range(7) for lesson in index.lessons(class_name, day)}
+
+def next_lesson_start(class_name: str, subject: str, now: datetime.datetime):
+    """
+    Начало ближайшего урока предмета у класса после now (None, если предмета нет в расписании).
+    """
+    index = timetable.get_index()
+    names = {name.lower() for name in (subject,) + SUBJECT_FALLBACKS.get(subject, ())}
+    days = {day for name in names for day in index.subject_days(class_name, name)}
+    for offset in range(8):
+        date = now.date() + datetime.timedelta(days=offset)
+        if date.weekday() not in days:
+            continue
+        for lesson in index.lessons(class_name, date.weekday()):
+            if lesson.subject.lower() not in names or lesson.start is None:
+                continue
+            start = datetime.datetime.combine(date, datetime.time(lesson.start // 60, lesson.start % 60))
+            if start > now:
+                return start
+    return None
+
+# --- Сроки ---
+
+def _at(date: datetime.date, time: datetime.time = DEFAULT_DUE_TIME):
+    return datetime.datetime.combine(date, time)
+
+def _number(value: str):
+    if not value:
+        return 1
+    return int(value) if value.isdigit() else NUMBER_WORDS[value.lower()]
+
+def parse_deadline(text: str, class_name: str = None, subject: str = None, now: datetime.datetime = None):
+    """
+    Разбирает срок сдачи из русского текста без обращения к AI.
+    Понимает «завтра», «послезавтра», «к пятнице», «в следующий вторник», «через 3 дня»,
+    «через 5 часов», «15.03», «15 марта», «к следующему уроку (математики)» и время «18:00».
+    Возвращает datetime или None, если срок в тексте не найден.
+    """
+    now = now or datetime.datetime.now()
+    today = now.date()
+    lowered = text.lower()
+    date = None
+    time = None
+
+    match = _LESSON_RE.search(lowered)
+    if match and class_name:
+        lesson_subject = normalize_subject(match.group("subject") or "", class_name) or subject
+        if lesson_subject:
+            start = next_lesson_start(class_name, lesson_subject, now)
+            if start:
+                return start
+
+    match = _OFFSET_RE.search(lowered)
+    if match:
+        amount = _number(match.group("number"))
+        unit = UNIT_STEMS[match.group("unit")]
+        if unit == "hours":
+            return now + datetime.timedelta(hours=amount)
+        date = today + datetime.timedelta(days=amount * (7 if unit == "weeks" else 1))
+
+    # «к 15.03» — явная дата; голое «15.03» уступает дню недели и «завтра»
+    date_match, explicit_date = _find_date(lowered)
+    if date is None and explicit_date:
+        date = _date_from_match(today, date_match)
+    if date is None:
+        match = _MONTH_DATE_RE.search(lowered)
+        if match:
+            date = _calendar_date(today, int(match.group("day")), MONTHS[match.group("month")])
+    if date is None:
+        match = _RELATIVE_RE.search(lowered)
+        if match:
+            offset = RELATIVE_DAYS[match.group("word")]
+            date = today + datetime.timedelta(days=offset)
+            if offset == 0:
+                time = TODAY_DUE_TIME
+    if date is None:
+        match = _WEEKDAY_RE.search(lowered) or _WEEKDAY_ABBREVIATION_RE.search(lowered)
+        if match:
+            weekday = WEEKDAYS[match.group("weekday")]
+            if match.group("next"):
+                # «в следующую пятницу» — пятница следующей недели
+                date = today + datetime.timedelta(days=7 - today.weekday() + weekday)
+            else:
+                date = today + datetime.timedelta(days=(weekday - today.weekday()) % 7 or 7)
+    if date is None and date_match:
+        date = _date_from_match(today, date_match)
+
+    match = _TIME_RE.search(lowered)
+    if match:
+        time = datetime.time(int(match.group("hour")), int(match.group("minute")))
+        date = date or (today if time > now.time() else today + datetime.timedelta(days=1))
+    if date is None:
+        return None
+    return _at(date, time or DEFAULT_DUE_TIME)
+
+def _find_date(lowered: str):
+    """
+    Первая дата вида «15.03» (совпадение, стоит ли перед ней «к/до/на»); номера упражнений пропускаются.
+    Дата с предлогом важнее голой.
+    """
+    bare = None
+    for match in _DATE_RE.finditer(lowered):
+        before = lowered[:match.start()]
+        if _DATE_NUMBERING_BEFORE_RE.search(before) or _DATE_NUMBERING_AFTER_RE.match(lowered, match.end()):
+            continue
+        if _DATE_PREPOSITION_RE.search(before):
+            return match, True
+        bare = bare or match
+    return bare, False
+
+def _date_from_match(today: datetime.date, match):
+    return _calendar_date(today, int(match.group("day")), int(match.group("month")), match.group("year"))
+
+def _calendar_date(today: datetime.date, day: int, month: int, year: str = None):
+    try:
+        if year:
+            return datetime.date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+        date = datetime.date(today.year, month, day)
+        # Дата без года, которая уже прошла, — это следующий год
+        return date if date >= today else date.replace(year=today.year + 1)
+    except ValueError:
+        return None
+
+async def llm_deadline(text: str, now: datetime.datetime = None):
+    """
+    Запасной вариант для формулировок, которые не разобрал parse_deadline.
+    """
+    now = now or datetime.datetime.now()
+    prompt = (
+        f"Сейчас {now.strftime('%Y-%m-%d %H:%M')} ({now.strftime('%A')}). "
+        f"Определи срок сдачи задания из текста и ответь только датой в формате ГГГГ-ММ-ДД ЧЧ:ММ. "
+        f"Если срока нет, ответь «нет».\n\nТекст: {text}"
+    )
+    try:
+        answer = await ai_helper.get_llm_client().complete("", prompt)
+        return datetime.datetime.strptime(answer.strip()[:16], "%Y-%m-%d %H:%M")
+    except (LLMError, ValueError) as e:
+        logger.info(f"LLM deadline fallback failed: {e}")
+        return None
 
 class DataParser:
     """
     Архитектура: Принять - Обработать - Отдать
     Этот класс отвечает за интеллектуальный разбор пользовательского ввода и его трансформацию в структурированные данные.
     """
-    
+
     @staticmethod
     async def accept_input(raw_text: str):
         """
@@ -16,34 +310,108 @@ class DataParser:
         return raw_text.strip()
 
     @staticmethod
-    async def process_task(text: str):
+    def parse_task(text: str, class_name: str = None, now: datetime.datetime = None, default_deadline=None):
         """
-        ОБРАБОТАТЬ: Анализ текста, извлечение предмета и дедлайна, декомпозиция задачи.
+        Разбор без AI: предмет, описание и срок (default_deadline, если срок не найден).
         """
-        # 1. Извлечение предмета (первое слово или слово перед двоеточием)
-        subject = "Общее"
-        match_subject = re.match(r"^([\w\s]+):", text)
+        # 1. Предмет: слово перед двоеточием или упоминание известного предмета
+        subject = None
+        match_subject = _SUBJECT_PREFIX_RE.match(text)
         if match_subject:
-            subject = match_subject.group(1).strip()
-            text = text[len(match_subject.group(0)):].strip()
-        
-        # 2. Поиск даты (простой парсер для примера)
-        deadline = datetime.datetime.now() + datetime.timedelta(days=1)
-        if "завтра" in text.lower():
-            deadline = datetime.datetime.now() + datetime.timedelta(days=1)
-        elif "послезавтра" in text.lower():
-            deadline = datetime.datetime.now() + datetime.timedelta(days=2)
-            
-        # 3. Декомпозиция через AI
-        steps = await split_task_into_steps(text)
-        
+            prefix = match_subject.group(1).strip()
+            rest = text[len(match_subject.group(0)):].strip()
+            subject = normalize_subject(prefix, class_name)
+            if subject is None:
+                # «Пт: Алгебра №12» — перед двоеточием срок, а не предмет
+                prefix_deadline = parse_deadline(prefix, class_name=class_name, now=now)
+                if prefix_deadline:
+                    return DataParser.parse_task(rest, class_name, now, default_deadline=prefix_deadline)
+            subject = subject or prefix
+            text = rest
+        else:
+            subject = normalize_subject(text, class_name)
+
+        # 2. Срок по таблицам; урок без предмета ищется по предмету задания.
+        # Срок раздела перекрывается только явным сроком строки («к …», «до …»):
+        # «Алгебра: №3.12» в разделе «Пятница:» сдаётся в пятницу
+        deadline_text = text
+        if default_deadline is not None:
+            match = _EXPLICIT_DEADLINE_RE.search(text)
+            deadline_text = text[match.start():] if match else ""
+        deadline = (deadline_text and parse_deadline(deadline_text, class_name=class_name, subject=subject, now=now)) \
+            or default_deadline
         return {
-            "subject": subject,
+            "subject": subject or "Общее",
             "description": text,
             "deadline": deadline,
-            "steps": steps
         }
 
+    @staticmethod
+    async def process_task(text: str, class_name: str = None, now: datetime.datetime = None):
+        """
+        ОБРАБОТАТЬ: Анализ текста, извлечение предмета и дедлайна, декомпозиция задачи.
+        """
+        now = now or datetime.datetime.now()
+        data = DataParser.parse_task(text, class_name, now)
+
+        # AI — только для сроков, которые не разобрали правила
+        if data["deadline"] is None:
+            data["deadline"] = await llm_deadline(text, now) or now + datetime.timedelta(days=1)
+
+        # 3. Декомпозиция через AI
+        data["steps"] = await ai_helper.get_task_steps(ai_helper.task_text(data["subject"], data["description"]))
+        return data
+
+    @staticmethod
+    def parse_batch(raw_text: str, class_name: str = None, now: datetime.datetime = None):
+        """
+        Разбор многострочного ввода за один проход: строка — задание.
+        Строка только со сроком («Пятница:», «К 15.03») задаёт срок следующим заданиям без своего срока.
+        """
+        now = now or datetime.datetime.now()
+        items = []
+        section_deadline = None
+        for line in raw_text.splitlines():
+            line = _BULLET_RE.sub("", line).strip()
+            if not line:
+                continue
+            header = line.rstrip(":").strip()
+            if len(header.split()) <= 3 and normalize_subject(header, class_name) is None:
+                header_deadline = parse_deadline(header, class_name=class_name, now=now)
+                if header_deadline:
+                    section_deadline = header_deadline
+                    continue
+            items.append(DataParser.parse_task(line, class_name, now, default_deadline=section_deadline))
+        return items
+
+    @staticmethod
+    async def process_batch(items, now: datetime.datetime = None, concurrency: int = BATCH_AI_CONCURRENCY):
+        """
+        Обращения к AI для всей пачки идут параллельно, но не больше concurrency одновременно.
+        """
+        now = now or datetime.datetime.now()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def enrich(item):
+            async with semaphore:
+                if item["deadline"] is None:
+                    item["deadline"] = await llm_deadline(item["description"], now) or now + datetime.timedelta(days=1)
+                steps = await ai_helper.get_task_steps(ai_helper.task_text(item["subject"], item["description"]))
+                # Ошибку AI не сохраняем: план сгенерируется в фоне или по запросу
+                item["steps"] = steps if ai_helper.is_good_answer(steps) else None
+
+        await asyncio.gather(*(enrich(item) for item in items))
+        return items
+
+    @staticmethod
+    def deliver_batch_response(items):
+        response = f"✅ Добавлено заданий: {len(items)}\n\n"
+        for item in sorted(items, key=lambda i: i["deadline"]):
+            response += f"📚 {item['subject']} — {item['description']} (до {item['deadline'].strftime('%d.%m %H:%M')})\n"
+        planned = sum(1 for item in items if item.get("steps"))
+        response += f"\n📝 План выполнения готов для {planned} из {len(items)}."
+        return response
+
     @staticmethod
     async def deliver_response(processed_data: dict):
         """
@@ -56,17 +424,38 @@ class DataParser:
         response += "Удачи с выполнением! Я напомню тебе о дедлайне. 😉"
         return response
 
-async def handle_user_task_input(raw_text: str):
+async def handle_user_task_input(raw_text: str, class_name: str = None):
     """
     Pipeline: Accept -> Process -> Deliver
     """
     # Accept
     input_text = await DataParser.accept_input(raw_text)
-    
+
     # Process
-    processed_data = await DataParser.process_task(input_text)
-    
+    processed_data = await DataParser.process_task(input_text, class_name)
+
     # Deliver
     final_output = await DataParser.deliver_response(processed_data)
-    
+
     return final_output, processed_data
+
+async def handle_user_task_batch(raw_text: str, user_id: int, class_name: str = None):
+    """
+    Pipeline для пачки заданий: разбор всех строк, параллельные обращения к AI,
+    запись одной транзакцией и один общий ответ.
+    """
+    now = datetime.datetime.now()
+    items = DataParser.parse_batch(raw_text, class_name, now)
+    if not items:
+        return "Не нашёл ни одного задания. Пиши по заданию на строку: «Алгебра: №123 к пятнице».", []
+
+    for item in items:
+        difficulty, confidence = difficulty_model.classify(item["subject"], item["description"])
+        item["difficulty"] = difficulty
+        item["difficulty_source"] = "model" if difficulty_model.is_confident(confidence) else None
+    await DataParser.process_batch(items, now)
+    tasks = await db_helper.add_tasks(user_id, class_name, items)
+    # Материалы (и сложность, если модель не уверена) — в фоне, как для одиночного задания
+    for task in tasks:
+        task_pipeline.schedule_task_artifacts(task.id)
+    return DataParser.deliver_batch_response(items), tasks
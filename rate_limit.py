@@ -0,0 +1,80 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity в запасе.
+    acquire() ждёт, пока появится токен.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """
+        Сколько секунд ждать до следующего токена (0 — можно сразу).
+        """
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> float:
+        """
+        Берёт токен без ожидания: 0 — токен взят, иначе через сколько секунд он появится.
+        """
+        wait = self.delay()
+        if wait <= 0:
+            self._tokens -= 1
+        return wait
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                wait = self.delay()
+                if wait <= 0:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep(wait)
+
+class ChatRateLimiter:
+    """
+    Лимиты Telegram: общий на бота и отдельный на каждый чат.
+    Корзины чатов хранятся в LRU, чтобы тысячи пользователей не раздували память.
+    """
+
+    def __init__(self, global_rate: float = 25, chat_rate: float = 1, chat_burst: float = 1, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def try_acquire_chat(self, chat_id: int) -> float:
+        """
+        Токен чата без ожидания (см. TokenBucket.try_acquire); общий лимит берётся отдельно.
+        """
+        return self._chat_bucket(chat_id).try_acquire()
+
+    async def acquire(self, chat_id: int):
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
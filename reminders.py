@@ -0,0 +1,75 @@
+import os
+import asyncio
+import logging
+import datetime
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+import db_helper
+from outbox import outbox, BULK
+
+logger = logging.getLogger(__name__)
+
+# Настройки напоминаний (можно переопределить через .env)
+REMINDER_TICK = int(os.getenv("REMINDER_TICK", "300"))  # как часто проверять, секунды
+REMINDER_WINDOW_HOURS = int(os.getenv("REMINDER_WINDOW_HOURS", "24"))  # за сколько часов до дедлайна напоминать
+REMINDER_COOLDOWN_HOURS = int(os.getenv("REMINDER_COOLDOWN_HOURS", "12"))  # не чаще, чем раз в N часов
+
+def format_reminder(tasks):
+    lines = ["⏰ *Скоро дедлайн:*", ""]
+    for subject, deadline in tasks:
+        lines.append(f"• {subject} — {deadline.strftime('%d.%m %H:%M')}")
+    lines.append("")
+    lines.append("Открой «📝 Мои Задания», чтобы отметить выполненные.")
+    return "\n".join(lines)
+
+async def send_due_reminders(now: datetime.datetime = None):
+    """
+    Один проход: находит задания с близким дедлайном, шлёт каждому ученику одно сообщение
+    со всеми его заданиями и отмечает last_reminded_at одним UPDATE.
+    """
+    now = now or datetime.datetime.now()
+    rows = await db_helper.get_due_reminders(
+        now=now,
+        horizon=now + datetime.timedelta(hours=REMINDER_WINDOW_HOURS),
+        reminded_before=now - datetime.timedelta(hours=REMINDER_COOLDOWN_HOURS)
+    )
+
+    # Группируем по ученику: одно сообщение вместо сообщения на каждое задание
+    per_user = {}
+    for user_id, telegram_id, subject, deadline in rows:
+        per_user.setdefault((user_id, telegram_id), []).append((subject, deadline))
+
+    async def send(user_id, telegram_id, tasks):
+        try:
+            # Очередь отправки сама соблюдает лимиты Telegram и повторяет запрос после RetryAfter
+            await outbox.send_message(telegram_id, format_reminder(tasks), priority=BULK)
+            return user_id
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат недоступен — не пытаемся снова до следующего окна
+            logger.info(f"Reminder to {telegram_id} skipped: {e}")
+            return user_id
+        except Exception as e:
+            logger.error(f"Error sending reminder to {telegram_id}: {e}")
+            return None
+
+    results = await asyncio.gather(*[
+        send(user_id, telegram_id, tasks) for (user_id, telegram_id), tasks in per_user.items()
+    ])
+    reminded = [user_id for user_id in results if user_id is not None]
+
+    await db_helper.mark_reminded(reminded, now)
+    return len(reminded)
+
+async def run_reminder_loop():
+    logger.info(f"Reminder scheduler started (tick {REMINDER_TICK}s, window {REMINDER_WINDOW_HOURS}h)")
+    while True:
+        try:
+            sent = await send_due_reminders()
+            if sent:
+                logger.info(f"Reminders sent: {sent}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reminder tick failed: {e}")
+        await asyncio.sleep(REMINDER_TICK)
@@ -1,11 +1,18 @@
 from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
 
 # Папка для статики
 IMG_DIR = "/home/ubuntu/smart_diary_bot/static/schedules"
 os.makedirs(IMG_DIR, exist_ok=True)
 
-# Полное расписание для всех классов
+# Начальное расписание для всех классов. Миграция переносит его в таблицу schedules,
+# дальше источник правды — БД (см. timetable.py)
 РАСПИСАНИЕ = {
     "6А": {
         0: [("Математика", "205"), ("Русский язык", "304"), ("История", "210"), ("Физкультура", "Зал"), ("Биология", "401"), ("География", "403")],
@@ -34,32 +41,184 @@ os.makedirs(IMG_DIR, exist_ok=True)
 for cls in ["7В", "7С", "8А", "8Б", "9А", "10А", "11А"]:
     РАСПИСАНИЕ[cls] = РАСПИСАНИЕ["7А"]
 
-def generate_schedule_image(class_name, day_index, schedule_items):
-    width = 800
-    padding = 50
-    header_height = 150
-    item_height = 90
-    item_spacing = 20
+# Параметры отрисовки карточки. Входят в ключ кэша: поменяли дизайн — старые картинки не используются
+RENDER_PARAMS = {
+    "version": 1,
+    "width": 800,
+    "padding": 50,
+    "header_height": 150,
+    "item_height": 90,
+    "item_spacing": 20,
+    "bg_color": (255, 255, 255),
+    "accent_color": (63, 81, 181),
+    "text_main": (33, 33, 33),
+    "text_secondary": (117, 117, 117),
+    "card_bg": (245, 247, 250),
+}
+
+# (класс, день) -> (хэш содержимого, путь к файлу)
+_image_cache = {}
+
+# Пул для рендера: PIL — синхронная CPU-работа, в event loop её выполнять нельзя
+RENDER_WORKERS = int(os.getenv("SCHEDULE_RENDER_WORKERS", "2"))
+_render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="schedule-render")
+_inflight = {}  # хэш -> asyncio.Task текущего рендера
+_fonts_local = threading.local()
+_stats_lock = threading.Lock()
+RENDER_STATS = {"queued": 0, "rendered": 0, "coalesced": 0, "total_render_ms": 0.0, "last_render_ms": 0.0}
+
+def schedule_image_hash(class_name, day_index, schedule_items):
+    """
+    Хэш всего, что попадает на картинку: класс, день, уроки и параметры отрисовки.
+    Одинаковое содержимое даёт одинаковый хэш и один файл на диске.
+    """
+    payload = json.dumps(
+        [class_name, day_index, [list(item) for item in schedule_items], RENDER_PARAMS],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def _cached_path(class_name, day_index, image_hash):
+    cached = _image_cache.get((class_name, day_index))
+    if cached and cached[0] == image_hash and os.path.exists(cached[1]):
+        return cached[1]
+    return None
+
+def _render_to_file(class_name, day_index, schedule_items, file_path):
+    """
+    Рисует карточку, если файла ещё нет. Выполняется в пуле потоков.
+    """
+    if not os.path.exists(file_path):
+        started = time.perf_counter()
+        generate_schedule_image(class_name, day_index, schedule_items, file_path=file_path)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with _stats_lock:
+            RENDER_STATS["rendered"] += 1
+            RENDER_STATS["total_render_ms"] += elapsed_ms
+            RENDER_STATS["last_render_ms"] = elapsed_ms
+    return file_path
+
+def get_schedule_image(class_name, day_index, schedule_items):
+    """
+    Возвращает путь к карточке расписания, рисуя её только если такой ещё нет.
+    Синхронная версия для скриптов; из хэндлеров используйте render_schedule_image.
+    """
+    image_hash = schedule_image_hash(class_name, day_index, schedule_items)
+    cached = _cached_path(class_name, day_index, image_hash)
+    if cached:
+        return cached
+
+    file_path = _render_to_file(class_name, day_index, schedule_items, f"{IMG_DIR}/schedule_{image_hash}.png")
+    _image_cache[(class_name, day_index)] = (image_hash, file_path)
+    return file_path
+
+async def _render_in_pool(class_name, day_index, schedule_items, file_path):
+    loop = asyncio.get_running_loop()
+    RENDER_STATS["queued"] += 1
+    try:
+        return await loop.run_in_executor(_render_pool, _render_to_file, class_name, day_index, schedule_items, file_path)
+    finally:
+        RENDER_STATS["queued"] -= 1
+
+async def render_schedule_image(class_name, day_index, schedule_items):
+    """
+    Асинхронно возвращает путь к карточке. Рисование идёт в пуле потоков и не блокирует event loop,
+    одновременные запросы одной и той же карточки ждут один общий рендер.
+    """
+    image_hash = schedule_image_hash(class_name, day_index, schedule_items)
+    cached = _cached_path(class_name, day_index, image_hash)
+    if cached:
+        return cached
+
+    task = _inflight.get(image_hash)
+    if task is None:
+        file_path = f"{IMG_DIR}/schedule_{image_hash}.png"
+        task = asyncio.ensure_future(_render_in_pool(class_name, day_index, list(schedule_items), file_path))
+        _inflight[image_hash] = task
+        task.add_done_callback(lambda _: _inflight.pop(image_hash, None))
+    else:
+        RENDER_STATS["coalesced"] += 1
+
+    file_path = await asyncio.shield(task)
+    _image_cache[(class_name, day_index)] = (image_hash, file_path)
+    return file_path
+
+def get_render_stats():
+    """
+    Метрики рендера: глубина очереди, число отрисовок и склеенных запросов, время рендера.
+    """
+    with _stats_lock:
+        stats = dict(RENDER_STATS)
+    stats["inflight"] = len(_inflight)
+    stats["avg_render_ms"] = stats["total_render_ms"] / stats["rendered"] if stats["rendered"] else 0.0
+    return stats
+
+def invalidate_schedule_cache(class_name=None):
+    """
+    Сбрасывает кэш карточек (для одного класса или целиком) после изменения расписания.
+    Файлы, на которые больше никто не ссылается, удаляются.
+    """
+    keys = [k for k in _image_cache if class_name is None or k[0] == class_name]
+    dropped = {_image_cache.pop(k)[1] for k in keys}
+    still_used = {path for _, path in _image_cache.values()}
+    for path in dropped - still_used:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+async def prewarm_schedule_cache(timetable=None):
+    """
+    Заранее рисует карточки для всех классов и дней, чтобы утренний пик не упирался в PIL.
+    """
+    timetable = timetable or РАСПИСАНИЕ
+    jobs = [
+        render_schedule_image(class_name, day_index, items)
+        for class_name, days in timetable.items()
+        for day_index, items in days.items()
+    ]
+    await asyncio.gather(*jobs)
+    return len(jobs)
+
+def _load_fonts():
+    """
+    Шрифты грузятся один раз на поток рендера, а не на каждую картинку.
+    """
+    fonts = getattr(_fonts_local, "fonts", None)
+    if fonts is None:
+        try:
+            fonts = (
+                ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf", 48),
+                ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf", 28),
+                ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf", 24),
+                ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf", 20),
+            )
+        except OSError:
+            default = ImageFont.load_default()
+            fonts = (default, default, default, default)
+        _fonts_local.fonts = fonts
+    return fonts
+
+def generate_schedule_image(class_name, day_index, schedule_items, file_path=None):
+    width = RENDER_PARAMS["width"]
+    padding = RENDER_PARAMS["padding"]
+    header_height = RENDER_PARAMS["header_height"]
+    item_height = RENDER_PARAMS["item_height"]
+    item_spacing = RENDER_PARAMS["item_spacing"]
     
     num_lessons = len(schedule_items)
     height = header_height + (item_height + item_spacing) * num_lessons + padding
     
-    bg_color = (255, 255, 255)
-    accent_color = (63, 81, 181)
-    text_main = (33, 33, 33)
-    text_secondary = (117, 117, 117)
-    card_bg = (245, 247, 250)
+    bg_color = RENDER_PARAMS["bg_color"]
+    accent_color = RENDER_PARAMS["accent_color"]
+    text_main = RENDER_PARAMS["text_main"]
+    text_secondary = RENDER_PARAMS["text_secondary"]
+    card_bg = RENDER_PARAMS["card_bg"]
     
     img = Image.new('RGB', (width, height), color=bg_color)
     draw = ImageDraw.Draw(img)
     
-    try:
-        font_bold = ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf", 48)
-        font_semi = ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf", 28)
-        font_reg = ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf", 24)
-        font_small = ImageFont.truetype("/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf", 20)
-    except:
-        font_bold = font_semi = font_reg = font_small = ImageFont.load_default()
+    font_bold, font_semi, font_reg, font_small = _load_fonts()
 
     days = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
     
@@ -87,6 +246,10 @@ def generate_schedule_image(class_name, day_index, schedule_items):
         
         y_offset += item_height + item_spacing
         
-    file_path = f"{IMG_DIR}/schedule_{class_name}_{day_index}.png"
-    img.save(file_path)
+    if file_path is None:
+        file_path = f"{IMG_DIR}/schedule_{class_name}_{day_index}.png"
+    # Пишем во временный файл, чтобы кэш никогда не отдал недорисованную картинку
+    tmp_path = f"{file_path}.tmp"
+    img.save(tmp_path, format="PNG")
+    os.replace(tmp_path, file_path)
     return file_path
@@ -0,0 +1,35 @@
+import asyncio
+
+class DDGSSearchBackend:
+    """
+    Поиск через DuckDuckGo. Библиотека синхронная, поэтому каждый запрос уходит в поток,
+    а не блокирует event loop.
+    """
+
+    def _text(self, query: str, max_results: int):
+        from duckduckgo_search import DDGS
+        return [{"title": r['title'], "link": r['href']} for r in DDGS().text(query, max_results=max_results)]
+
+    async def search(self, query: str, max_results: int = 2):
+        return await asyncio.to_thread(self._text, query, max_results)
+
+class StubSearchBackend:
+    """
+    Локальная заглушка для тестов: отдаёт заранее заданные результаты с заданной задержкой.
+    """
+
+    def __init__(self, results: dict = None, delays: dict = None, default_delay: float = 0.0):
+        self.results = results or {}
+        self.delays = delays or {}
+        self.default_delay = default_delay
+        self.queries = []
+
+    async def search(self, query: str, max_results: int = 2):
+        self.queries.append(query)
+        delay = self.delays.get(query, self.default_delay)
+        if delay:
+            await asyncio.sleep(delay)
+        items = self.results.get(query)
+        if items is None:
+            items = [{"title": f"{query} #{i}", "link": f"https://example.com/{abs(hash(query))}/{i}"} for i in range(max_results)]
+        return items[:max_results]
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+import db_helper
+import ai_helper
+import difficulty_model
+from ai_queue import ai_queue, BACKGROUND, INTERACTIVE, QueueFull
+
+logger = logging.getLogger(__name__)
+
+# Задачи фоновой генерации, чтобы не ставить одно задание в очередь дважды
+_jobs = {}
+# Генерация по кнопке: (задание, поле) -> задача, повторные нажатия ждут её же
+_artifact_jobs = {}
+
+def schedule_task_artifacts(task_id: int):
+    """
+    Ставит фоновую генерацию плана, сложности и материалов для нового задания
+    в очередь AI с низким приоритетом: вопросы учеников обслуживаются раньше.
+    Если очередь переполнена, артефакты сгенерируются по запросу.
+    """
+    job = _jobs.get(task_id)
+    if job is None or job.future.done():
+        try:
+            job = ai_queue.submit(("task", task_id), lambda: precompute_task_artifacts(task_id), priority=BACKGROUND)
+        except QueueFull:
+            logger.warning(f"AI queue is full, artifacts for task {task_id} will be generated on demand")
+            return None
+        _jobs[task_id] = job
+        job.future.add_done_callback(lambda _: _jobs.pop(task_id, None))
+    return job
+
+async def _value(value):
+    # Уже известное значение в виде корутины для asyncio.gather
+    return value
+
+async def precompute_task_artifacts(task_id: int):
+    task = await db_helper.get_task(task_id)
+    if not task:
+        return
+    text = ai_helper.task_text(task.subject, task.description)
+    # Сложность оценивает локальная модель; AI спрашиваем, только если она не уверена
+    difficulty, confidence = difficulty_model.classify(task.subject, task.description)
+    escalate = not difficulty_model.is_confident(confidence)
+    try:
+        steps, materials, llm_difficulty = await asyncio.gather(
+            _value(task.steps) if task.steps else ai_helper.get_task_steps(text),
+            ai_helper.get_task_materials(text),
+            ai_helper.get_task_difficulty(task.subject, task.description) if escalate else _value(None)
+        )
+        fields = {}
+        if llm_difficulty:
+            fields.update(difficulty=llm_difficulty, difficulty_source="llm")
+        elif task.difficulty_source is None:
+            fields.update(difficulty=difficulty, difficulty_source="model")
+        # Ошибки AI не сохраняем: в этом случае сработает генерация по запросу
+        if ai_helper.is_good_answer(steps) and steps != task.steps:
+            fields["steps"] = steps
+        if ai_helper.is_good_answer(materials):
+            fields["materials"] = materials
+        await db_helper.update_task_artifacts(task_id, **fields)
+        logger.info(f"Artifacts ready for task {task_id}: {sorted(fields)}")
+    except Exception as e:
+        logger.error(f"Error precomputing artifacts for task {task_id}: {e}")
+
+async def _generate_artifact(task, field: str):
+    text = ai_helper.task_text(task.subject, task.description)
+    generate = ai_helper.get_task_steps if field == "steps" else ai_helper.get_task_materials
+    # Одинаковый промпт с фоновой задачей: кэш ответов склеит запросы в один вызов LLM
+    result = await generate(text)
+    if ai_helper.is_good_answer(result):
+        await db_helper.update_task_artifacts(task.id, **{field: result})
+    return result
+
+async def get_task_artifact(task_id: int, field: str, user_id=None):
+    """
+    Отдаёт готовый план ('steps') или материалы ('materials') задания.
+    Если фоновая генерация ещё не закончилась, ждёт её (стоящую в очереди — поднимает
+    до интерактивного приоритета); иначе ставит генерацию поля в очередь AI как интерактивный запрос user_id.
+    Может выбросить QueueFull или JobCancelled, как и вопросы ученика.
+    """
+    task = await db_helper.get_task(task_id)
+    if not task:
+        return None
+    ready = getattr(task, field)
+    if ready:
+        return ready
+
+    background = _jobs.get(task_id)
+    if background and not background.future.done():
+        # Уже запущенную фоновую задачу просто ждём, стоящую в очереди — ещё и поднимаем
+        ai_queue.promote(background, user_id)
+        await background.result()
+        task = await db_helper.get_task(task_id)
+        if not task:
+            return None
+        if getattr(task, field):
+            return getattr(task, field)
+
+    key = (task_id, field)
+    job = _artifact_jobs.get(key)
+    if job is None or job.future.done():
+        # replace=False: нажатие кнопки не должно снимать вопрос, который ученик задал раньше
+        job = ai_queue.submit(user_id, lambda: _generate_artifact(task, field), priority=INTERACTIVE, replace=False)
+        _artifact_jobs[key] = job
+        job.future.add_done_callback(lambda _: _artifact_jobs.pop(key, None))
+    return await job.result()
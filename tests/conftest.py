@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Отдельная SQLite-база на тест: engine и фабрика сессий подменяются во всех модулях, которые их импортировали.
+    NullPool — соединения не переживают asyncio.run теста.
+    """
+    from sqlalchemy.pool import NullPool
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+    import models
+    import migrate
+    import db_helper
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'diary.db'}", poolclass=NullPool)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    for module in (models, migrate, db_helper):
+        monkeypatch.setattr(module, "engine", engine)
+    for module in (models, db_helper):
+        monkeypatch.setattr(module, "AsyncSessionLocal", session_factory)
+    db_helper.invalidate_user()
+    yield tmp_path / "diary.db"
+    db_helper.invalidate_user()
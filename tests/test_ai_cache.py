@@ -0,0 +1,132 @@
+import asyncio
+import sqlite3
+
+from ai_cache import ResponseCache, make_key
+
+
+def test_make_key_ignores_case_and_spaces():
+    assert make_key("Решить  уравнение\n", "x") == make_key("решить уравнение", "X")
+    assert make_key("решить", "x") != make_key("решить", "y")
+
+
+def test_entries_expire_after_ttl():
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, db_path="")
+        await cache.set("fresh", "ответ")
+        cache.ttl = -1
+        await cache.set("stale", "ответ")
+        return await cache.lookup("fresh"), await cache.lookup("stale", "нет"), cache.get_stats()
+
+    fresh, stale, stats = asyncio.run(scenario())
+    assert (fresh, stale) == ("ответ", "нет")
+    assert stats["entries"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, max_entries=2, db_path="")
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.get("a")
+        await cache.set("c", 3)
+        return [await cache.lookup(key) for key in "abc"], cache.get_stats()
+
+    values, stats = asyncio.run(scenario())
+    assert values == [1, None, 3]
+    assert stats["evictions"] == 1
+
+
+def test_size_limit_evicts_entries():
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, max_bytes=50, db_path="")
+        await cache.set("a", "x" * 30)
+        await cache.set("b", "y" * 30)
+        return await cache.lookup("a"), await cache.lookup("b"), cache.get_stats()["bytes"]
+
+    a, b, size = asyncio.run(scenario())
+    assert a is None and b == "y" * 30
+    assert size <= 50
+
+
+def test_concurrent_misses_share_one_computation():
+    calls = []
+
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, db_path="")
+        gate = asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await gate.wait()
+            return "ответ"
+
+        waiters = [asyncio.ensure_future(cache.get_or_compute("key", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert cache.inflight("key") is not None
+        gate.set()
+        results = await asyncio.gather(*waiters)
+        return results, cache.inflight("key"), cache.get_stats()
+
+    results, inflight, stats = asyncio.run(scenario())
+    assert results == ["ответ"] * 5
+    assert len(calls) == 1
+    assert inflight is None
+    assert stats["coalesced"] == 4
+
+
+def test_rejected_values_are_not_cached():
+    calls = []
+
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, db_path="")
+
+        async def compute():
+            calls.append(1)
+            return "❌ ошибка"
+
+        for _ in range(2):
+            await cache.get_or_compute("key", compute, should_cache=lambda value: not value.startswith("❌"))
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_sqlite_tier_survives_restart_and_drops_expired_rows(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        cache = ResponseCache("test", ttl=60, db_path=path)
+        await cache.set("kept", {"text": "ответ"})
+        cache.ttl = -1
+        await cache.set("stale", "старое")
+        cache.close()
+
+        restarted = ResponseCache("test", ttl=60, db_path=path)
+        values = await restarted.lookup("kept"), await restarted.lookup("stale")
+        restarted.close()
+        return values, restarted.get_stats()
+
+    (kept, stale), stats = asyncio.run(scenario())
+    assert kept == {"text": "ответ"} and stale is None
+    assert stats["db_hits"] == 1
+    with sqlite3.connect(path) as conn:
+        assert [row[0] for row in conn.execute("SELECT key FROM ai_cache")] == ["test:kept"]
+
+
+def test_sqlite_tier_is_capped_per_namespace(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        other = ResponseCache("other", ttl=60, db_path=path)
+        await other.set("x", 0)
+        cache = ResponseCache("test", ttl=60, db_path=path, max_db_rows=2, sweep_every=1)
+        for i in range(5):
+            await cache.set(f"k{i}", i)
+        cache.close()
+        other.close()
+
+    asyncio.run(scenario())
+    with sqlite3.connect(path) as conn:
+        keys = sorted(row[0] for row in conn.execute("SELECT key FROM ai_cache"))
+    # Остаются самые свежие строки, чужое пространство имён не трогается
+    assert keys == ["other:x", "test:k3", "test:k4"]
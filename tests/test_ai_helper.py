@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+import ai_helper
+from ai_cache import ResponseCache
+from search_backend import StubSearchBackend
+
+TOPIC = "дроби"
+VK_QUERY = f"site:vk.com/video {TOPIC}"
+MATERIAL_QUERY = f"{TOPIC} образовательный материал"
+VIDEO_QUERY = f"{TOPIC} урок видео"
+
+
+@pytest.fixture(autouse=True)
+def fresh_search_cache(monkeypatch):
+    monkeypatch.setattr(ai_helper, "search_cache", ResponseCache("search", 60, db_path=""))
+    monkeypatch.setattr(ai_helper, "SEARCH_DEADLINE", 0.2)
+
+
+def _link(n):
+    return {"title": f"Ссылка {n}", "link": f"https://example.com/{n}"}
+
+
+def test_search_ranks_and_deduplicates_results(monkeypatch):
+    backend = StubSearchBackend(results={
+        VK_QUERY: [_link(1), _link(2)],
+        MATERIAL_QUERY: [_link(3), _link(1)],
+        VIDEO_QUERY: [_link(4)],
+    })
+    monkeypatch.setattr(ai_helper, "_search_backend", backend)
+    results = asyncio.run(ai_helper.search_educational_resources(TOPIC))
+    # 1: 3 + 2/2, 3: 2, 2: 3/2, 4: 1
+    assert [r["link"] for r in results] == [_link(n)["link"] for n in (1, 3, 2, 4)]
+
+
+def test_search_deadline_returns_partial_results_and_skips_cache(monkeypatch):
+    backend = StubSearchBackend(results={VK_QUERY: [_link(1)]}, delays={VIDEO_QUERY: 5.0})
+    monkeypatch.setattr(ai_helper, "_search_backend", backend)
+
+    async def search_twice():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = await ai_helper.search_educational_resources(TOPIC)
+        elapsed = loop.time() - started
+        second = await ai_helper.search_educational_resources(TOPIC)
+        return first, elapsed, second
+
+    first, elapsed, second = asyncio.run(search_twice())
+    assert elapsed < 1.0
+    assert _link(1) in first and len(first) == 3  # медленный подзапрос не дождались
+    assert first == second
+    # Неполный результат не закэширован — второй вызов снова идёт в поиск
+    assert backend.queries.count(VK_QUERY) == 2
+
+
+def test_search_caches_complete_results(monkeypatch):
+    backend = StubSearchBackend()
+    monkeypatch.setattr(ai_helper, "_search_backend", backend)
+
+    async def search_twice():
+        return (await ai_helper.search_educational_resources(TOPIC),
+                await ai_helper.search_educational_resources(TOPIC.upper()))
+
+    first, second = asyncio.run(search_twice())
+    assert first == second
+    assert len(backend.queries) == 3
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from ai_queue import AIQueue, JobCancelled, QueueFull, INTERACTIVE, BACKGROUND
+
+
+async def _occupied(queue):
+    """
+    Ставит задачу, которая держит единственный слот очереди, пока не откроют release.
+    """
+    release = asyncio.Event()
+    blocker = queue.submit("blocker", release.wait)
+    while not blocker.started:
+        await asyncio.sleep(0)
+    return blocker, release
+
+
+def _recorder(order, name):
+    async def run():
+        order.append(name)
+        return name
+    return run
+
+
+def test_interactive_jobs_run_before_background():
+    async def scenario():
+        queue = AIQueue(concurrency=1)
+        blocker, release = await _occupied(queue)
+        order = []
+        background = [queue.submit("precompute", _recorder(order, f"bg{i}"), BACKGROUND) for i in range(3)]
+        interactive = queue.submit("student", _recorder(order, "question"))
+        release.set()
+        await asyncio.gather(blocker.result(), interactive.result(), *(job.result() for job in background))
+        await queue.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["question", "bg0", "bg1", "bg2"]
+
+
+def test_owners_take_turns_within_priority():
+    async def scenario():
+        queue = AIQueue(concurrency=1)
+        blocker, release = await _occupied(queue)
+        order = []
+        jobs = [queue.submit("a", _recorder(order, f"a{i}"), BACKGROUND) for i in range(3)]
+        jobs += [queue.submit("b", _recorder(order, f"b{i}"), BACKGROUND) for i in range(2)]
+        release.set()
+        await asyncio.gather(blocker.result(), *(job.result() for job in jobs))
+        await queue.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_new_question_replaces_previous_one():
+    async def scenario():
+        queue = AIQueue(concurrency=1)
+        blocker, release = await _occupied(queue)
+        order = []
+        first = queue.submit("student", _recorder(order, "first"))
+        second = queue.submit("student", _recorder(order, "second"))
+        kept = queue.submit("student", _recorder(order, "button"), replace=False)
+        release.set()
+        with pytest.raises(JobCancelled):
+            await first.result()
+        await asyncio.gather(second.result(), kept.result())
+        await queue.stop()
+        return order, queue.get_stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["second", "button"]
+    assert stats["cancelled"] == 1 and stats["waiting"] == 0
+
+
+def test_interactive_job_expires_after_max_wait():
+    async def scenario():
+        queue = AIQueue(concurrency=1, max_wait=0.01)
+        blocker, release = await _occupied(queue)
+        order = []
+        late = queue.submit("student", _recorder(order, "late"))
+        background = queue.submit("precompute", _recorder(order, "background"), BACKGROUND)
+        await asyncio.sleep(0.05)
+        release.set()
+        with pytest.raises(JobCancelled, match="истекло"):
+            await late.result()
+        await background.result()
+        await queue.stop()
+        return order, queue.get_stats()
+
+    order, stats = asyncio.run(scenario())
+    # Фоновые задачи срока ожидания не имеют
+    assert order == ["background"]
+    assert stats["expired"] == 1 and stats["waiting"] == 0
+
+
+def test_promote_moves_background_job_ahead():
+    async def scenario():
+        queue = AIQueue(concurrency=1)
+        blocker, release = await _occupied(queue)
+        order = []
+        jobs = [queue.submit("precompute", _recorder(order, f"task{i}"), BACKGROUND) for i in range(3)]
+        assert queue.position(jobs[2]) == 3
+        assert queue.promote(jobs[2], "student")
+        assert queue.position(jobs[2]) == 1
+        release.set()
+        await asyncio.gather(blocker.result(), *(job.result() for job in jobs))
+        # Уже выполненную задачу поднять нельзя
+        promoted_again = queue.promote(jobs[0], "student")
+        await queue.stop()
+        return order, promoted_again
+
+    order, promoted_again = asyncio.run(scenario())
+    assert order == ["task2", "task0", "task1"]
+    assert promoted_again is False
+
+
+def test_background_jobs_get_half_of_the_queue():
+    async def scenario():
+        queue = AIQueue(concurrency=1, max_pending=4)
+        blocker, release = await _occupied(queue)
+        for i in range(2):
+            queue.submit("precompute", _recorder([], i), BACKGROUND)
+        with pytest.raises(QueueFull):
+            queue.submit("precompute", _recorder([], "extra"), BACKGROUND)
+        # Интерактивным место ещё есть
+        queue.submit("student", _recorder([], "question"), INTERACTIVE)
+        release.set()
+        await queue.stop()
+        return queue.get_stats()
+
+    assert asyncio.run(scenario())["rejected"] == 1
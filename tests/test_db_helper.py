@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+
+import pytest
+
+import db_helper
+import migrate
+
+
+@pytest.fixture
+def school(database):
+    """
+    Мигрированная база с двумя учениками 7А и заданиями: одно на завтра, одно просроченное.
+    """
+    async def setup():
+        await migrate.run_migrations()
+        students = []
+        for telegram_id in (1, 2):
+            await db_helper.get_or_create_user(telegram_id, full_name=f"Ученик {telegram_id}")
+            students.append(await db_helper.update_user_class(telegram_id, "7А"))
+        now = datetime.datetime.now()
+        upcoming = await db_helper.add_task(students[0].id, "Алгебра", "№1", now + datetime.timedelta(days=1),
+                                            difficulty="hard", class_name="7А")
+        overdue = await db_helper.add_task(students[0].id, "Физика", "§2", now - datetime.timedelta(days=1),
+                                           class_name="7А")
+        return students, upcoming, overdue
+
+    return asyncio.run(setup())
+
+
+def test_complete_task_is_idempotent(school):
+    (student, _), upcoming, _ = school
+
+    async def scenario():
+        first = await db_helper.complete_task(upcoming.id, student.id)
+        # Двойное нажатие и гонка двух нажатий
+        repeated = await asyncio.gather(*(db_helper.complete_task(upcoming.id, student.id) for _ in range(3)))
+        return first, repeated, await db_helper.get_user_stats(student)
+
+    first, repeated, (stats, xp, level, rank, class_size) = asyncio.run(scenario())
+    assert first == ["🎯 Первое задание"]
+    assert repeated == [None, None, None]
+    assert xp == db_helper.XP_MAP["hard"]
+    assert (stats.completed, stats.on_time, stats.rated, stats.current_streak) == (1, 1, 1, 1)
+    assert (rank, class_size) == (1, 2)
+
+
+def test_complete_unknown_task(school):
+    (student, _), _, _ = school
+    assert asyncio.run(db_helper.complete_task(999, student.id)) is None
+
+
+def test_stats_counters(school):
+    (first, second), upcoming, overdue = school
+
+    async def scenario():
+        await db_helper.complete_task(upcoming.id, first.id)
+        await db_helper.complete_task(overdue.id, first.id)
+        await db_helper.complete_task(upcoming.id, second.id)
+        before = await db_helper.get_class_stats("7А"), await db_helper.get_user_stats(first)
+        await db_helper.delete_task(upcoming.id)
+        after = await db_helper.get_class_stats("7А"), await db_helper.get_user_stats(first)
+        return before, after, await db_helper.get_user_stats(second)
+
+    before, after, second_stats = asyncio.run(scenario())
+    class_stats, (user_stats, *_) = before
+    assert (class_stats.tasks_total, class_stats.completions_total,
+            class_stats.on_time_total, class_stats.rated_total) == (2, 3, 2, 3)
+    assert (user_stats.completed, user_stats.on_time, user_stats.rated) == (2, 1, 2)
+    assert user_stats.current_streak == 1  # два задания в один день — одна серия
+
+    # Удалённое задание вычитается из счётчиков класса и обоих учеников
+    class_stats, (user_stats, *_) = after
+    assert (class_stats.tasks_total, class_stats.completions_total,
+            class_stats.on_time_total, class_stats.rated_total) == (1, 1, 0, 1)
+    assert (user_stats.completed, user_stats.on_time, user_stats.rated) == (1, 0, 1)
+    assert (second_stats[0].completed, second_stats[0].on_time, second_stats[0].rated) == (0, 0, 0)
+
+
+def test_rank_uses_current_xp(school):
+    (first, second), upcoming, _ = school
+
+    async def scenario():
+        await db_helper.complete_task(upcoming.id, second.id)
+        # second — объект, прочитанный до начисления XP; XP и место берутся из базы
+        return await db_helper.get_user_stats(first), await db_helper.get_user_stats(second)
+
+    (_, first_xp, _, first_rank, _), (_, second_xp, _, second_rank, _) = asyncio.run(scenario())
+    assert (first_xp, first_rank) == (0, 2)
+    assert second_xp > 0 and second_rank == 1
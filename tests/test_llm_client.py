@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from llm_client import LLMClient, LLMError, FakeProvider
+
+
+def test_complete_falls_back_to_next_provider():
+    broken, spare = FakeProvider(fail=True), FakeProvider("ответ")
+    client = LLMClient([broken, spare])
+    assert asyncio.run(client.complete("system", "вопрос")) == "ответ"
+    assert (broken.calls, spare.calls) == (1, 1)
+
+
+def test_complete_times_out_slow_provider():
+    slow, fast = FakeProvider("поздно", delay=1.0), FakeProvider("быстро")
+    client = LLMClient([slow, fast], timeout=0.05)
+    assert asyncio.run(client.complete("system", "вопрос")) == "быстро"
+    assert slow.calls == 1
+
+
+def test_complete_raises_when_all_providers_fail():
+    client = LLMClient([FakeProvider(fail=True), FakeProvider(delay=1.0)], timeout=0.05)
+    with pytest.raises(LLMError, match="таймаут"):
+        asyncio.run(client.complete("system", "вопрос"))
+
+
+def test_stream_falls_back_before_first_chunk():
+    client = LLMClient([FakeProvider(fail=True), FakeProvider("раз два три")])
+
+    async def collect():
+        return [chunk async for chunk in client.stream("system", "вопрос")]
+
+    assert "".join(asyncio.run(collect())) == "раз два три"
+
+
+class StallingProvider(FakeProvider):
+    """
+    Отдаёт первый кусок сразу, а следующий — только через delay.
+    """
+
+    async def stream(self, system_prompt: str, user_prompt: str):
+        self.calls += 1
+        yield "раз"
+        await asyncio.sleep(self.delay)
+        yield " два"
+
+
+def test_stream_does_not_switch_provider_after_first_chunk():
+    spare = FakeProvider("запасной")
+    client = LLMClient([StallingProvider(delay=1.0), spare], timeout=0.05)
+    chunks = []
+
+    async def collect():
+        async for chunk in client.stream("system", "вопрос"):
+            chunks.append(chunk)
+
+    # Ответ уже частично показан — второй провайдер не пробуется
+    with pytest.raises(LLMError, match="таймаут"):
+        asyncio.run(collect())
+    assert chunks == ["раз"]
+    assert spare.calls == 0
@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+
+from sqlalchemy import inspect
+
+import migrate
+import models
+
+# Схема базы до появления миграций
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER NOT NULL UNIQUE, username VARCHAR, full_name VARCHAR,
+                    class_name VARCHAR, last_reminded_at DATETIME, xp INTEGER, level INTEGER);
+CREATE TABLE schedules (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id), day_of_week INTEGER,
+                        lesson_name VARCHAR NOT NULL, start_time VARCHAR);
+CREATE TABLE tasks (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id), subject VARCHAR NOT NULL,
+                    description TEXT, deadline DATETIME, is_completed BOOLEAN, difficulty VARCHAR, steps TEXT);
+CREATE TABLE mood_logs (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id), timestamp DATETIME,
+                        mood VARCHAR, load_level INTEGER);
+CREATE TABLE achievements (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id), name VARCHAR,
+                           earned_at DATETIME);
+INSERT INTO users (id, telegram_id, class_name, xp, level) VALUES (1, 100, '7А', 40, 1);
+INSERT INTO tasks (id, user_id, subject, deadline, is_completed, difficulty)
+    VALUES (1, 1, 'Алгебра', '2026-10-20 08:00:00', 1, 'hard'), (2, 1, 'Физика', NULL, 0, NULL);
+INSERT INTO achievements (user_id, name) VALUES (1, '🎯 Первое задание'), (1, '🎯 Первое задание');
+"""
+
+
+def _schema():
+    async def read():
+        async with models.engine.connect() as conn:
+            def collect(sync_conn):
+                insp = inspect(sync_conn)
+                return {
+                    table: ({c["name"] for c in insp.get_columns(table)}, {i["name"] for i in insp.get_indexes(table)})
+                    for table in insp.get_table_names()
+                }
+            return await conn.run_sync(collect)
+    return asyncio.run(read())
+
+
+def _assert_matches_models(schema):
+    for table in models.Base.metadata.sorted_tables:
+        columns, indexes = schema[table.name]
+        assert columns == {c.name for c in table.columns}, table.name
+        assert {i.name for i in table.indexes} <= indexes, table.name
+
+
+def test_fresh_database(database):
+    assert asyncio.run(migrate.run_migrations()) == migrate.LATEST_VERSION
+    _assert_matches_models(_schema())
+    # Повторный запуск ничего не применяет
+    assert asyncio.run(migrate.run_migrations()) == migrate.LATEST_VERSION
+    with sqlite3.connect(database) as conn:
+        versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [m[0] for m in migrate.MIGRATIONS]
+
+
+def test_legacy_database(database):
+    with sqlite3.connect(database) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+
+    assert asyncio.run(migrate.run_migrations()) == migrate.LATEST_VERSION
+    _assert_matches_models(_schema())
+    with sqlite3.connect(database) as conn:
+        assert conn.execute("SELECT class_name FROM tasks ORDER BY id").fetchall() == [("7А",), ("7А",)]
+        assert conn.execute("SELECT task_id, user_id, on_time FROM task_completions").fetchall() == [(1, 1, None)]
+        assert conn.execute("SELECT COUNT(*) FROM achievements").fetchone() == (1,)
+        assert conn.execute("SELECT difficulty_source FROM tasks WHERE id = 1").fetchone() == ("llm",)
+        # Время старых отметок неизвестно, поэтому в долю «вовремя» они не входят
+        assert conn.execute("SELECT completed, on_time, rated FROM user_stats").fetchall() == [(1, 0, 0)]
+        assert conn.execute(
+            "SELECT class_name, tasks_total, completions_total, on_time_total, rated_total FROM class_stats"
+        ).fetchall() == [("7А", 2, 1, 0, 0)]
+
+
+def test_skipped_migration_is_applied_later(database):
+    asyncio.run(migrate.run_migrations())
+    with sqlite3.connect(database) as conn:
+        conn.execute("DELETE FROM schema_version WHERE version = 7")
+    assert asyncio.run(migrate.run_migrations()) == migrate.LATEST_VERSION
+    with sqlite3.connect(database) as conn:
+        assert conn.execute("SELECT 1 FROM schema_version WHERE version = 7").fetchone() == (1,)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbox import Outbox, BULK
+from rate_limit import ChatRateLimiter
+
+
+class FakeBot:
+    """
+    Записывает отправленные сообщения; чатам из flood отвечает RetryAfter заданное число раз.
+    """
+
+    def __init__(self, flood=None, retry_after=0.05):
+        self.flood = dict(flood or {})
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.flood.get(chat_id):
+            self.flood[chat_id] -= 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", self.retry_after)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def _outbox(bot, **kwargs):
+    outbox = Outbox(ChatRateLimiter(global_rate=1000, chat_rate=1000, chat_burst=1000), **kwargs)
+    outbox.start(bot)
+    return outbox
+
+
+def test_retry_after_is_retried():
+    bot = FakeBot(flood={1: 2})
+
+    async def scenario():
+        outbox = _outbox(bot)
+        result = await outbox.send_message(1, "привет")
+        await outbox.stop()
+        return result
+
+    assert asyncio.run(scenario()) == "привет"
+    assert bot.sent == [(1, "привет")]
+
+
+def test_retry_after_gives_up_after_max_retries():
+    bot = FakeBot(flood={1: 5})
+
+    async def scenario():
+        outbox = _outbox(bot, max_retries=1)
+        with pytest.raises(TelegramRetryAfter):
+            await outbox.send_message(1, "привет")
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    assert bot.sent == []
+
+
+def test_flooded_chat_does_not_block_others_and_keeps_order():
+    bot = FakeBot(flood={1: 1}, retry_after=0.2)
+
+    async def scenario():
+        outbox = _outbox(bot, workers=1)
+        await asyncio.gather(
+            outbox.send_message(1, "первое"), outbox.send_message(1, "второе"),
+            outbox.send_message(2, "рассылка", priority=BULK), outbox.send_message(3, "ответ"),
+        )
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    assert bot.sent == [(3, "ответ"), (2, "рассылка"), (1, "первое"), (1, "второе")]
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+import parser_engine
+import timetable
+
+NOW = datetime.datetime(2026, 10, 14, 12, 0)  # среда
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("завтра", datetime.datetime(2026, 10, 15, 8, 0)),
+    ("к пятнице", datetime.datetime(2026, 10, 16, 8, 0)),
+    ("к 15.03", datetime.datetime(2027, 3, 15, 8, 0)),
+    ("сдать 20.10 18:00", datetime.datetime(2026, 10, 20, 18, 0)),
+    # Номера упражнений и глав — не даты
+    ("№3.12", None),
+    ("№12.5, 13", None),
+    ("читать 1.2 главу", None),
+    ("читать 1.2 главу к понедельнику", datetime.datetime(2026, 10, 19, 8, 0)),
+    ("упр. 4.5 до 20.10", datetime.datetime(2026, 10, 20, 8, 0)),
+    # Сокращения дней недели — только как срок
+    ("к ср", datetime.datetime(2026, 10, 21, 8, 0)),
+    ("до вс", datetime.datetime(2026, 10, 18, 8, 0)),
+    ("упр. 5 пт", datetime.datetime(2026, 10, 16, 8, 0)),
+    ("ср. с прошлым годом", None),
+    ("сравнить ср и пт значения", None),
+])
+def test_parse_deadline(text, expected):
+    assert parser_engine.parse_deadline(text, now=NOW) == expected
+
+
+def test_parse_batch_keeps_section_deadline():
+    items = parser_engine.DataParser.parse_batch(
+        "Пятница:\nАлгебра: №3.12\nРусский: упр. 45\nФизика: №2.3 к понедельнику", now=NOW
+    )
+    deadlines = [item["deadline"] for item in items]
+    assert deadlines == [
+        datetime.datetime(2026, 10, 16, 8, 0),
+        datetime.datetime(2026, 10, 16, 8, 0),
+        datetime.datetime(2026, 10, 19, 8, 0),
+    ]
+
+
+@pytest.fixture
+def class_timetable(monkeypatch):
+    rows = [("7А", day, 1, "Математика", "101", "08:30") for day in range(5)]
+    monkeypatch.setattr(timetable, "_index", timetable.TimetableIndex(rows))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("к следующему уроку", datetime.datetime(2026, 10, 15, 8, 30)),
+    ("к паре", datetime.datetime(2026, 10, 15, 8, 30)),
+    ("на следующую пару", datetime.datetime(2026, 10, 15, 8, 30)),
+    # «на пару» — «вдвоём», а не срок
+    ("решить на пару с соседом", None),
+])
+def test_parse_deadline_next_lesson(class_timetable, text, expected):
+    assert parser_engine.parse_deadline(text, class_name="7А", subject="Математика", now=NOW) == expected
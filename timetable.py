@@ -0,0 +1,179 @@
+import os
+import asyncio
+import logging
+import datetime
+from collections import namedtuple
+
+from sqlalchemy import select, func, delete
+
+from models import AsyncSessionLocal, Schedule
+
+logger = logging.getLogger(__name__)
+
+# Звонки по умолчанию, если у урока не задано время начала
+BELLS = ["08:30", "09:25", "10:20", "11:25", "12:20", "13:15", "14:10", "15:05"]
+LESSON_MINUTES = int(os.getenv("LESSON_MINUTES", "45"))
+TIMETABLE_POLL_INTERVAL = int(os.getenv("TIMETABLE_POLL_INTERVAL", "30"))
+
+Lesson = namedtuple("Lesson", "number subject room start_time start end")  # start/end — минуты от полуночи
+
+_NO_LESSON = 255
+
+def default_start_time(number: int):
+    return BELLS[number - 1] if 0 < number <= len(BELLS) else None
+
+def _minutes(hhmm: str):
+    if not hhmm:
+        return None
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
+class TimetableIndex:
+    """
+    Неизменяемый снимок расписания всех классов: (класс, день недели) -> уроки.
+    Для каждого дня заранее посчитана таблица «минута дня -> текущий или следующий урок»,
+    поэтому вопрос «какой урок сейчас/следующий» решается одним обращением по индексу.
+    """
+    __slots__ = ("_days", "_next", "_subject_days", "fingerprint")
+
+    def __init__(self, rows, fingerprint=None):
+        days = {}
+        for class_name, day, number, subject, room, start_time in rows:
+            start = _minutes(start_time or default_start_time(number))
+            end = start + LESSON_MINUTES if start is not None else None
+            days.setdefault((class_name, day), []).append(Lesson(number, subject, room, start_time, start, end))
+
+        self._days = {key: tuple(sorted(lessons, key=lambda l: l.number)) for key, lessons in days.items()}
+        self._next = {key: self._build_minute_table(lessons) for key, lessons in self._days.items()}
+        subject_days = {}
+        for (class_name, day), lessons in self._days.items():
+            for lesson in lessons:
+                subject_days.setdefault((class_name, lesson.subject.lower()), set()).add(day)
+        self._subject_days = {key: tuple(sorted(value)) for key, value in subject_days.items()}
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def _build_minute_table(lessons):
+        timed = [l for l in lessons if l.start is not None]
+        table = bytearray([_NO_LESSON]) * 1440
+        j = 0
+        for minute in range(1440):
+            while j < len(timed) and timed[j].end <= minute:
+                j += 1
+            if j == len(timed):
+                break
+            table[minute] = lessons.index(timed[j])
+        return bytes(table)
+
+    def classes(self):
+        return sorted({class_name for class_name, _ in self._days})
+
+    def lessons(self, class_name: str, day: int):
+        return self._days.get((class_name, day), ())
+
+    def items(self, class_name: str, day: int):
+        """
+        Уроки дня в формате schedule_gen: [(предмет, кабинет), ...].
+        """
+        return [(l.subject, l.room) for l in self.lessons(class_name, day)]
+
+    def as_dict(self):
+        result = {}
+        for (class_name, day) in self._days:
+            result.setdefault(class_name, {})[day] = self.items(class_name, day)
+        return result
+
+    def next_lesson(self, class_name: str, when: datetime.datetime = None):
+        """
+        Текущий или ближайший урок класса сегодня (None, если уроки закончились).
+        """
+        when = when or datetime.datetime.now()
+        key = (class_name, when.weekday())
+        table = self._next.get(key)
+        if table is None:
+            return None
+        pos = table[when.hour * 60 + when.minute]
+        return None if pos == _NO_LESSON else self._days[key][pos]
+
+    def subject_days(self, class_name: str, subject: str):
+        """
+        Дни недели, в которые у класса есть предмет.
+        """
+        return self._subject_days.get((class_name, subject.lower()), ())
+
+    def diff(self, other):
+        """
+        (класс, день), у которых уроки отличаются от другого снимка.
+        """
+        keys = set(self._days) | set(other._days)
+        return {key for key in keys if self._days.get(key) != other._days.get(key)}
+
+_index = TimetableIndex([])
+_reload_lock = asyncio.Lock()
+
+def get_index() -> TimetableIndex:
+    return _index
+
+async def _fingerprint(session):
+    result = await session.execute(
+        select(func.count(Schedule.id), func.max(Schedule.updated_at)).where(Schedule.class_name.isnot(None))
+    )
+    count, updated = result.one()
+    return (count, updated)
+
+async def reload(force: bool = False):
+    """
+    Перечитывает расписание из БД, если оно изменилось, и атомарно подменяет индекс.
+    Карточки расписания изменившихся классов сбрасываются.
+    """
+    global _index
+    async with _reload_lock:
+        async with AsyncSessionLocal() as session:
+            fingerprint = await _fingerprint(session)
+            if not force and fingerprint == _index.fingerprint:
+                return set()
+            result = await session.execute(
+                select(Schedule.class_name, Schedule.day_of_week, Schedule.lesson_number,
+                       Schedule.lesson_name, Schedule.room, Schedule.start_time)
+                .where(Schedule.class_name.isnot(None))
+                .order_by(Schedule.class_name, Schedule.day_of_week, Schedule.lesson_number)
+            )
+            new_index = TimetableIndex(result.all(), fingerprint)
+
+        changed = new_index.diff(_index)
+        _index = new_index
+    if changed:
+        import schedule_gen
+        for class_name in {class_name for class_name, _ in changed}:
+            schedule_gen.invalidate_schedule_cache(class_name)
+        logger.info(f"Timetable reloaded: {len(changed)} class/day slots changed")
+    return changed
+
+async def watch(interval: int = TIMETABLE_POLL_INTERVAL):
+    """
+    Фоновая проверка изменений расписания в БД: правки применяются без перезапуска бота.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Timetable reload failed: {e}")
+
+async def set_day(class_name: str, day: int, lessons):
+    """
+    Заменяет уроки класса на день. lessons — [(предмет, кабинет), ...].
+    """
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(Schedule).where(Schedule.class_name == class_name, Schedule.day_of_week == day)
+        )
+        session.add_all([
+            Schedule(class_name=class_name, day_of_week=day, lesson_number=number,
+                     lesson_name=subject, room=room, start_time=default_start_time(number))
+            for number, (subject, room) in enumerate(lessons, 1)
+        ])
+        await session.commit()
+    return await reload()
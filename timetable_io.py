@@ -0,0 +1,257 @@
+"""
+Массовый импорт и экспорт расписания.
+
+    python timetable_io.py import school.csv [--dry-run] [--batch 500]
+    python timetable_io.py export school.csv
+
+Форматы определяются по расширению: .csv, .json (массив объектов), .jsonl (объект на строку).
+Поля: class, day (0-6 или Пн..Вс), lesson (номер урока), subject, room, start_time (HH:MM, необязательно).
+Файл читается потоково: в памяти держится только текущая пачка строк.
+"""
+import re
+import csv
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import select, delete
+
+from models import AsyncSessionLocal, Schedule, init_db
+from db_helper import dialect_insert
+import timetable
+import schedule_gen
+
+FIELDS = ["class", "day", "lesson", "subject", "room", "start_time"]
+DAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+DAY_NAMES = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+CLASS_RE = re.compile(r"^\d{1,2}[А-ЯЁA-Z]$")
+TIME_RE = re.compile(r"^([01]?\d|2[0-3]):[0-5]\d$")
+MAX_REPORTED_ERRORS = 20
+
+# --- чтение ---
+
+def _iter_json_array(f, chunk_size: int = 65536):
+    """
+    Потоковый разбор JSON-массива объектов без загрузки всего файла.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    started = False
+    while True:
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("JSON-файл должен содержать массив объектов")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            yield obj
+        buf = buf[pos:]
+        if eof:
+            raise ValueError("JSON-массив не закрыт")
+
+def iter_records(path: str):
+    """
+    Отдаёт (номер записи, словарь) по одной записи за раз.
+    """
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".csv"):
+            yield from enumerate(csv.DictReader(f), 2)
+        elif path.endswith(".jsonl"):
+            for num, line in enumerate(f, 1):
+                if line.strip():
+                    yield num, json.loads(line)
+        elif path.endswith(".json"):
+            yield from enumerate(_iter_json_array(f), 1)
+        else:
+            raise ValueError(f"Неизвестный формат файла: {path}")
+
+def _field(record: dict, name: str) -> str:
+    value = record.get(name)
+    return "" if value is None else str(value).strip()
+
+def validate_record(record: dict):
+    """
+    Проверяет запись и приводит её к (класс, день, номер урока, предмет, кабинет, время начала).
+    """
+    class_name = _field(record, "class").upper()
+    if not CLASS_RE.match(class_name):
+        raise ValueError(f"некорректный класс '{class_name}'")
+
+    day = _field(record, "day").lower()
+    if day.isdigit() and int(day) < len(DAYS):
+        day = int(day)
+    elif day in DAYS:
+        day = DAYS.index(day)
+    elif day in DAY_NAMES:
+        day = DAY_NAMES.index(day)
+    else:
+        raise ValueError(f"некорректный день '{day}'")
+
+    try:
+        lesson = int(record.get("lesson"))
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректный номер урока '{record.get('lesson')}'")
+    if not 1 <= lesson <= 12:
+        raise ValueError(f"номер урока вне диапазона: {lesson}")
+
+    subject = _field(record, "subject")
+    if not subject:
+        raise ValueError("не указан предмет")
+    room = _field(record, "room")
+
+    start_time = _field(record, "start_time") or timetable.default_start_time(lesson)
+    if start_time and not TIME_RE.match(start_time):
+        raise ValueError(f"некорректное время '{start_time}'")
+    return class_name, day, lesson, subject, room, start_time
+
+# --- импорт ---
+
+async def _flush(batch, cleared_slots):
+    """
+    Одна транзакция на пачку: для впервые встреченных (класс, день) старые уроки удаляются,
+    затем строки вставляются с обновлением при совпадении номера урока.
+    Повторы одного урока внутри пачки схлопываются до последней строки: ON CONFLICT
+    в Postgres не может изменить одну строку дважды за запрос.
+    """
+    now = datetime.datetime.utcnow()
+    batch = list({row[:3]: row for row in batch}.values())
+    async with AsyncSessionLocal() as session:
+        new_slots = {(row[0], row[1]) for row in batch} - cleared_slots
+        for class_name, day in new_slots:
+            await session.execute(
+                delete(Schedule).where(Schedule.class_name == class_name, Schedule.day_of_week == day)
+            )
+        stmt = dialect_insert(Schedule).values([
+            {"class_name": c, "day_of_week": d, "lesson_number": n, "lesson_name": s,
+             "room": r, "start_time": t, "updated_at": now}
+            for c, d, n, s, r, t in batch
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["class_name", "day_of_week", "lesson_number"],
+            set_={"lesson_name": stmt.excluded.lesson_name, "room": stmt.excluded.room,
+                  "start_time": stmt.excluded.start_time, "updated_at": now}
+        )
+        await session.execute(stmt)
+        await session.commit()
+        cleared_slots |= new_slots
+
+async def import_timetable(path: str, batch_size: int = 500, dry_run: bool = False):
+    started = time.perf_counter()
+    await init_db()
+    batch = []
+    affected = set()
+    ok = errors = 0
+    for num, record in iter_records(path):
+        try:
+            row = validate_record(record)
+        except ValueError as e:
+            errors += 1
+            if errors <= MAX_REPORTED_ERRORS:
+                print(f"Запись {num}: {e}", file=sys.stderr)
+            continue
+        ok += 1
+        if dry_run:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await _flush(batch, affected)
+            batch = []
+    if batch:
+        await _flush(batch, affected)
+
+    rendered = 0
+    if affected:
+        # Перерисовываем только изменённые карточки; бот подхватит их по хэшу содержимого
+        await timetable.reload(force=True)
+        index = timetable.get_index()
+        jobs = [
+            schedule_gen.render_schedule_image(class_name, day, index.items(class_name, day))
+            for class_name, day in affected
+            if index.items(class_name, day)
+        ]
+        await asyncio.gather(*jobs)
+        rendered = len(jobs)
+
+    mode = " (проверка, без записи)" if dry_run else ""
+    print(f"Импорт{mode}: {ok} строк, {errors} ошибок, {len(affected)} дней классов обновлено, "
+          f"{rendered} карточек перерисовано за {time.perf_counter() - started:.2f} с")
+    return ok, errors
+
+# --- экспорт ---
+
+async def export_timetable(path: str):
+    started = time.perf_counter()
+    await init_db()
+    count = 0
+    query = (
+        select(Schedule.class_name, Schedule.day_of_week, Schedule.lesson_number,
+               Schedule.lesson_name, Schedule.room, Schedule.start_time)
+        .where(Schedule.class_name.isnot(None))
+        .order_by(Schedule.class_name, Schedule.day_of_week, Schedule.lesson_number)
+        .execution_options(yield_per=500)
+    )
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if path.endswith(".csv") else None
+        if writer:
+            writer.writerow(FIELDS)
+        elif path.endswith(".json"):
+            f.write("[\n")
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query)
+            async for row in result:
+                if writer:
+                    writer.writerow(row)
+                else:
+                    line = json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False)
+                    if path.endswith(".json"):
+                        line = ("  " if count == 0 else ",\n  ") + line
+                    else:
+                        line += "\n"
+                    f.write(line)
+                count += 1
+        if path.endswith(".json"):
+            f.write("\n]\n")
+    print(f"Экспорт: {count} строк в {path} за {time.perf_counter() - started:.2f} с")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт и экспорт расписания")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="загрузить расписание из CSV/JSON/JSONL")
+    imp.add_argument("path")
+    imp.add_argument("--batch", type=int, default=500, help="строк в одной транзакции")
+    imp.add_argument("--dry-run", action="store_true", help="только проверить файл")
+    exp = sub.add_parser("export", help="выгрузить расписание в CSV/JSON/JSONL")
+    exp.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        _, errors = asyncio.run(import_timetable(args.path, args.batch, args.dry_run))
+        sys.exit(1 if errors else 0)
+    asyncio.run(export_timetable(args.path))
+
+if __name__ == "__main__":
+    main()
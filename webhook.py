@@ -0,0 +1,240 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+from collections import deque
+
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+logger = logging.getLogger(__name__)
+
+# Настройки режима вебхука (можно переопределить через .env)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+# Несколько процессов: router принимает вебхук и раскладывает апдейты по WORKER_URLS,
+# каждый worker обрабатывает свою долю чатов
+WORKER_URLS = [url.strip() for url in os.getenv("WORKER_URLS", "").split(",") if url.strip()]
+FORWARD_RETRIES = int(os.getenv("FORWARD_RETRIES", "5"))
+
+def update_chat_id(update: dict):
+    """
+    Чат, к которому относится апдейт (для callback — чат сообщения с кнопкой).
+    """
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return None
+
+class UpdateProcessor:
+    """
+    Ограниченная очередь апдейтов и фиксированный пул обработчиков.
+    Если очередь полна, вебхук отвечает 503 и Telegram сам повторит доставку позже,
+    поэтому всплеск апдейтов не раздувает память.
+
+    Апдейты одного чата обрабатываются строго по очереди, разные чаты — параллельно:
+    пока чат занят, его новые апдейты ждут в его собственной очереди и не занимают обработчики.
+    handler — корутина, получающая сырой апдейт (по умолчанию dp.feed_raw_update).
+    """
+
+    def __init__(self, dp, bot, queue_size: int = UPDATE_QUEUE_SIZE, workers: int = UPDATE_WORKERS, handler=None):
+        self.dp = dp
+        self.bot = bot
+        self.handler = handler or (lambda update: dp.feed_raw_update(bot, update))
+        self.queue_size = queue_size
+        self.workers_count = workers
+        self.ready = asyncio.Queue()  # чаты, у которых есть апдейт и никто его не обрабатывает
+        self.pending = {}  # чат -> deque апдейтов; первый — обрабатываемый сейчас
+        self.size = 0
+        self.accepting = False
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self._workers = []
+
+    def start(self):
+        self.accepting = True
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    def submit(self, update: dict) -> bool:
+        if not self.accepting:
+            return False
+        if self.size >= self.queue_size:
+            self.rejected += 1
+            return False
+        chat_id = update_chat_id(update)
+        key = chat_id if chat_id is not None else ("update", update.get("update_id"))
+        self.size += 1
+        if key in self.pending:
+            self.pending[key].append(update)
+        else:
+            self.pending[key] = deque([update])
+            self.ready.put_nowait(key)
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            lane = self.pending[key]
+            update = lane[0]
+            self.in_flight += 1
+            try:
+                await self.handler(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.get('update_id')}: {e}")
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                self.size -= 1
+                lane.popleft()
+                if lane:
+                    self.ready.put_nowait(key)
+                else:
+                    del self.pending[key]
+                self.ready.task_done()
+
+    async def drain(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """
+        Перестаёт принимать апдейты и ждёт, пока обработаются уже принятые.
+        """
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.ready.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown timeout: {self.size} updates dropped ({self.in_flight} in flight)")
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "accepting": self.accepting,
+            "queued": self.size - self.in_flight,
+            "in_flight": self.in_flight,
+            "chats": len(self.pending),
+            "processed": self.processed,
+            "rejected": self.rejected,
+        }
+
+class ShardForwarder:
+    """
+    Пересылает апдейт процессу-обработчику, выбранному по id чата: чат всегда попадает
+    в один и тот же процесс, поэтому порядок его апдейтов и локальные кэши сохраняются.
+    Используется как handler для UpdateProcessor, который уже держит порядок внутри чата.
+    """
+
+    def __init__(self, worker_urls, secret: str = WEBHOOK_SECRET, retries: int = FORWARD_RETRIES):
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.retries = retries
+        self.session = None
+
+    def shard(self, update: dict) -> str:
+        chat_id = update_chat_id(update)
+        key = chat_id if chat_id is not None else update.get("update_id", 0)
+        return self.worker_urls[key % len(self.worker_urls)]
+
+    async def __call__(self, update: dict):
+        if self.session is None:
+            self.session = ClientSession(timeout=ClientTimeout(total=10))
+        url = self.shard(update)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.post(url, json=update, headers=headers) as resp:
+                    if resp.status == 200:
+                        return
+                    error = f"HTTP {resp.status}"
+            except (ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            # Обработчик перегружен или перезапускается — ждём, не нарушая порядок чата
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 10))
+        raise RuntimeError(f"worker {url} unavailable: {error}")
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+def create_app(processor: UpdateProcessor, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH):
+    async def handle_update(request: web.Request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not processor.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(request: web.Request):
+        status = 200 if processor.accepting else 503
+        return web.json_response(processor.stats(), status=status)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/health", health)
+    return app
+
+async def run_webhook(bot, dp, drop_pending_updates: bool = False, role: str = "webhook"):
+    """
+    Запускает приём апдейтов через вебхук и работает до SIGINT/SIGTERM.
+    role: webhook — один процесс принимает и обрабатывает апдейты;
+    router — принимает вебхук Telegram и пересылает апдейты в WORKER_URLS по id чата;
+    worker — обрабатывает апдейты от router, вебхук в Telegram не регистрирует.
+    При остановке сначала закрывает приём, затем дожидается обработки принятых апдейтов.
+    Вебхук в Telegram не удаляется: апдейты на время перезапуска копятся на стороне Telegram.
+    """
+    if not WEBHOOK_SECRET or (role != "worker" and not WEBHOOK_URL):
+        raise RuntimeError("Для режима вебхука нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    if role == "router" and not WORKER_URLS:
+        raise RuntimeError("Для BOT_MODE=router нужен WORKER_URLS")
+
+    forwarder = ShardForwarder(WORKER_URLS) if role == "router" else None
+    processor = UpdateProcessor(dp, bot, handler=forwarder)
+    runner = web.AppRunner(create_app(processor))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    processor.start()
+
+    if role != "worker":
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=drop_pending_updates
+        )
+    logger.info(f"Webhook server ({role}) listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Shutting down webhook server...")
+        await processor.drain()
+        await runner.cleanup()
+        if forwarder:
+            await forwarder.close()
+        logger.info(f"Webhook server stopped: {processor.stats()}")